@@ -1,6 +1,22 @@
+import os
+
 # EEG bins in Hz + MUA bins
 default_bins = [(1, 4), (4, 8), (8, 13), (13, 30), (30, 90), (90, 200),
                 (300, 500)]
 
 grid_size = 500
 img_size = int(0.7 * grid_size)
+
+# Directory for the fast-reopen cache of imported recordings
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "mea-analysis")
+# Upper bound for the size of the cache, the least recently opened recordings
+# are evicted first, see controllers/io/cache.py::evict_cached
+cache_max_bytes = 100 * 1024**3
+
+# Directory for the data of recordings that are stored on disk instead of
+# shared memory, see model/data.py::MemmapArray
+spill_dir = os.path.join(cache_dir, "spill")
+
+# Number of threads that filter blocks of channels concurrently, see
+# controllers/analysis/filter.py::map_channel_blocks
+filter_workers = os.cpu_count() or 1
@@ -1,16 +1,29 @@
 import numpy as np
-import pandas as pd
-import scipy.signal as sg
 from tqdm import tqdm
 import pdb
 
-from model.data import Recording, SharedArray
+from model.data import RaggedArray, Recording, ResultTable
 from constants import default_bins
+from lazy_import import lazy_import
 from controllers.analysis.analyze import compute_entropies_jit
 from controllers.analysis.spectral import bin_powers, compute_spectrograms
 
+sg = lazy_import("scipy.signal")
 
-def compute_derivatives_jit(data: np.ndarray, fs: int) -> np.ndarray:
+# columns of the peak table besides the channel, see detect_peaks
+PEAK_COLUMNS = ["PeakIndex", "TimeStamp", "RelAmplitude", "StartIndex",
+                "StopIndex", "Duration[s]", "InterPeakInterval[s]"]
+# columns of the event table besides the channel and the band powers, see
+# detect_events
+EVENT_COLUMNS = ["StartIndex", "StopIndex", "Duration [s]",
+                 "ApproximateEntropy", "#Peaks", "MeanInterPeakInterval[s]",
+                 "InterEventInterval[s]"]
+
+
+def compute_derivatives_jit(data: np.ndarray,
+                            fs: int,
+                            out: np.ndarray = None
+                            ) -> np.ndarray:
     """
     Compute the first derivative of the signals using numbas
     just-in-time compiler.
@@ -18,13 +31,25 @@ def compute_derivatives_jit(data: np.ndarray, fs: int) -> np.ndarray:
     :param data: numpy array to calculate the first derivative from
     :type data: np.ndarray
 
+    :param out: array of shape (data.shape[0], data.shape[1] - 1) to write
+        the result to, e.g. a pooled shared buffer. Allocated if None.
+    :type out: np.ndarray
+
     :return: first derivative of the array
     :rtype: np.ndarray
     """
-    return np.diff(data) * fs
+    # keep the precision of the data, e.g. float32
+    out = np.subtract(data[:, 1:], data[:, :-1], out=out)
+    out *= out.dtype.type(fs)
+
+    return out
 
 
-def moving_avg(sig: np.ndarray, w: int, fs: int = None) -> np.ndarray:
+def moving_avg(sig: np.ndarray,
+               w: int,
+               fs: int = None,
+               out: np.ndarray = None
+               ) -> np.ndarray:
     """
     Compute the moving average of the signals.
 
@@ -34,6 +59,10 @@ def moving_avg(sig: np.ndarray, w: int, fs: int = None) -> np.ndarray:
     :param w: window size
     :type w: int
 
+    :param out: array of the shape of sig to write the result to, e.g. a
+        pooled shared buffer. Allocated if None.
+    :type out: np.ndarray
+
     :return: moving average of the array
     :rtype: np.ndarray
     """
@@ -46,10 +75,15 @@ def moving_avg(sig: np.ndarray, w: int, fs: int = None) -> np.ndarray:
 
     pad = int((w - 1) / 2)
     padded = np.pad(sig, ((0, 0), (pad, pad)), "reflect")
-    ret = np.cumsum(padded, axis=-1)
+    # accumulate in float64 even for float32 signals, as the differences of
+    # large cumulative sums lose all significant digits in float32
+    ret = np.cumsum(padded, axis=-1, dtype=np.float64)
     ret[:, w:] = ret[:, w:] - ret[:, :-w]
 
-    return ret[:, w - 1:] / w
+    if out is None:
+        out = np.empty(sig.shape, dtype=sig.dtype)
+
+    return np.divide(ret[:, w - 1:], w, out=out, casting="same_kind")
 
 
 def envelopes(s: np.ndarray,
@@ -91,6 +125,42 @@ def envelopes(s: np.ndarray,
     return lmin, lmax
 
 
+def result_table(rows: list[tuple[int, dict[str, np.ndarray]]],
+                 names: np.ndarray,
+                 columns: list[str],
+                 sort_by: str = None
+                 ) -> ResultTable:
+    """
+    Concatenates the columns of the results of each channel into a table in
+    shared memory, see model/data.py::ResultTable.
+
+    :param rows: the channel index and the columns of its results, for each
+        channel with results
+    :type rows: list[tuple[int, dict[str, np.ndarray]]]
+
+    :param names: the names of the selected channels
+    :type names: np.ndarray
+
+    :param columns: the names of the columns, in order
+    :type columns: list[str]
+
+    :param sort_by: column to sort the results of each channel by, if they
+        are not sorted already
+    :type sort_by: str
+
+    :return: the table sorted by channel
+    :rtype: ResultTable
+    """
+    channels = [np.full(len(cols[columns[0]]), i) for i, cols in rows]
+    table = {name: np.concatenate([cols[name] for _, cols in rows])
+             if len(rows) > 0 else np.empty(0) for name in columns}
+
+    return ResultTable(table,
+                       np.concatenate(channels) if len(rows) > 0
+                       else np.empty(0, dtype=np.int32),
+                       names, sort_by)
+
+
 def compute_derivatives(rec: Recording):
     """
     Compute the first derivative of the signals.
@@ -98,10 +168,16 @@ def compute_derivatives(rec: Recording):
     :param rec: the recording object
     :type rec: Recording
     """
-    data = rec.get_data()
-    rec.derivatives = SharedArray(
-            compute_derivatives_jit(data, rec.sampling_rate)
-                                 )
+    def compute():
+        n_rows, n_samples = rec.data.shape
+        derivatives = rec.allocate((n_rows, n_samples - 1))
+        # ADC counts are scaled block-wise, see model/data.py::Recording
+        for rows, block in rec.iter_channel_blocks():
+            compute_derivatives_jit(block, rec.sampling_rate,
+                                    out=derivatives.read()[rows])
+        return derivatives
+
+    rec.derivatives = rec.derived("derivatives", (), compute)
 
 
 def compute_mv_avgs(rec: Recording, w: int = None):
@@ -119,8 +195,13 @@ def compute_mv_avgs(rec: Recording, w: int = None):
     :return: moving average of the array
     :rtype: np.ndarray
     """
-    data = rec.get_data()
-    rec.mv_avgs = SharedArray(moving_avg(data, w))
+    def compute():
+        mv_avgs = rec.allocate(rec.data.shape)
+        for rows, block in rec.iter_channel_blocks():
+            moving_avg(block, w, out=mv_avgs.read()[rows])
+        return mv_avgs
+
+    rec.mv_avgs = rec.derived("mv_avgs", (w,), compute)
 
 
 def compute_mv_mads(rec: Recording, w: int = None):
@@ -144,9 +225,16 @@ def compute_mv_mads(rec: Recording, w: int = None):
     :return: moving MAD of the array
     :rtype: np.ndarray
     """
-    sigs = rec.get_data()
-    abs_dev = np.absolute(sigs.T - np.mean(sigs, axis=-1)).T
-    rec.mv_mads = SharedArray(moving_avg(abs_dev, w))
+    def compute():
+        mv_mads = rec.allocate(rec.data.shape)
+        for rows, sigs in rec.iter_channel_blocks():
+            means = np.mean(sigs, axis=-1, dtype=np.float64, keepdims=True)
+            abs_dev = np.absolute(sigs - means.astype(sigs.dtype))
+            moving_avg(abs_dev, w, out=mv_mads.read()[rows])
+        return mv_mads
+
+    # cached, such that tuning the thresholds does not recompute it
+    rec.mv_mads = rec.derived("mv_mads", (w,), compute)
 
 
 def compute_envelopes(rec: Recording, win: int = 100):
@@ -156,14 +244,19 @@ def compute_envelopes(rec: Recording, win: int = 100):
     :param rec: the recording object
     :type rec: Recording
     """
-    data = rec.get_data()
-    # tuple of lists containing ndarrays.
-    #  shared lists do not support ndarrays.
-    # Also with a reasonable window size, the lists should not be too large
+    # tuple of ragged arrays with one row of indices per channel, kept in
+    # shared memory such that plot processes attach to them by name.
     # e.g. for 0.1s window size, 1kHz sampling rate, and a duration of 120 s
-    # the lists will contain 1200 elements * number of selected channels.
-    # For 10 selected channels, this is 12000 elements * 4 bytes = 48 kB.
-    rec.envelopes = envelopes(data, win)
+    # the rows contain 1200 elements * number of selected channels.
+    def compute():
+        lmin, lmax = [], []
+        for _, block in rec.iter_channel_blocks():
+            block_min, block_max = envelopes(block, win)
+            lmin.extend(block_min)
+            lmax.extend(block_max)
+        return RaggedArray(lmin), RaggedArray(lmax)
+
+    rec.envelopes = rec.derived("envelopes", (win,), compute)
 
 def detect_peaks(rec: Recording,
                      mad_win: float = None,
@@ -215,15 +308,17 @@ def detect_peaks(rec: Recording,
     win = int(np.round(env_win * fs))
     compute_envelopes(rec, win)
 
-    data = rec.get_data()
-    n_peaks = np.zeros(data.shape[0])
-    peaks_freq = np.zeros(data.shape[0])
+    # a single channel is scaled at a time, see model/data.py::Recording
+    n_rows = rec.data.shape[0]
+    n_peaks = np.zeros(n_rows)
+    peaks_freq = np.zeros(n_rows)
 
-    lower = np.zeros(data.shape[0])
-    upper = np.zeros(data.shape[0])
+    lower = np.zeros(n_rows)
+    upper = np.zeros(n_rows)
     # we'll write concurrently to the list and sort it afterwards
     rows = []
-    for i in tqdm(range(data.shape[0])):  # prange
+    for i in tqdm(range(n_rows)):  # prange
+        sig = rec.get_block(slice(i, i + 1))[0]
         peaks = []
         peak_durations = []
         starts = []
@@ -235,22 +330,22 @@ def detect_peaks(rec: Recording,
         # user, as well as the percentile.
         min_env = rec.envelopes[0][i]
         max_env = rec.envelopes[1][i]
-        lower[i] = env_thrsh_f * np.percentile(data[i][min_env],
+        lower[i] = env_thrsh_f * np.percentile(sig[min_env],
                                                (100 - env_percentile))
-        upper[i] = env_thrsh_f * np.percentile(data[i][max_env],
+        upper[i] = env_thrsh_f * np.percentile(sig[max_env],
                                                env_percentile)
 
-        up_peaks, up_props = sg.find_peaks(data[i],
+        up_peaks, up_props = sg.find_peaks(sig,
                                            height=upper[i],
                                            prominence=upper[i])
 
-        up_widths = sg.peak_widths(data[i], up_peaks, rel_height=1)
+        up_widths = sg.peak_widths(sig, up_peaks, rel_height=1)
 
-        down_peaks, down_props = sg.find_peaks(-data[i],
+        down_peaks, down_props = sg.find_peaks(-sig,
                                                height=-lower[i],
                                                prominence=-lower[i])
 
-        down_widths = sg.peak_widths(-data[i], down_peaks, 1)
+        down_widths = sg.peak_widths(-sig, down_peaks, 1)
 
         peaks = np.concatenate((up_peaks, down_peaks))
 
@@ -271,36 +366,31 @@ def detect_peaks(rec: Recording,
         peak_durations = np.concatenate((up_widths[0], down_widths[0]))
         peak_durations = peak_durations[order] / fs
 
-        peak_ampls = data[i][peaks] / np.abs(data[i][peaks]).max()
+        peak_ampls = sig[peaks] / np.abs(sig[peaks]).max()
 
         n_peaks[i] = peaks.shape[0]
         peaks_freq[i] = n_peaks[i] / fs / 1000000
 
-        channel = np.repeat(names[i], len(peaks))
-
         ipi = np.diff(peaks) / fs
         if peaks.shape[0] > 0:
             ipi = np.hstack((np.array([np.nan]), ipi))
 
-        channel_peaks = pd.DataFrame(
-                {"Channel": channel,
-                 "PeakIndex": peaks,
-                 "TimeStamp": peak_times,
-                 "RelAmplitude": peak_ampls,
-                 "StartIndex": starts,
-                 "StopIndex": stops,
-                 "Duration[s]": peak_durations,
-                 "InterPeakInterval[s]": ipi}
-                )
-        rows.append(channel_peaks)
+        rows.append((i, {"PeakIndex": peaks,
+                         "TimeStamp": peak_times,
+                         "RelAmplitude": peak_ampls,
+                         "StartIndex": starts,
+                         "StopIndex": stops,
+                         "Duration[s]": peak_durations,
+                         "InterPeakInterval[s]": ipi}))
 
     rec.lower = lower
     rec.upper = upper
 
-    # concatenate the list of data frames into one data frame,
-    # sort it by channel and peak index and attach it to the recording object
-    rec.peaks_df = pd.concat(rows)
-    rec.peaks_df.sort_values(by=["Channel", "PeakIndex"], inplace=True)
+    # the channels are in order and the peaks of each sorted already, so the
+    # columns are just concatenated. The peak indices per channel share the
+    # memory of the table.
+    rec.peak_table = result_table(rows, names, PEAK_COLUMNS)
+    rec.peaks = rec.peak_table.ragged("PeakIndex")
     rec.channels_df['n_peaks'] = n_peaks
     rec.channels_df['peak_freq'] = peaks_freq
 
@@ -359,31 +449,34 @@ def detect_peaks_alt(rec: Recording,
     # Compute moving mean absolute deviation of the signals, used to detect
     # peaks as the moving MAD is smoother than the signal itself and increases
     # strongly when the siginal is peaking or bursting.
-    win = int(np.round(mad_win * fs))
-    compute_mv_mads(rec, win)
+    mad_w = int(np.round(mad_win * fs))
+    compute_mv_mads(rec, mad_w)
 
     # compute the envelope of the MAD to estimate the noise threshold of
     # the moving MAD signal. Attach it to the recording object to be able to
     # plot it later, when tuning the parameters.
     win = int(np.round(env_win * fs))
     mv_mads = rec.mv_mads.read()
-    _, mad_env = envelopes(mv_mads, win)
+    mad_env = rec.derived("mad_env", (mad_w, win),
+                          lambda: RaggedArray(envelopes(mv_mads, win)[1]))
     rec.mad_env = mad_env
 
     # compute the envelope of the sigal to later estimate the noise levels
     # per channel
     compute_envelopes(rec, win)
 
-    data = rec.get_data()
-    n_peaks = np.zeros(data.shape[0])
-    peaks_freq = np.zeros(data.shape[0])
+    # a single channel is scaled at a time, see model/data.py::Recording
+    n_rows, n_samples = rec.data.shape
+    n_peaks = np.zeros(n_rows)
+    peaks_freq = np.zeros(n_rows)
 
-    lower = np.zeros(data.shape[0])
-    upper = np.zeros(data.shape[0])
-    mad_thresh = np.zeros(data.shape[0])
+    lower = np.zeros(n_rows)
+    upper = np.zeros(n_rows)
+    mad_thresh = np.zeros(n_rows)
     # we'll write concurrently to the list and sort it afterwards
     rows = []
-    for i in tqdm(range(data.shape[0])):  # prange
+    for i in tqdm(range(n_rows)):  # prange
+        sig = rec.get_block(slice(i, i + 1))[0]
         peaks = []
         peak_durations = []
         starts = []
@@ -402,9 +495,9 @@ def detect_peaks_alt(rec: Recording,
         # user, as well as the percentile.
         min_env = rec.envelopes[0][i]
         max_env = rec.envelopes[1][i]
-        lower[i] = env_thrsh_f * np.percentile(data[i][min_env],
+        lower[i] = env_thrsh_f * np.percentile(sig[min_env],
                                                (100 - env_percentile))
-        upper[i] = env_thrsh_f * np.percentile(data[i][max_env],
+        upper[i] = env_thrsh_f * np.percentile(sig[max_env],
                                                env_percentile)
 
         # we have a peak/burst, if the mad is above the respective threshold
@@ -416,18 +509,18 @@ def detect_peaks_alt(rec: Recording,
         # and convert it to an array of tuples of the form (start, stop)
         above_thresh_idxs = np.where(abs_diff == 1)[0].reshape(-1, 2)
         for (start, stop) in above_thresh_idxs:
-            if any(data[i][start:stop] > upper[i]):
-                peaks.append(np.argmax(data[i][start:stop]) + start)
+            if any(sig[start:stop] > upper[i]):
+                peaks.append(np.argmax(sig[start:stop]) + start)
                 # find actual boundaries, as the current ones are based on a
                 # a moving quantity with relatively large window size
                 p_start = start
                 p_stop = stop
                 for t in range(peaks[-1], 0):
-                    if data[i][t] < upper[i]:
+                    if sig[t] < upper[i]:
                         p_start = t
                         break
-                for t in range(peaks[-1], data.shape[1]):
-                    if data[i][t] < upper[i]:
+                for t in range(peaks[-1], n_samples):
+                    if sig[t] < upper[i]:
                         p_stop = t
                         break
 
@@ -435,17 +528,17 @@ def detect_peaks_alt(rec: Recording,
                 starts.append(p_start)
                 stops.append(p_stop)
 
-            if any(data[i][start:stop] < lower[i]):
-                peaks.append(np.argmin(data[i][start:stop]) + start)
+            if any(sig[start:stop] < lower[i]):
+                peaks.append(np.argmin(sig[start:stop]) + start)
 
                 p_start = start
                 p_stop = stop
                 for t in range(peaks[-1], 0):
-                    if data[i][t] > lower[i]:
+                    if sig[t] > lower[i]:
                         p_start = t
                         break
-                for t in range(peaks[-1], data.shape[1]):
-                    if data[i][t] < lower[i]:
+                for t in range(peaks[-1], n_samples):
+                    if sig[t] < lower[i]:
                         p_stop = t
                         break
 
@@ -460,34 +553,30 @@ def detect_peaks_alt(rec: Recording,
 
         peaks_freq[i] = n_peaks[i] / fs / 1000000
 
-        peak_ampls = data[i][peaks] / np.abs(data[i][peaks]).max()
-        channel = np.repeat(names[i], len(peaks))
+        peak_ampls = sig[peaks] / np.abs(sig[peaks]).max()
         peak_times = peaks / fs
 
         ipi = np.diff(peaks) / fs
         if peaks.shape[0] > 0:
             ipi = np.hstack((np.array([np.nan]), ipi))
 
-        channel_peaks = pd.DataFrame(
-                {"Channel": channel,
-                 "PeakIndex": peaks,
-                 "TimeStamp": peak_times,
-                 "RelAmplitude": peak_ampls,
-                 "StartIndex": starts,
-                 "StopIndex": stops,
-                 "Duration[s]": peak_durations,
-                 "InterPeakInterval[s]": ipi}
-                )
-        rows.append(channel_peaks)
+        rows.append((i, {"PeakIndex": peaks,
+                         "TimeStamp": peak_times,
+                         "RelAmplitude": peak_ampls,
+                         "StartIndex": np.array(starts, dtype=int),
+                         "StopIndex": np.array(stops, dtype=int),
+                         "Duration[s]": peak_durations,
+                         "InterPeakInterval[s]": ipi}))
 
     rec.lower = lower
     rec.upper = upper
     rec.mad_thresh = mad_thresh
 
-    # concatenate the list of data frames into one data frame,
-    # sort it by channel and peak index and attach it to the recording object
-    rec.peaks_df = pd.concat(rows)
-    rec.peaks_df.sort_values(by=["Channel", "PeakIndex"], inplace=True)
+    # sort the peaks of each channel by index, the peak indices per channel
+    # share the memory of the table
+    rec.peak_table = result_table(rows, names, PEAK_COLUMNS,
+                                  sort_by="PeakIndex")
+    rec.peaks = rec.peak_table.ragged("PeakIndex")
     rec.channels_df['n_peaks'] = n_peaks
     rec.channels_df['peak_freq'] = peaks_freq
 
@@ -527,7 +616,7 @@ def detect_events(rec: Recording,
     if mad_thrsh_f is None:
         mad_thrsh_f = 1.5
 
-    if rec.peaks_df is None:
+    if rec.peaks is None:
         detect_peaks(rec)
 
     if rec.spectrograms is None:
@@ -547,14 +636,20 @@ def detect_events(rec: Recording,
     # the moving MAD signal. Attach it to the recording object to be able to
     # plot it later, when tuning the parameters.
     mv_mads = rec.mv_mads.read()
-    _, mad_env = envelopes(mv_mads, win)
+    mad_env = rec.derived("mad_env", (win, win),
+                          lambda: RaggedArray(envelopes(mv_mads, win)[1]))
     rec.mad_env = mad_env
 
-    data = rec.get_data()
-    mad_thresh = np.zeros(data.shape[0])
+    # a single channel is scaled at a time, see model/data.py::Recording
+    n_rows = rec.data.shape[0]
+    mad_thresh = np.zeros(n_rows)
     # we'll write concurrently to the list and sort it afterwards
     rows = []
-    for i in tqdm(range(data.shape[0])):  # prange
+    for i in tqdm(range(n_rows)):  # prange
+        sig = rec.get_block(slice(i, i + 1))[0]
+        # sorted peak indices of the channel and their inter peak intervals
+        chan_peaks = rec.peaks[i]
+        chan_ipi = np.concatenate(([np.nan], np.diff(chan_peaks) / fs))
         durations = []
         starts = []
         stops = []
@@ -597,8 +692,8 @@ def detect_events(rec: Recording,
             e_start = above_thresh_idxs[j, 0]
             e_stop = above_thresh_idxs[j, 1]
             if ((e_stop - e_start < idx_len)
-                 or not any(data[i][e_start:e_stop] > rec.upper[i])
-                 or not any(data[i][e_start:e_stop] < rec.lower[i])):
+                 or not any(sig[e_start:e_stop] > rec.upper[i])
+                 or not any(sig[e_start:e_stop] < rec.lower[i])):
                 del_idxs.append(j)
                 
         above_thresh_idxs = np.delete(above_thresh_idxs, del_idxs, axis=0)
@@ -608,40 +703,38 @@ def detect_events(rec: Recording,
             starts.append(start)
             stops.append(stop)
             freqs.append(bin_powers(rec, i, (start, stop)))
-            n_peaks.append(rec.peaks_df[(rec.peaks_df['Channel'] == names[i])
-                                        & (rec.peaks_df['PeakIndex'] >= start)
-                                        & (rec.peaks_df['PeakIndex'] < stop)
-                                        ].shape[0]
-                           )
-            entropy = compute_entropies_jit(data[i][start:stop].reshape(1, -1))
+            # the peaks within the event
+            first, last = np.searchsorted(chan_peaks, [start, stop])
+            n_peaks.append(last - first)
+            entropy = compute_entropies_jit(sig[start:stop].reshape(1, -1))
             app_ens.append(entropy[0])
-            ipi.append(rec.peaks_df[(rec.peaks_df['Channel'] == names[i])
-                                    & (rec.peaks_df['PeakIndex'] >= start)
-                                    & (rec.peaks_df['PeakIndex'] < stop)
-                                    ]['InterPeakInterval[s]'].mean()
-                       )
-        iei = [start[i] - stop[i - 1] for i in range(1, len(starts))]
+            event_ipi = chan_ipi[first:last]
+            event_ipi = event_ipi[~np.isnan(event_ipi)]
+            ipi.append(event_ipi.mean() if event_ipi.shape[0] > 0
+                       else np.nan)
+        iei = [starts[i] - stops[i - 1] for i in range(1, len(starts))]
         if len(starts) > 0:
             iei.insert(0, np.nan)
         iei = np.array(iei) / fs
 
-        channel = np.repeat(names[i], len(durations))
-        channel_events = pd.DataFrame(
-                {"Channel": channel,
-                 "StartIndex": starts,
-                 "StopIndex": stops,
-                 "Duration [s]": durations,
-                 "ApproximateEntropy": app_ens,
-                 "#Peaks": n_peaks,
-                 "MeanInterPeakInterval[s]": ipi,
-                 "InterEventInterval[s]": iei,
-                 } | dict(zip(freq_bin_names, np.array(freqs).T))
-                )
-        rows.append(channel_events)
+        if len(starts) == 0:
+            continue
+
+        rows.append((i, {"StartIndex": np.array(starts, dtype=int),
+                         "StopIndex": np.array(stops, dtype=int),
+                         "Duration [s]": np.array(durations),
+                         "ApproximateEntropy": np.array(app_ens),
+                         "#Peaks": np.array(n_peaks, dtype=int),
+                         "MeanInterPeakInterval[s]": np.array(ipi),
+                         "InterEventInterval[s]": iei,
+                         } | dict(zip(freq_bin_names, np.array(freqs).T))))
 
     rec.event_mad_thresh = mad_thresh
 
-    # concatenate the list of data frames into one data frame,
-    # sort it by channel and peak index and attach it to the recording object
-    rec.events_df = pd.concat(rows)
+    # the events of each channel are in order already. The event bounds per
+    # channel share the memory of the table.
+    rec.event_table = result_table(rows, names,
+                                   EVENT_COLUMNS + freq_bin_names)
+    rec.events = (rec.event_table.ragged("StartIndex"),
+                  rec.event_table.ragged("StopIndex"))
 
@@ -1,9 +1,7 @@
 """
 TODO
 """
-import antropy as ant
 import numpy as np
-import numba as nb
 from tqdm import tqdm
 
 from model.data import Recording
@@ -38,12 +36,15 @@ def compute_snrs_jit(signals: np.ndarray) -> np.ndarray:
     return mean_squared / np.var(signals, axis=-1)
 
 
-@nb.jit(parallel=True)
 def compute_entropies_jit(data: np.ndarray) -> np.ndarray:
     """
-    Compute the approximate entropy of the signals using numbas
-    just-in-time compiler for loop parallelization. Antropys app_entropy
-    already uses numba under the hood.
+    Compute the approximate entropy of the signals. Antropys sample_entropy
+    already uses numbas just-in-time compiler under the hood. Importing
+    antropy compiles its functions, which takes several seconds, so it is
+    imported on first use.
+    The loop is not compiled with numba: numba can not type antropy or tqdm,
+    so nb.jit(parallel=True) raises a TypingError since numba 0.59 and fell
+    back to object mode before, which runs prange serially.
 
     :param data: numpy array to calculate approximate entropy from
     :type data: np.ndarray
@@ -51,10 +52,12 @@ def compute_entropies_jit(data: np.ndarray) -> np.ndarray:
     :return: approximate entropy of the array
     :rtype: np.ndarray
     """
+    import antropy as ant
+
     n_els = data.shape[0]
     entropies = np.zeros(n_els)
 
-    for i in tqdm(nb.prange(data.shape[0])):
+    for i in tqdm(range(data.shape[0])):
         entropies[i] = ant.sample_entropy(data[i])
 
     return entropies
@@ -68,7 +71,8 @@ def compute_snrs(rec: Recording):
     :param rec: Recording object containing signals to be processed
     :type rec: Recording
     """
-    rec.channels_df['SNR'] = compute_snrs_jit(rec.get_data())
+    rec.channels_df['SNR'] = np.concatenate(
+            [compute_snrs_jit(block) for _, block in rec.iter_channel_blocks()])
 
 
 def compute_rms(rec: Recording):
@@ -79,7 +83,8 @@ def compute_rms(rec: Recording):
     :param rec: Recording object containing signals to be processed
     :type rec: Recording
     """
-    rec.channels_df['RMS'] = compute_rms_jit(rec.get_data())
+    rec.channels_df['RMS'] = np.concatenate(
+            [compute_rms_jit(block) for _, block in rec.iter_channel_blocks()])
 
 
 def compute_entropies(rec: Recording):
@@ -90,7 +95,8 @@ def compute_entropies(rec: Recording):
     :param rec: Recording object containing signals to be processed
     :type rec: Recording
     """
-    entropies = compute_entropies_jit(rec.get_data())
+    entropies = np.concatenate([compute_entropies_jit(block)
+                                for _, block in rec.iter_channel_blocks()])
     rec.channels_df['ApproxEntropy'] = entropies
 
 
@@ -108,24 +114,26 @@ def bin_amplitude(rec: Recording, new_sr: int = 500) -> np.ndarray:
     :return: binned signals
     :rtype: np.ndarray
     """
-    signals = rec.get_data()
-    n_bins = new_sr / rec.sampling_rate * signals.shape[1]
-    bins = np.zeros((signals.shape[0], n_bins))
-
-    signal_idx = 0
-    bin_idx = 0
-    while signal_idx < signals.shape[1]:
-        t_int = 0
-        n_frames_in_bin = 0
-
-        while t_int < 1 / new_sr and signal_idx < signals.shape[1]:
-            bins[:, bin_idx] = bins[:, bin_idx] + signals[:, signal_idx]
-
-            t_int = t_int + 1 / rec.sampling_rate
-            signal_idx = signal_idx + 1
-            n_frames_in_bin = n_frames_in_bin + 1
-
-        bins[:, bin_idx] = bins[:, bin_idx] / n_frames_in_bin
-        bin_idx = bin_idx + 1
+    n_bins = new_sr / rec.sampling_rate * rec.data.shape[1]
+    bins = np.zeros((rec.data.shape[0], n_bins))
+
+    # ADC counts are scaled block-wise, see model/data.py::Recording
+    for rows, signals in rec.iter_channel_blocks():
+        signal_idx = 0
+        bin_idx = 0
+        while signal_idx < signals.shape[1]:
+            t_int = 0
+            n_frames_in_bin = 0
+
+            while t_int < 1 / new_sr and signal_idx < signals.shape[1]:
+                bins[rows, bin_idx] = bins[rows, bin_idx] \
+                        + signals[:, signal_idx]
+
+                t_int = t_int + 1 / rec.sampling_rate
+                signal_idx = signal_idx + 1
+                n_frames_in_bin = n_frames_in_bin + 1
+
+            bins[rows, bin_idx] = bins[rows, bin_idx] / n_frames_in_bin
+            bin_idx = bin_idx + 1
 
     return bins
@@ -1,31 +1,211 @@
 """
 TODO
 """
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Callable, Optional
 
 import numpy as np
-import scipy.signal as sg
 
-from model.data import Recording, SharedArray
+from constants import filter_workers
+from lazy_import import lazy_import
+from model.data import BLOCK_BYTES, Recording
 
+sg = lazy_import("scipy.signal")
 
-def frequency_filter(rec: Recording,
-                     stop: bool,
-                     low_cut: Optional[float],
-                     high_cut: Optional[float],
-                     order: Optional[int] = 16):
+# Minimal number of samples per time block of the streamed filters, see
+# sosfiltfilt_blocks. Recordings with many channels are split into blocks of
+# rows instead of shorter time blocks, as sosfilt has a per call overhead.
+MIN_BLOCK_LEN = 4096
+
+# Largest denominator of the ratio of the sampling rates when downsampling.
+# The polyphase filter has 20 * denominator + 1 taps, see
+# resample_poly_blocks.
+MAX_RESAMPLING_DENOMINATOR = 1000
+
+
+def channel_blocks(n_rows: int,
+                   row_bytes: int,
+                   workers: int,
+                   block_bytes: int = BLOCK_BYTES
+                   ) -> list[slice]:
     """
-    A general purpose digital filter for low-pass, high-pass and band-pass
-    filtering. Uses the scipy.signal.sosfilt method:
-    https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.sosfilt.html?highlight=filt%20filt#scipy.signal.sosfilt
+    Splits the rows of the data matrix into blocks that are filtered
+    concurrently, at least one per worker, such that the float64 copies of
+    the blocks that are filtered at the same time take at most block_bytes.
+    A block holds at least one row though, so if a row is larger than
+    block_bytes / workers, they take workers * row_bytes. Cap the workers
+    by concurrent_workers in that case.
 
-    Apply a digital filter forward and backward to a signal.
-    This function applies a linear digital filter twice, once forward and once
-    backwards. The combined filter has zero phase and a filter order twice that
-    of the original.
+    :param n_rows: The number of rows of the data matrix.
+    :type n_rows: int
+
+    :param row_bytes: The size of the float64 copy of a row of a block.
+    :type row_bytes: int
+
+    :param workers: The number of threads filtering blocks concurrently.
+    :type workers: int
+
+    :param block_bytes: The size of the blocks of all workers together.
+    :type block_bytes: int
+
+    :return: The blocks of rows.
+    :rtype: list[slice]
+    """
+    per_worker = -(-n_rows // workers)
+    block_rows = max(1, min(per_worker,
+                            block_bytes // workers // max(1, row_bytes)))
+
+    return [slice(start, min(start + block_rows, n_rows))
+            for start in range(0, n_rows, block_rows)]
+
+
+def concurrent_workers(row_bytes: int,
+                       workers: int,
+                       block_bytes: int = BLOCK_BYTES
+                       ) -> int:
+    """
+    Caps the number of threads processing copies of whole rows, such that
+    the copies of the rows that are processed at the same time take at most
+    block_bytes, but at least one row is processed.
+
+    :param row_bytes: The size of the float64 copy of a row.
+    :type row_bytes: int
+
+    :param workers: The number of threads to use at most.
+    :type workers: int
+
+    :param block_bytes: The size of the copies of all workers together.
+    :type block_bytes: int
+
+    :return: The number of threads.
+    :rtype: int
+    """
+    return max(1, min(workers, block_bytes // max(1, row_bytes)))
+
+
+def map_channel_blocks(func: Callable[[slice], None],
+                       blocks: list[slice],
+                       workers: int):
+    """
+    Calls func for every block of rows in a pool of threads. The filters of
+    scipy.signal release the GIL while filtering, so the blocks are filtered
+    in parallel and write into the shared data matrix without copies.
+    Exceptions raised by func are raised again.
+
+    :param func: The function filtering a block of rows.
+    :type func: Callable[[slice], None]
+
+    :param blocks: The blocks of rows, see channel_blocks.
+    :type blocks: list[slice]
+
+    :param workers: The number of threads.
+    :type workers: int
+    """
+    if workers == 1 or len(blocks) == 1:
+        for rows in blocks:
+            func(rows)
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(func, blocks))
 
-    :param rec: Input recording object whose signals to filter.
-    :type rec: Recording
+
+def filtfilt_padlen(sos: np.ndarray) -> int:
+    """
+    Computes the length of the odd extension at both ends of the signal that
+    sg.sosfiltfilt uses by default.
+
+    :param sos: Second-order sections of the filter.
+    :type sos: np.ndarray
+
+    :return: The number of samples the signal is extended by on each side.
+    :rtype: int
+    """
+    n_zeros = min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+
+    return 3 * (2 * len(sos) + 1 - n_zeros)
+
+
+def sosfiltfilt_blocks(sos: np.ndarray,
+                       data: np.ndarray,
+                       block_bytes: int = BLOCK_BYTES,
+                       workers: int = 1):
+    """
+    Applies a filter forward and backward to the rows of data in-place, i.e.
+    computes sg.sosfiltfilt(sos, data) with its default odd padding.
+    Instead of padding and filtering copies of the whole matrix, the data is
+    streamed in time blocks, first forward and then backward, carrying the
+    filter state from one block to the next. Only the padding, which is
+    computed from the first and the last samples, and the block being
+    filtered are held in float64. As sg.sosfilt returns a new array for
+    every block and a block has at least MIN_BLOCK_LEN samples per row, the
+    extra memory is about twice block_bytes, but at least
+    2 * workers * MIN_BLOCK_LEN * 8 bytes per row of a block.
+
+    The forward pass is written to data before the backward pass reads it,
+    so for float32 data the result is rounded once more than by
+    sg.sosfiltfilt, which is far below the precision of float32.
+
+    :param sos: Second-order sections of the filter.
+    :type sos: np.ndarray
+
+    :param data: 2D array to filter along the last axis, modified in-place.
+    :type data: np.ndarray
+
+    :param block_bytes: Size of the float64 blocks that are filtered at once.
+    :type block_bytes: int
+
+    :param workers: The number of threads filtering blocks of rows.
+    :type workers: int
+    """
+    n_rows, n_samples = data.shape
+    padlen = filtfilt_padlen(sos)
+    if n_samples <= padlen:
+        raise ValueError(f"The signal needs more than {padlen} samples for "
+                         "this filter.")
+
+    blocks = channel_blocks(n_rows, MIN_BLOCK_LEN * 8, workers, block_bytes)
+    block_rows = blocks[0].stop
+    block_len = max(MIN_BLOCK_LEN,
+                    block_bytes // workers // (block_rows * 8))
+    starts = range(0, n_samples, block_len)
+    # initial state for a step response, scaled by the first sample of the
+    # padded signal below
+    zi_step = sg.sosfilt_zi(sos)[:, np.newaxis, :]
+
+    def filter_rows(rows: slice):
+        x = data[rows]
+        first = x[:, :1].astype(np.float64)
+        left = 2 * first - x[:, padlen:0:-1]
+        # the original end of the signal is overwritten by the forward pass
+        end = x[:, -(padlen + 1):].astype(np.float64)
+        right = 2 * end[:, -1:] - end[:, -2::-1]
+
+        _, zi = sg.sosfilt(sos, left, zi=zi_step * left[:, :1])
+        for start in starts:
+            block = x[:, start:start + block_len]
+            block[:], zi = sg.sosfilt(sos, block, zi=zi)
+        right, _ = sg.sosfilt(sos, right, zi=zi)
+
+        _, zi = sg.sosfilt(sos, right[:, ::-1], zi=zi_step * right[:, -1:])
+        for start in reversed(starts):
+            block = x[:, start:start + block_len]
+            block[:, ::-1], zi = sg.sosfilt(sos, block[:, ::-1], zi=zi)
+
+    map_channel_blocks(filter_rows, blocks, workers)
+
+
+def frequency_sos(fs: float,
+                  stop: bool,
+                  low_cut: Optional[float],
+                  high_cut: Optional[float],
+                  order: Optional[int] = 16) -> tuple[np.ndarray, str]:
+    """
+    Designs the Butterworth filter of frequency_filter.
+
+    :param fs: The sampling rate in Hz.
+    :type fs: float
 
     :param stop: If True, a bandstop filter is used, therwise a bandpass.
     :type stop: bool
@@ -38,8 +218,10 @@ def frequency_filter(rec: Recording,
 
     :param order: Order of the filter.
     :type order: int
+
+    :return: The second-order sections and the type of the filter.
+    :rtype: tuple[np.ndarray, str]
     """
-    fs = rec.sampling_rate
     if low_cut == 0:
         low_cut = None
 
@@ -68,79 +250,308 @@ def frequency_filter(rec: Recording,
         sos = sg.butter(N=order, Wn=cut, btype=btype, fs=fs,
                         output='sos')
 
-    data = rec.get_data()
-    data[:] = sg.sosfiltfilt(sos, data)[:]
+    return sos, btype
+
+
+def frequency_filter(rec: Recording,
+                     stop: bool,
+                     low_cut: Optional[float],
+                     high_cut: Optional[float],
+                     order: Optional[int] = 16,
+                     workers: Optional[int] = None):
+    """
+    A general purpose digital filter for low-pass, high-pass and band-pass
+    filtering. Uses the scipy.signal.sosfilt method:
+    https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.sosfilt.html?highlight=filt%20filt#scipy.signal.sosfilt
+
+    Apply a digital filter forward and backward to a signal.
+    This function applies a linear digital filter twice, once forward and once
+    backwards. The combined filter has zero phase and a filter order twice that
+    of the original.
+
+    :param rec: Input recording object whose signals to filter.
+    :type rec: Recording
+
+    :param stop: If True, a bandstop filter is used, therwise a bandpass.
+    :type stop: bool
+
+    :param low_cut: Low-pass cutoff frequency in Hz.
+    :type low_cut: float
+
+    :param high_cut: High-pass cutoff frequency in Hz.
+    :type high_cut: float
+
+    :param order: Order of the filter.
+    :type order: int
+
+    :param workers: The number of threads filtering blocks of channels,
+                    defaults to constants.filter_workers.
+    :type workers: int
+    """
+    sos, btype = frequency_sos(rec.sampling_rate, stop, low_cut, high_cut,
+                               order)
+
+    # filter in-place, so ADC counts have to be scaled first
+    rec.snapshot(f"{btype} filter, order {order}")
+    rec.to_float()
+    # The filter state is kept in float64 also for float32 data, as the poles
+    # of high order or narrow filters are too close to the unit circle for
+    # float32.
+    sosfiltfilt_blocks(sos, rec.get_data(),
+                       workers=workers or filter_workers)
+    rec.data_changed()
 
 
-def downsample(rec: Recording, new_fs: int):
+def downsample(rec: Recording, new_fs: int, workers: Optional[int] = None):
     """
     Downsample the data to a new sampling rate. The new sampling rate must be
     smaller than the current sampling rate.
+    The ratio of the rates is approximated by a fraction up / down with a
+    denominator of at most MAX_RESAMPLING_DENOMINATOR and the data is
+    resampled in a single pass with a polyphase filter, see
+    resample_poly_blocks, directly into the smaller buffer.
 
     :param rec: The recording whichs signals to downsample.
     :type rec: Recording
 
     :param new_fs: The new sampling rate.
     :type new_fs: int
+
+    :param workers: The number of threads downsampling blocks of channels,
+                    defaults to constants.filter_workers.
+    :type workers: int
     """
-    q = int(np.round(rec.sampling_rate / new_fs))
-    rec.stop_idx = rec.stop_idx / q
-    q_it = 0
-
-    prev_data = rec.data
-    # determine if we can find a factor that is divisible by 12
-    # to downsample the signal without a residual
-    for i in range(12):
-        if q % (12 - i) == 0:
-            q_it = 12 - i
-            break
-
-    # if we didnt just use a factor of 10
-    if q_it == 0:
-        q_it = 10
-
-    downsampled = rec.get_data()
-    # As mentioned in the scipy docs, downsampling should be done iteratively
-    # if the downsampling factor is larger than 12
-    i = 0
-    while q > 13:
-        # On each iteration we downsample by a factor of q_it
-        # and count how often we do that.
-        downsampled = sg.decimate(downsampled, q_it)
-        q = int(np.round(q / q_it))
-        i += 1
-
-    # Adjust the sampling rate with what was downsampled already
-    rec.sampling_rate = rec.sampling_rate / q_it**i
-
-    q = int(np.floor(q))
-    # if the residual factor is at least 2, downsample by what's left
-    if q > 1:
-        downsampled = sg.decimate(downsampled, q)
-        rec.sampling_rate = int(np.round(rec.sampling_rate / q))
-
-    # if the residual factor is 1, we are done
+    up, down = resampling_ratio(rec.sampling_rate, new_fs)
+
+    rec.snapshot(f"downsampling to {new_fs} Hz")
+    rec.to_float()
+    n_rows, n_samples = rec.data.shape
+
     # replace the data in the recording object with the downsampled data
-    # as it is smaller in size i.e. replace the larger buffer by a smaller one
-    rec.data = SharedArray(downsampled)
-    # release the larger array from memory
-    prev_data.free()
+    # as it is smaller in size i.e. replace the larger buffer by a smaller one.
+    # Assigning it releases the larger array, see model/data.py::Recording
+    data = rec.allocate((n_rows, -(-n_samples * up // down)))
+    resample_poly_blocks(rec.get_data(), data.read(), up, down,
+                         workers=workers or filter_workers)
+    rec.data = data
+    resampled_indices(rec, up, down)
+    rec.data_changed()
+
+
+def resampling_ratio(fs: float, new_fs: float) -> tuple[int, int]:
+    """
+    Approximates the ratio of the sampling rates by a fraction with a
+    denominator of at most MAX_RESAMPLING_DENOMINATOR.
+
+    :param fs: The current sampling rate.
+    :type fs: float
+
+    :param new_fs: The new sampling rate, smaller than fs.
+    :type new_fs: float
+
+    :return: The coprime up- and downsampling factors.
+    :rtype: tuple[int, int]
+    """
+    ratio = Fraction(new_fs / fs).limit_denominator(
+            MAX_RESAMPLING_DENOMINATOR)
+    if not 0 < ratio < 1:
+        raise ValueError(f"Cannot downsample from {fs} Hz to {new_fs} Hz.")
+
+    return ratio.numerator, ratio.denominator
+
+
+def resampled_indices(rec: Recording, up: int, down: int):
+    """
+    Updates the sampling rate and the indices of the time window of the
+    recording after resampling by up / down.
+
+    :param rec: The resampled recording.
+    :type rec: Recording
+
+    :param up: The upsampling factor.
+    :type up: int
 
+    :param down: The downsampling factor.
+    :type down: int
+    """
+    # sample i is at the same time as sample i * up / down afterwards
+    rec.start_idx = rec.start_idx * up // down
+    rec.stop_idx = rec.stop_idx * up // down
+    rec.sampling_rate = rec.sampling_rate * up / down
+
+
+def resample_poly_blocks(data: np.ndarray,
+                         out: np.ndarray,
+                         up: int,
+                         down: int,
+                         block_bytes: int = BLOCK_BYTES,
+                         workers: int = 1):
+    """
+    Resamples the rows of data by the factor up / down into out, i.e.
+    computes sg.resample_poly(data, up, down, axis=1) with its default
+    Kaiser window and zero padding. The output is computed in time blocks,
+    each from the input samples that the polyphase filter covers for it, so
+    only the blocks being filtered are held in float64.
+
+    :param data: 2D array to resample along the last axis.
+    :type data: np.ndarray
+
+    :param out: 2D array of shape (rows, ceil(samples * up / down)).
+    :type out: np.ndarray
+
+    :param up: The upsampling factor, coprime to down.
+    :type up: int
+
+    :param down: The downsampling factor.
+    :type down: int
+
+    :param block_bytes: Size of the float64 blocks that are filtered at once.
+    :type block_bytes: int
+
+    :param workers: The number of threads resampling blocks of rows.
+    :type workers: int
+    """
+    n_rows, n_in = data.shape
+    n_out = out.shape[1]
+
+    # the filter of sg.resample_poly, delayed such that its center falls on
+    # an output sample
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = sg.firwin(2 * half_len + 1, 1 / max_rate, window=('kaiser', 5.0))
+    n_pre_pad = down - half_len % down
+    h = np.concatenate([np.zeros(n_pre_pad), h * up])
+    delay = (half_len + n_pre_pad) // down
+
+    blocks = channel_blocks(n_rows, MIN_BLOCK_LEN * 8, workers, block_bytes)
+    block_rows = blocks[0].stop
+    block_len = max(MIN_BLOCK_LEN,
+                    block_bytes // workers // (block_rows * 8))
+    out_len = max(1, block_len * up // down)
+
+    def resample_rows(rows: slice):
+        for start in range(0, n_out, out_len):
+            stop = min(start + out_len, n_out)
+            # out[k] = sum over i of data[i] * h[(k + delay) * down - i * up],
+            # the first input is rounded to a multiple of down, such that
+            # the outputs of upfirdn are aligned to the output samples
+            first = max(0, -(-((start + delay) * down - len(h) + 1) // up))
+            first -= first % down
+            last = min(n_in, (stop - 1 + delay) * down // up + 1)
+            resampled = sg.upfirdn(h, data[rows, first:last], up, down)
+
+            offset = start + delay - first * up // down
+            resampled = resampled[:, offset:offset + stop - start]
+            out[rows, start:start + resampled.shape[1]] = resampled
+            # the input ends before the filter, i.e. it is zero-padded
+            out[rows, start + resampled.shape[1]:stop] = 0
+
+    map_channel_blocks(resample_rows, blocks, workers)
+
+
+def line_noise_sos(fs: float,
+                   base_freq: float = 50,
+                   n_harmonics: int = 9,
+                   width: float = 3.0,
+                   method: str = "notch",
+                   order: int = 16) -> np.ndarray:
+    """
+    Designs a single cascade of second-order sections that removes the line
+    frequency and its harmonics. Harmonics above the Nyquist frequency are
+    skipped.
 
-def filter_line_noise(rec: Recording, order: Optional[int] = 16) -> None:
+    :param fs: The sampling rate in Hz.
+    :type fs: float
+
+    :param base_freq: The frequency of the power line, 50 or 60 Hz.
+    :type base_freq: float
+
+    :param n_harmonics: The number of multiples of base_freq to remove,
+                        including base_freq itself.
+    :type n_harmonics: int
+
+    :param width: The width of each stop band in Hz.
+    :type width: float
+
+    :param method: "notch" for a second order IIR notch per harmonic or
+                   "bandstop" for a Butterworth bandstop of the given order.
+    :type method: str
+
+    :param order: The order of the Butterworth bandstops.
+    :type order: int
+
+    :return: The second-order sections of all harmonics.
+    :rtype: np.ndarray
     """
-    Filter out the 50 Hz line noise and multiples of it from the data.
+    freqs = [i * base_freq for i in range(1, n_harmonics + 1)
+             if i * base_freq + width / 2 < fs / 2]
+    if not freqs:
+        raise ValueError(f"{base_freq} Hz is above the Nyquist frequency.")
+
+    if method == "notch":
+        sections = [sg.tf2sos(*sg.iirnotch(freq, freq / width, fs=fs))
+                    for freq in freqs]
+    elif method == "bandstop":
+        sections = [sg.butter(N=order, Wn=[freq - width / 2,
+                                           freq + width / 2],
+                              btype='bandstop', output='sos', fs=fs)
+                    for freq in freqs]
+    else:
+        raise ValueError(f"Unknown line noise filter {method}.")
+
+    return np.vstack(sections)
+
+
+def filter_line_noise(rec: Recording,
+                      order: Optional[int] = 16,
+                      workers: Optional[int] = None,
+                      base_freq: float = 50,
+                      n_harmonics: int = 9,
+                      method: str = "notch") -> None:
+    """
+    Filter out the line noise and multiples of it from the data.
+    By default, a cascade of notch filters is applied forward and backward
+    in a single in-place pass, see sosfiltfilt_blocks, which has zero phase.
+    The bandstop method applies Butterworth bandstops of the given order
+    forward only, as before, since they have many more sections to run.
 
     :param rec: The data to filter the line noise from.
     :type rec: Recording
 
-    :param order (int): The order of the filter.
+    :param order (int): The order of the bandstop filters.
     :type order: int
+
+    :param workers: The number of threads filtering blocks of channels,
+                    defaults to constants.filter_workers.
+    :type workers: int
+
+    :param base_freq: The frequency of the power line, 50 Hz in Europe and
+                      60 Hz in North America.
+    :type base_freq: float
+
+    :param n_harmonics: The number of multiples of base_freq to remove,
+                        including base_freq itself.
+    :type n_harmonics: int
+
+    :param method: "notch" or "bandstop", see line_noise_sos.
+    :type method: str
     """
-    freqs = [i * 50 for i in range(1, 10)]
+    sos = line_noise_sos(rec.sampling_rate, base_freq, n_harmonics,
+                         method=method, order=order)
 
+    rec.snapshot(f"line noise filter, {base_freq} Hz")
+    rec.to_float()
     data = rec.get_data()
-    for freq in freqs:
-        sos = sg.butter(N=order, Wn=[freq-1.5, freq+1.5], btype='bandstop',
-                        output='sos', fs=rec.sampling_rate)
-        data[:] = sg.sosfilt(sos, data)[:]
+    workers = workers or filter_workers
+    if method == "notch":
+        sosfiltfilt_blocks(sos, data, workers=workers)
+        rec.data_changed()
+        return
+
+    def filter_rows(rows: slice):
+        # float64 filter state, see frequency_filter
+        data[rows] = sg.sosfilt(sos, data[rows])
+
+    blocks = channel_blocks(data.shape[0], data.shape[1] * 8, workers)
+    map_channel_blocks(filter_rows, blocks, workers)
+    rec.data_changed()
@@ -1,20 +1,74 @@
 """
 TODO
 """
-import elephant as ep
-from elephant.causality.granger import (pairwise_granger,
-                                        pairwise_spectral_granger)
-from mutual_info.mutual_info import mutual_information
 # import numba as nb
-import neo
 import numpy as np
-from PyIF.te_compute import te_compute
-import scipy.signal as sg
-import quantities as pq
 
+from lazy_import import lazy_import
 # from src.model.event import Event
 from model.data import Recording
 
+ep = lazy_import("elephant")
+neo = lazy_import("neo")
+pq = lazy_import("quantities")
+sg = lazy_import("scipy.signal")
+
+
+def channel_stats(rec: Recording) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the mean and standard deviation of every channel block-wise,
+    merging the statistics of the time windows of long rows, see
+    model/data.py::Recording.iter_blocks.
+
+    :param rec: The recording object.
+    :type rec: Recording
+
+    :return: the means and standard deviations per channel.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    n_rows = rec.data.shape[0]
+    counts = np.zeros(n_rows)
+    means = np.zeros(n_rows)
+    sq_devs = np.zeros(n_rows)
+    for rows, start, stop, block in rec.iter_blocks(np.float64):
+        n = stop - start
+        block_means = np.mean(block, axis=-1)
+        block_sq_devs = np.sum(np.square(block - block_means[:, None]),
+                               axis=-1)
+        # combines the statistics of the previous and the new samples
+        delta = block_means - means[rows]
+        total = counts[rows] + n
+        means[rows] += delta * n / total
+        sq_devs[rows] += block_sq_devs + delta**2 * counts[rows] * n / total
+        counts[rows] = total
+
+    return means, np.sqrt(sq_devs / counts)
+
+
+def iter_channel_pairs(rec: Recording):
+    """
+    Iterates over all pairs of channels i >= j, in ascending order of j for
+    every i. Holds at most two blocks of rows, see
+    model/data.py::Recording.iter_channel_blocks, instead of the whole data
+    matrix, at the cost of reading the rows before every block again.
+
+    :param rec: The recording object.
+    :type rec: Recording
+
+    :return: generator of i, j and the signals of both channels.
+    """
+    for rows1, block1 in rec.iter_channel_blocks():
+        for rows2, block2 in rec.iter_channel_blocks():
+            if rows2.start >= rows1.stop:
+                break
+
+            for i, sig1 in enumerate(block1, rows1.start):
+                for j, sig2 in enumerate(block2, rows2.start):
+                    if i < j:
+                        break
+
+                    yield i, j, sig1, sig2
+
 
 # parallelize, maybe pull out z-scoring for numba
 def compute_xcorrs(rec: Recording):
@@ -26,24 +80,20 @@ def compute_xcorrs(rec: Recording):
     :param rec: The recording object.
     :type rec: Recording
     """
-    sig = rec.get_data()
-    means = np.mean(sig, axis=-1)
-    stds = np.std(sig, axis=-1)
-    sig = ((sig.T - means) / stds).T
+    n_rows, n_samples = rec.data.shape
+    means, stds = channel_stats(rec)
 
-    lags = sg.correlation_lags(sig.shape[1], sig.shape[1], "same")
-    rec.xcorrs = lags, np.zeros((sig.shape[0], sig.shape[0], sig.shape[1]))
-
-    for i, sig1 in enumerate(sig):
-        for j, sig2 in enumerate(sig):
-            if i < j:
-                continue
+    lags = sg.correlation_lags(n_samples, n_samples, "same")
+    rec.xcorrs = lags, np.zeros((n_rows, n_rows, n_samples))
 
-            rec.xcorrs[1][i, j] = (sg.correlate(sig1, sig2, 'same')
-                                   * (1 / (sig.shape[1] - np.abs(lags))))
+    for i, j, sig1, sig2 in iter_channel_pairs(rec):
+        rec.xcorrs[1][i, j] = (sg.correlate((sig1 - means[i]) / stds[i],
+                                            (sig2 - means[j]) / stds[j],
+                                            'same')
+                               * (1 / (n_samples - np.abs(lags))))
 
-    for i in range(sig.shape[0]):
-        for j in range(sig.shape[0]):
+    for i in range(n_rows):
+        for j in range(n_rows):
             if i >= j:
                 continue
 
@@ -59,23 +109,19 @@ def compute_mutual_info(rec: Recording):
     :param rec: The recording object.
     :type rec: Recording
     """
-    data = rec.get_data()
-    for i, sig1 in enumerate(data):
-        for j, sig2 in enumerate(data):
-            if i < j:
-                continue
+    from mutual_info.mutual_info import mutual_information
 
-            data.mutual_informations[i, j] = mutual_information((sig1, sig2))
+    n_channels = rec.data.shape[0]
+    rec.mutual_infos = np.zeros((n_channels, n_channels))
+    for i, j, sig1, sig2 in iter_channel_pairs(rec):
+        rec.mutual_infos[i, j] = mutual_information((sig1, sig2))
 
-    n_channels = len(rec.selected_electrodes)
     for i in range(n_channels):
         for j in range(n_channels):
             if i >= j:
                 continue
 
-            rec.mutual_infos[i, j] = data.mutual_infos[j, i]
-
-    rec.data.close()
+            rec.mutual_infos[i, j] = rec.mutual_infos[j, i]
 
 
 # PyIF.compute_te already uses numba/gpu
@@ -91,21 +137,24 @@ def compute_transfer_entropy(rec: Recording, lag_ms: int = 1000):
     :param lag_ms: The time lag to use for the transfer entropy computation.
     :type lag_ms: int
     """
-    data = rec.get_data()
-    n_els = data.shape[0]
-    data.transfer_entropies = np.zeros((n_els, n_els))
+    from PyIF.te_compute import te_compute
+
+    n_els = rec.data.shape[0]
+    rec.transfer_entropies = np.zeros((n_els, n_els))
     lags = int(lag_ms * 0.001 * rec.sampling_rate)
     lags = max(lags, 1)
 
-    for i, sig1 in enumerate(data):
-        for j, sig2 in enumerate(data):
-            if i == j:
-                continue
+    # both directions of every pair
+    for i, j, sig1, sig2 in iter_channel_pairs(rec):
+        if i == j:
+            continue
 
-            rec.transfer_entropies[i, j] = te_compute(sig1,
-                                                      sig2,
-                                                      embedding=lags)
-    rec.data.close()
+        rec.transfer_entropies[i, j] = te_compute(sig1,
+                                                  sig2,
+                                                  embedding=lags)
+        rec.transfer_entropies[j, i] = te_compute(sig2,
+                                                  sig1,
+                                                  embedding=lags)
 
 
 # parallelize
@@ -116,20 +165,13 @@ def compute_coherence(rec: Recording):
     :param rec: The recording object.
     :type rec: Recording
     """
-    data = rec.get_data()
-    coherences = []
-    for i, sig1 in enumerate(data):
-        coherences.append([])
-        for j, sig2 in enumerate(data):
-            if i < j:
-                continue
-
-            coh = ep.spectral.multitaper_coherence(sig1.T, sig2.T,
-                                                   fs=rec.sampling_rate)
-            coherences[i].append(coh)
+    coherences = [[] for _ in range(rec.data.shape[0])]
+    for i, _, sig1, sig2 in iter_channel_pairs(rec):
+        coh = ep.spectral.multitaper_coherence(sig1.T, sig2.T,
+                                               fs=rec.sampling_rate)
+        coherences[i].append(coh)
 
     rec.coherences = np.array(coherences)
-    rec.data.close()
 
 
 # parallelize
@@ -143,20 +185,16 @@ def compute_granger_causality(rec: Recording, lag_ms=1000):
     :param lag_ms: The time lag to use for the Granger causality computation.
     :type lag_ms: int
     """
+    from elephant.causality.granger import pairwise_granger
+
     lags = int(lag_ms * 0.001 * rec.sampling_rate)
-    data = rec.get_data()
-    cgs = []
-    for i, sig1 in enumerate(data):
-        cgs.append([])
-        for j, sig2 in enumerate(data):
-            if i < j:
-                continue
-            caus = pairwise_granger(np.hstack((sig1.T, sig2.T)),
-                                    max_order=lags)
-            cgs[i].append(caus)
+    cgs = [[] for _ in range(rec.data.shape[0])]
+    for i, _, sig1, sig2 in iter_channel_pairs(rec):
+        caus = pairwise_granger(np.hstack((sig1.T, sig2.T)),
+                                max_order=lags)
+        cgs[i].append(caus)
 
     rec.granger_causalities = cgs
-    rec.data.close()
 
 
 # parallelize
@@ -167,25 +205,22 @@ def compute_spectral_granger(rec: Recording):
     :param rec: The recording object.
     :type rec: Recording
     """
-    data = rec.get_data()
-    spectral_cgs = []
-    for i, sig1 in enumerate(data):
-        spectral_cgs.append([])
-        for j, sig2 in enumerate(data):
-            if i < j:
-                continue
+    from elephant.causality.granger import pairwise_spectral_granger
 
-            scgs = pairwise_spectral_granger(sig1.T, sig2.T,
-                                             fs=rec.sampling_rate)
-            spectral_cgs[i].append(scgs)
+    spectral_cgs = [[] for _ in range(rec.data.shape[0])]
+    for i, _, sig1, sig2 in iter_channel_pairs(rec):
+        scgs = pairwise_spectral_granger(sig1.T, sig2.T,
+                                         fs=rec.sampling_rate)
+        spectral_cgs[i].append(scgs)
 
     rec.spectal_granger = spectral_cgs
-    rec.data.close()
 
 
 def compute_current_source_density(rec: Recording):
     """
     Compute the current source density of the data in the Recording object.
+    KCSD estimates it from all channels at once, so unlike the pairwise
+    measures, the whole data matrix is passed to it.
 
     :param rec: The recording object.
     :type rec: Recording
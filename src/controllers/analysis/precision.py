@@ -0,0 +1,224 @@
+"""
+Accuracy check of the float32 processing mode against the float64 path.
+
+With Recording.precision set to np.float32, the data and all derived arrays
+are stored in float32. Filter coefficients and states, as well as the
+cumulative sums of the moving averages, stay in float64 as float32 is not
+numerically safe there (poles close to the unit circle, cancellation of large
+sums). compare_precisions runs the processing stages on a float64 and a
+float32 copy of a recording and reports the deviation per stage,
+check_precisions additionally raises if a stage exceeds its tolerance in
+TOLERANCES, see tests/test_precision.py.
+
+For 10 channels of 60 s synthetic LFP (random walk, 50 Hz hum and spikes,
+25 kHz, see synthetic_recording) the maximum absolute error relative to the
+largest absolute float64 value is as follows. The stages are applied one
+after the other, so the errors accumulate:
+
+    ================  =========  =========
+    Stage             RelError   Tolerance
+    ================  =========  =========
+    bandpass          2.4e-07    1e-06
+    line noise        2.6e-07    1e-06
+    downsample        2.5e-07    1e-06
+    PSD               3.1e-08    1e-06
+    spectrogram       1.6e-07    1e-06
+    moving MAD        7.7e-08    1e-06
+    derivative        6.8e-07    1e-05
+    ================  =========  =========
+
+i.e. float32 results agree with float64 to about float32 resolution. The
+derivative amplifies rounding errors of neighbouring samples, but stays far
+below the noise level of the recordings.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from controllers.analysis.activity import compute_derivatives, compute_mv_mads
+from controllers.analysis.filter import (downsample, filter_line_noise,
+                                         frequency_filter)
+from controllers.analysis.spectral import compute_psds, compute_spectrograms
+from model.data import Recording
+
+# Maximum relative error of each float32 stage, see check_precisions.
+TOLERANCES = {"bandpass": 1e-6,
+              "line noise": 1e-6,
+              "downsample": 1e-6,
+              "PSD": 1e-6,
+              "spectrogram": 1e-6,
+              "moving MAD": 1e-6,
+              "derivative": 1e-5}
+
+
+def copy_recording(rec: Recording, precision) -> Recording:
+    """
+    Copies the loaded data of a recording into a new recording with the given
+    precision.
+
+    :param rec: the recording to copy.
+    :type rec: Recording
+
+    :param precision: the floating point type of the copy.
+    :type precision: np.dtype
+
+    :return: the copy.
+    :rtype: Recording
+    """
+    data = rec.get_block(dtype=np.float64).astype(precision)
+    cpy = Recording(rec.fname, rec.recording_date, rec.n_mea_electrodes,
+                    rec.sampling_rate, data, rec.start_idx, rec.stop_idx,
+                    rec.electrode_names, rec.ground_els, rec.ground_el_names,
+                    precision=precision)
+    cpy.selected_electrodes = rec.selected_electrodes
+    cpy.channels_df = pd.DataFrame(cpy.get_sel_names(), columns=['Channel'],
+                                   dtype="string")
+
+    return cpy
+
+
+def relative_error(ref: np.ndarray, approx: np.ndarray) -> tuple[float, float]:
+    """
+    Computes the maximum absolute error and the maximum absolute error
+    relative to the largest absolute reference value.
+
+    :param ref: the float64 reference.
+    :type ref: np.ndarray
+
+    :param approx: the float32 result.
+    :type approx: np.ndarray
+
+    :return: the maximum absolute and the maximum relative error.
+    :rtype: tuple[float, float]
+    """
+    err = np.max(np.abs(ref - approx.astype(np.float64)))
+    scale = np.max(np.abs(ref))
+
+    return err, err / scale if scale > 0 else err
+
+
+def compare_precisions(rec: Recording,
+                       low_cut: float = 1,
+                       high_cut: float = 300,
+                       new_fs: int = 1000,
+                       mad_win: int = 50) -> pd.DataFrame:
+    """
+    Runs bandpass and line noise filtering, downsampling, PSDs, spectrograms,
+    moving MADs and derivatives on a float64 and a float32 copy of the
+    selected data and compares the results.
+
+    :param rec: the recording, the selection has to be applied already.
+    :type rec: Recording
+
+    :param low_cut: lower cutoff frequency of the bandpass.
+    :type low_cut: float
+
+    :param high_cut: upper cutoff frequency of the bandpass.
+    :type high_cut: float
+
+    :param new_fs: sampling rate to downsample to.
+    :type new_fs: int
+
+    :param mad_win: window size of the moving MAD in samples.
+    :type mad_win: int
+
+    :return: the maximum absolute and relative error per stage.
+    :rtype: pd.DataFrame
+    """
+    recs = [copy_recording(rec, np.float64), copy_recording(rec, np.float32)]
+    stages = [("bandpass",
+               lambda r: frequency_filter(r, False, low_cut, high_cut),
+               lambda r: r.get_data()),
+              ("line noise", filter_line_noise, lambda r: r.get_data()),
+              ("downsample", lambda r: downsample(r, new_fs),
+               lambda r: r.get_data()),
+              ("PSD", compute_psds, lambda r: r.psds[1].read()),
+              ("spectrogram", compute_spectrograms,
+               lambda r: r.spectrograms[2].read()),
+              ("moving MAD", lambda r: compute_mv_mads(r, mad_win),
+               lambda r: r.mv_mads.read()),
+              ("derivative", compute_derivatives,
+               lambda r: r.derivatives.read())]
+
+    rows = []
+    for name, stage, result in stages:
+        for r in recs:
+            stage(r)
+        abs_err, rel_err = relative_error(result(recs[0]), result(recs[1]))
+        rows.append({"Stage": name, "MaxAbsError": abs_err,
+                     "RelError": rel_err,
+                     "dtype": result(recs[1]).dtype.name})
+
+    for r in recs:
+        r.free()
+
+    return pd.DataFrame(rows)
+
+
+def check_precisions(rec: Recording, **kwargs) -> pd.DataFrame:
+    """
+    Compares the precisions like compare_precisions and raises if the
+    relative error of a stage exceeds its tolerance in TOLERANCES.
+
+    :param rec: the recording, the selection has to be applied already.
+    :type rec: Recording
+
+    :param kwargs: further parameters of compare_precisions.
+
+    :return: the maximum absolute and relative error per stage.
+    :rtype: pd.DataFrame
+    """
+    errors = compare_precisions(rec, **kwargs)
+    too_large = [f"{row.Stage}: {row.RelError:.1e} > "
+                 f"{TOLERANCES[row.Stage]:.0e}"
+                 for row in errors.itertuples()
+                 if row.RelError > TOLERANCES[row.Stage]]
+    if too_large:
+        raise ValueError("float32 deviates from float64 by more than the "
+                         "tolerance in " + ", ".join(too_large))
+
+    return errors
+
+
+def synthetic_recording(n_channels: int = 10,
+                        duration: float = 60,
+                        fs: int = 25000,
+                        seed: int = 0) -> Recording:
+    """
+    Creates a recording of synthetic LFP in volts, i.e. a random walk with
+    50 Hz hum and about one spike per second on every channel, all
+    channels selected.
+
+    :param n_channels: the number of channels.
+    :type n_channels: int
+
+    :param duration: the duration in seconds.
+    :type duration: float
+
+    :param fs: the sampling rate in Hz.
+    :type fs: int
+
+    :param seed: the seed of the random number generator.
+    :type seed: int
+
+    :return: the recording in float64.
+    :rtype: Recording
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * fs)
+    data = np.cumsum(rng.normal(0, 1e-6, (n_channels, n_samples)), axis=1)
+    data += 2e-5 * np.sin(2 * np.pi * 50 * np.arange(n_samples) / fs)
+
+    spike = -1e-4 * np.exp(-np.arange(int(0.002 * fs)) / (0.0005 * fs))
+    for row in data:
+        spikes = (rng.random(n_samples) < 1 / fs).astype(np.float64)
+        row += np.convolve(spikes, spike)[:n_samples]
+
+    names = np.array([f"R 1 C {i + 1}" for i in range(n_channels)])
+    rec = Recording("synthetic", datetime.datetime(2023, 1, 1), n_channels,
+                    fs, data, 0, n_samples - 1, names,
+                    np.array([], dtype=int), np.array([], dtype=str))
+    rec.selected_electrodes = list(range(n_channels))
+
+    return rec
@@ -0,0 +1,254 @@
+"""
+Preprocessing chains, which apply several filters and the downsampling in a
+single pass over the data.
+
+Applying the steps of controllers/analysis/filter.py one after the other
+reads and writes the whole data matrix once per step. A chain reads a block
+of channels instead, applies all stages to it in float64 and writes only the
+output of the last stage, so the full-rate data is read exactly once.
+The stages see whole rows, thus the result is the same as when applying the
+steps one by one, except that float32 data is not rounded in between.
+
+    Preprocessing([FrequencyFilter(False, 1, 300),
+                   LineNoiseFilter(50),
+                   Downsample(1000)]).apply(rec)
+"""
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+
+from constants import filter_workers
+from controllers.analysis.filter import (channel_blocks,
+                                         concurrent_workers,
+                                         frequency_sos,
+                                         line_noise_sos,
+                                         map_channel_blocks,
+                                         resample_poly_blocks,
+                                         resampled_indices,
+                                         resampling_ratio,
+                                         sosfiltfilt_blocks)
+from lazy_import import lazy_import
+from model.data import BLOCK_BYTES, Recording, SelectionView
+
+sg = lazy_import("scipy.signal")
+
+
+class Stage(ABC):
+    """
+    A step of a preprocessing chain. It is designed for the sampling rate
+    of its input once and then applied to blocks of whole rows. Subclasses
+    have to implement apply and label.
+    """
+
+    def design(self, fs: float) -> float:
+        """
+        Designs the filter for the given sampling rate.
+
+        :param fs: The sampling rate of the input of the stage.
+        :type fs: float
+
+        :return: The sampling rate of the output of the stage.
+        :rtype: float
+        """
+        return fs
+
+    def output_len(self, n_samples: int) -> int:
+        """
+        :return: The number of samples of the output for n_samples input
+                 samples.
+        """
+        return n_samples
+
+    @abstractmethod
+    def apply(self, block: np.ndarray, block_bytes: int) -> np.ndarray:
+        """
+        Applies the stage to a block of whole rows.
+
+        :param block: The float64 rows, which may be modified in-place.
+        :type block: np.ndarray
+
+        :param block_bytes: Size of the temporary arrays of the stage.
+        :type block_bytes: int
+
+        :return: The processed rows.
+        :rtype: np.ndarray
+        """
+
+    def update(self, rec: Recording):
+        """
+        Updates the metadata of the recording after the chain was applied.
+        """
+
+    @abstractmethod
+    def label(self) -> str:
+        """
+        :return: The name of the stage, shown by undo.
+        """
+
+
+class FrequencyFilter(Stage):
+    """
+    Zero-phase Butterworth filter, see filter.py::frequency_filter.
+    """
+
+    def __init__(self,
+                 stop: bool,
+                 low_cut: Optional[float],
+                 high_cut: Optional[float],
+                 order: int = 16):
+        self.stop = stop
+        self.low_cut = low_cut
+        self.high_cut = high_cut
+        self.order = order
+        self.sos = None
+        self.btype = "frequency"
+
+    def design(self, fs: float) -> float:
+        self.sos, self.btype = frequency_sos(fs, self.stop, self.low_cut,
+                                             self.high_cut, self.order)
+        return fs
+
+    def apply(self, block: np.ndarray, block_bytes: int) -> np.ndarray:
+        sosfiltfilt_blocks(self.sos, block, block_bytes)
+        return block
+
+    def label(self) -> str:
+        return f"{self.btype} filter, order {self.order}"
+
+
+class LineNoiseFilter(Stage):
+    """
+    Removes the line frequency and its harmonics, see
+    filter.py::filter_line_noise.
+    """
+
+    def __init__(self,
+                 base_freq: float = 50,
+                 n_harmonics: int = 9,
+                 method: str = "notch",
+                 order: int = 16):
+        self.base_freq = base_freq
+        self.n_harmonics = n_harmonics
+        self.method = method
+        self.order = order
+        self.sos = None
+
+    def design(self, fs: float) -> float:
+        self.sos = line_noise_sos(fs, self.base_freq, self.n_harmonics,
+                                  method=self.method, order=self.order)
+        return fs
+
+    def apply(self, block: np.ndarray, block_bytes: int) -> np.ndarray:
+        if self.method == "notch":
+            sosfiltfilt_blocks(self.sos, block, block_bytes)
+            return block
+
+        return sg.sosfilt(self.sos, block)
+
+    def label(self) -> str:
+        return f"line noise filter, {self.base_freq} Hz"
+
+
+class Downsample(Stage):
+    """
+    Polyphase resampling to a lower rate, see filter.py::downsample.
+    """
+
+    def __init__(self, new_fs: float):
+        self.new_fs = new_fs
+        self.up = 1
+        self.down = 1
+
+    def design(self, fs: float) -> float:
+        self.up, self.down = resampling_ratio(fs, self.new_fs)
+        return fs * self.up / self.down
+
+    def output_len(self, n_samples: int) -> int:
+        return -(-n_samples * self.up // self.down)
+
+    def apply(self, block: np.ndarray, block_bytes: int) -> np.ndarray:
+        out = np.empty((block.shape[0], self.output_len(block.shape[1])))
+        resample_poly_blocks(block, out, self.up, self.down, block_bytes)
+        return out
+
+    def update(self, rec: Recording):
+        resampled_indices(rec, self.up, self.down)
+
+    def label(self) -> str:
+        return f"downsampling to {self.new_fs} Hz"
+
+
+class Preprocessing:
+    """
+    A chain of stages that is applied to a recording in a single pass.
+    """
+
+    def __init__(self, stages: list[Stage]):
+        if not stages:
+            raise ValueError("A preprocessing chain needs at least one stage.")
+        self.stages = stages
+
+    def apply(self, rec: Recording, workers: Optional[int] = None):
+        """
+        Applies all stages to blocks of channels in a pool of threads, see
+        filter.py::map_channel_blocks. If the chain does not change the
+        number of samples, float data is overwritten in-place, otherwise the
+        output is written into a new array, which replaces the data matrix.
+        The data is saved before, such that the whole chain can be undone.
+
+        :param rec: The recording to preprocess.
+        :type rec: Recording
+
+        :param workers: The number of threads processing blocks of channels,
+                        defaults to constants.filter_workers. Every thread
+                        holds a float64 copy of at least one whole row, so
+                        they are capped by BLOCK_BYTES, see
+                        filter.py::concurrent_workers.
+        :type workers: int
+        """
+        n_rows, n_samples = rec.data.shape
+        workers = concurrent_workers(n_samples * 8,
+                                     workers or filter_workers, BLOCK_BYTES)
+        fs, n_out = rec.sampling_rate, n_samples
+        for stage in self.stages:
+            fs = stage.design(fs)
+            n_out = stage.output_len(n_out)
+
+        rec.snapshot(", ".join(stage.label() for stage in self.stages))
+        in_place = (n_out == n_samples and not rec.raw
+                    and not isinstance(rec.data, SelectionView))
+        data = rec.data if in_place else rec.allocate((n_rows, n_out))
+        self._run(rec, data.read(), workers)
+
+        if not in_place:
+            # releases the full-rate data, see model/data.py::Recording
+            rec.data_rows = rec.file_rows()
+            rec.data = data
+            rec.raw = False
+        for stage in self.stages:
+            stage.update(rec)
+        rec.data_changed()
+
+    def _run(self, rec: Recording, out: np.ndarray, workers: int):
+        """
+        Reads every block of channels once, applies the stages to it and
+        writes the result to out.
+        """
+        block_bytes = BLOCK_BYTES // workers
+
+        def process_rows(rows: slice):
+            block = rec.get_block(rows, dtype=np.float64)
+            # the stages may modify the block in-place: scaled ADC counts are
+            # a copy already and float data is replaced by the output anyway,
+            # except for the full data matrix a selection view is taken from
+            block = block.astype(np.float64,
+                                 copy=(isinstance(rec.data, SelectionView)
+                                       and not rec.raw))
+            for stage in self.stages:
+                block = stage.apply(block, block_bytes)
+            out[rows] = block
+
+        blocks = channel_blocks(rec.data.shape[0], rec.data.shape[1] * 8,
+                                workers)
+        map_channel_blocks(process_rows, blocks, workers)
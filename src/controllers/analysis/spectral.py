@@ -1,13 +1,14 @@
 """
 TODO
 """
-from fooof import FOOOFGroup
 import numpy as np
-import scipy.signal as sg
 import pdb
 
 from model.data import Recording, SharedArray
 from constants import default_bins
+from lazy_import import lazy_import
+
+sg = lazy_import("scipy.signal")
 
 
 # No njit as numpy.fft is not supported & numpy already calls C routines
@@ -36,9 +37,19 @@ def compute_psds(rec: Recording):
     :param rec: The recording object.
     :type rec: Recording
     """
-    ys = rec.get_data()
-    freq, power = sg.welch(ys, fs=rec.sampling_rate, nperseg=256, nfft=512)
-    rec.psds = SharedArray(freq), SharedArray(power)
+    def compute():
+        power = None
+        # ADC counts are scaled block-wise, see model/data.py::Recording
+        for rows, ys in rec.iter_channel_blocks():
+            freq, block_power = sg.welch(ys, fs=rec.sampling_rate,
+                                         nperseg=256, nfft=512)
+            if power is None:
+                # write the blocks directly into the (pooled) shared buffer
+                power = rec.allocate((rec.data.shape[0], freq.shape[0]))
+            power.read()[rows] = block_power
+        return SharedArray(freq), power
+
+    rec.psds = rec.derived("psds", (), compute)
 
 
 # No njit as scipy.signal is not supported & scipy already calls C routines
@@ -50,10 +61,22 @@ def compute_spectrograms(rec: Recording):
     :type rec: Recording
     """
     win = np.kaiser(128, 0)
-    f, t, sxx = sg.spectrogram(rec.get_data(), rec.sampling_rate,
-                               window=win, nperseg=len(win),
-                               noverlap=len(win) / 4, nfft=2 * len(win))
-    rec.spectrograms = SharedArray(f), SharedArray(t), SharedArray(sxx)
+
+    def compute():
+        sxx = None
+        # ADC counts are scaled block-wise, see model/data.py::Recording
+        for rows, ys in rec.iter_channel_blocks():
+            f, t, block_sxx = sg.spectrogram(ys, rec.sampling_rate,
+                                             window=win, nperseg=len(win),
+                                             noverlap=len(win) / 4,
+                                             nfft=2 * len(win))
+            if sxx is None:
+                # write the blocks directly into the (pooled) shared buffer
+                sxx = rec.allocate((rec.data.shape[0],) + block_sxx.shape[1:])
+            sxx.read()[rows] = block_sxx
+        return SharedArray(f), SharedArray(t), sxx
+
+    rec.spectrograms = rec.derived("spectrograms", (), compute)
 
 
     freq_bin_names = [f"{bins[0]}-{bins[1]}" for bins in default_bins]
@@ -116,6 +139,8 @@ def compute_periodic_aperiodic_decomp(rec: Recording,
     if rec.psds is None:
         compute_psds(rec)
 
+    from fooof import FOOOFGroup
+
     fg = FOOOFGroup()
     fg.fit(rec.psds, freq_range, n_jobs=-1)
     rec.fooof_group = fg
@@ -0,0 +1,209 @@
+"""
+Runs an import in a background process, such that the Dash server stays
+responsive while a large file is read.
+
+The worker reports its progress through a queue and checks an event for
+cancellation between blocks, see controllers/io/cache.py::store_cached.
+Without filling the cache, only the metadata is read, which is quick. The
+selected electrodes and time window are then read by another background
+process, see SelectJob and controllers/select.py::read_selection.
+When it is done, the Recording or the selected data is sent back through
+the queue. Its arrays are pickled by the names of their shared memory
+segments or files, see model/data.py::SharedArray, so no data is copied.
+"""
+import multiprocessing as mp
+from queue import Empty
+from typing import Optional
+
+import numpy as np
+
+from controllers.io.cache import ImportCancelled, cached_mcs_256_import
+from controllers.io.import_mcs_cmos import mcs_cmos_import
+from controllers.select import read_selection
+from model.data import Recording
+
+
+class BackgroundJob:
+    """
+    Handle of a function running in a background process, which reports
+    ("progress", done, total) and finally ("done", result, info) or
+    ("cancelled", None, info) through a queue.
+    """
+
+    def __init__(self, target, *args) -> None:
+        """
+        Starts target(*args, que, cancel_event) in a new process.
+        """
+        ctx = mp.get_context("spawn")
+        self.que = ctx.Queue()
+        self.cancel_event = ctx.Event()
+        self.done_bytes = 0
+        self.total_bytes = 0
+        self.finished = False
+        self.cancelled = False
+        self.result = None
+        self.info = ""
+
+        self.proc = ctx.Process(target=target,
+                                args=(*args, self.que, self.cancel_event),
+                                daemon=True)
+        self.proc.start()
+
+    def poll(self) -> bool:
+        """
+        Reads all messages the worker sent so far.
+
+            :return True if the job finished, was cancelled or failed.
+        """
+        while not self.finished:
+            try:
+                kind, first, second = self.que.get_nowait()
+            except Empty:
+                # the worker died without reporting, e.g. killed by the OS
+                if not self.proc.is_alive() and self.que.empty():
+                    self.finished = True
+                    self.info = ("The background process terminated "
+                                 "unexpectedly.")
+                break
+
+            if kind == "progress":
+                self.done_bytes, self.total_bytes = first, second
+                continue
+
+            self.finished = True
+            self.cancelled = kind == "cancelled"
+            self.result, self.info = first, second
+            self.proc.join()
+
+        return self.finished
+
+    def progress(self) -> float:
+        """
+        :return the fraction of the data read so far, 1 if finished.
+        """
+        if self.finished:
+            return 1.0
+        if self.total_bytes == 0:
+            return 0.0
+
+        return self.done_bytes / self.total_bytes
+
+    def cancel(self) -> None:
+        """
+        Asks the worker to stop after the current block.
+        """
+        self.cancel_event.set()
+
+
+class ImportJob(BackgroundJob):
+    """
+    Handle of an import running in a background process.
+    """
+
+    def __init__(self,
+                 path: str,
+                 file_type: int = 0,
+                 raw: bool = False,
+                 precision=np.float64,
+                 storage: str = "shm",
+                 fill_cache: bool = False
+                 ) -> None:
+        """
+        Starts the import of a multi channel systems file in a new process,
+        see controllers/io/cache.py::cached_mcs_256_import for the parameters,
+        fill_cache is its fill parameter.
+        file_type is 0 for MCS 256 and 1 for MCS CMOS-MEA files.
+        """
+        super().__init__(import_worker, path, file_type, raw,
+                         np.dtype(precision), storage, fill_cache)
+
+    @property
+    def rec(self) -> Optional[Recording]:
+        """
+        The imported recording, once the import finished successfully.
+        """
+        return self.result
+
+
+class SelectJob(BackgroundJob):
+    """
+    Handle of the read of the selected electrodes and time window running in
+    a background process, see controllers/select.py::read_selection.
+    """
+
+    def __init__(self, rec: Recording) -> None:
+        """
+        Starts reading the selection of the recording from the file or cache
+        in a new process. The recording itself is not modified, pass the
+        result to controllers/select.py::adopt_selection once it finished.
+        """
+        super().__init__(select_worker, rec.handle())
+
+
+def import_worker(path: str,
+                  file_type: int,
+                  raw: bool,
+                  precision: np.dtype,
+                  storage: str,
+                  fill_cache: bool,
+                  que: mp.Queue,
+                  cancel
+                  ) -> None:
+    """
+    Entry point of the import process. Reports ("progress", done, total)
+    while reading and finally ("done", rec, info), ("cancelled", None, info)
+    or ("done", None, error message).
+
+        :param path: the path to the file containing the data in McS h5 format.
+        :param file_type: 0 for MCS 256 and 1 for MCS CMOS-MEA files.
+        :param raw: if True, the data is kept as int16 ADC counts.
+        :param precision: the floating point type of the data.
+        :param storage: "shm" or "disk", where the data matrix is kept.
+        :param fill_cache: if True, MCS 256 files that are not cached yet
+                are written to the cache before the recording is returned.
+        :param que: the queue to send the progress and the result to.
+        :param cancel: event that is set to cancel the import.
+    """
+    try:
+        if file_type == 1:
+            # CMOS files are not cached, as they are stored compactly as
+            # int16 already. Only the selection is read, see apply_selection.
+            rec, info = mcs_cmos_import(path, que, lazy=True, raw=raw,
+                                        precision=precision, storage=storage)
+        else:
+            rec, info = cached_mcs_256_import(path, que, raw, precision,
+                                              storage, cancel, fill_cache)
+    except ImportCancelled as err:
+        que.put(("cancelled", None, str(err)))
+        return
+    except (IOError, ValueError) as err:
+        que.put(("done", None, "Failed to import specified file!\n"
+                 f"Error: {err}"))
+        return
+
+    que.put(("done", rec, info))
+
+
+def select_worker(rec: Recording, que: mp.Queue, cancel) -> None:
+    """
+    Entry point of the process reading a selection. Reports ("progress",
+    done, total) while reading and finally ("done", data, info),
+    ("cancelled", None, info) or ("done", None, error message).
+
+        :param rec: handle of the recording, with the selected electrodes
+                and time window set, see model/data.py::Recording.handle.
+        :param que: the queue to send the progress and the result to.
+        :param cancel: event that is set to cancel reading.
+    """
+    try:
+        data = read_selection(rec, que, cancel)
+    except ImportCancelled as err:
+        que.put(("cancelled", None, str(err)))
+        return
+    except (IOError, ValueError, RuntimeError, IndexError) as err:
+        que.put(("done", None, "Failed to read the selection!\n"
+                 f"Error: {err}"))
+        return
+
+    que.put(("done", data, f"Read {data.shape[0]} electrodes with "
+             f"{data.shape[1]} samples each."))
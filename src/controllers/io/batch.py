@@ -0,0 +1,282 @@
+"""
+Batch import of many multi channel systems 256 MEA files, e.g. to preprocess
+all recordings of a day overnight.
+
+Every file is imported in a worker process of a process pool and streamed
+into the cache, see controllers/io/cache.py. Afterwards the files reopen
+instantly on the import screen. The number of concurrent imports is limited
+by the number of CPU cores and by a memory budget.
+index_archive only probes the metadata of the files, to list a whole archive
+in seconds.
+
+Usage:
+    cd src && python -m controllers.io.batch /path/to/recordings -j 8 -m 16
+    cd src && python -m controllers.io.batch --index "/archive/**/*.h5"
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import multiprocessing as mp
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from controllers.io.cache import (cache_dtype, cache_key, cache_paths,
+                                  cached_mcs_256_import)
+from controllers.io.import_mcs_256 import (CHUNK_BYTES, IMPORTER_VERSION,
+                                           mcs_256_probe)
+
+# Number of files probed by a worker per task when indexing an archive.
+PROBE_CHUNK = 64
+
+# Peak memory of a single import: the chunk read from the HDF5 file, its
+# reordered copy and the dirty pages of the cache file.
+WORKER_BYTES = 4 * CHUNK_BYTES
+
+
+def batch_import(pattern: str,
+                 n_workers: Optional[int] = None,
+                 mem_budget: Optional[int] = None,
+                 raw: bool = False,
+                 precision=np.float64
+                 ) -> pd.DataFrame:
+    """
+    Imports all files matching a glob pattern or contained in a directory
+    concurrently into the cache.
+
+    :param pattern: a directory, in which case all .h5 files therein are
+        imported, or a glob pattern like /data/2023-*/*.h5
+    :type pattern: str
+
+    :param n_workers: the maximal number of concurrent imports, defaults to
+        the number of CPU cores.
+    :type n_workers: int
+
+    :param mem_budget: the maximal number of bytes the imports may use
+        together. Limits the number of concurrent imports to
+        mem_budget // WORKER_BYTES, at least one.
+    :type mem_budget: int
+
+    :param raw: if True, the files are cached as int16 ADC counts, for
+        recordings that are imported as raw later on.
+    :type raw: bool
+
+    :param precision: the floating point type to cache the files in
+        otherwise. The cache is only used by imports of the same type.
+    :type precision: np.dtype
+
+    :return: a table with one row per file with its metadata, whether it was
+        cached already, the time the import took and the error if any.
+    :rtype: pd.DataFrame
+    """
+    rows = []
+    # probe first, to report invalid files without starting an import and to
+    # start with the longest recordings, such that no long import is left
+    # running alone at the end
+    probes = []
+    for path in find_files(pattern):
+        try:
+            probes.append(mcs_256_probe(path))
+        except (OSError, KeyError, IndexError) as err:
+            rows.append([path, None, None, None, None, False, 0.0,
+                         f"Not a valid MCS file: {err}", ""])
+    paths = [probe["path"] for probe in sorted(probes,
+                                               key=lambda p: -p["n_samples"])]
+    n_workers = batch_workers(len(paths), n_workers, mem_budget)
+
+    # spawn, as h5py is not fork safe if the parent process opened a file
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=mp.get_context("spawn")) as pool:
+        futures = {pool.submit(import_one, path, raw, precision): path
+                   for path in paths}
+        for future in as_completed(futures):
+            try:
+                rows.append(future.result())
+            except Exception as err:
+                # the worker died, e.g. killed by the OS, which breaks the
+                # pool, the remaining files are reported as failed as well
+                rows.append([futures[future], None, None, None, None, False,
+                             0.0, f"{type(err).__name__}: {err}", ""])
+
+    summary = pd.DataFrame(rows, columns=["File", "Date", "Sampling rate",
+                                          "Electrodes", "Duration [s]",
+                                          "Cached", "Import time [s]",
+                                          "Error", "Info"])
+
+    return summary.sort_values("File", ignore_index=True)
+
+
+def index_archive(pattern: str,
+                  n_workers: Optional[int] = None
+                  ) -> pd.DataFrame:
+    """
+    Probes the metadata of all files matching a glob pattern or contained in
+    a directory without reading any samples, see
+    controllers/io/import_mcs_256.py::mcs_256_probe.
+
+    :param pattern: a directory or a glob pattern, ** matches subdirectories.
+    :type pattern: str
+
+    :param n_workers: the number of worker processes, defaults to the number
+        of CPU cores.
+    :type n_workers: int
+
+    :return: a table with one row per file with its metadata and the error if
+        the file could not be probed.
+    :rtype: pd.DataFrame
+    """
+    paths = find_files(pattern)
+    n_workers = batch_workers(len(paths), n_workers)
+
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=mp.get_context("spawn")) as pool:
+        rows = list(pool.map(probe_one, paths, chunksize=PROBE_CHUNK))
+
+    return pd.DataFrame(rows, columns=["File", "Date", "Sampling rate",
+                                       "Channels", "Samples", "Duration [s]",
+                                       "MEA", "Layout", "Streams", "Error"])
+
+
+def probe_one(path: str) -> list:
+    """
+    Probes a single file. Runs in a worker process, so errors are reported
+    in the index instead of being raised.
+
+    :param path: the path to the file containing the data in McS h5 format.
+    :type path: str
+
+    :return: a row of the index, see index_archive.
+    :rtype: list
+    """
+    try:
+        probe = mcs_256_probe(path)
+    except Exception as err:
+        return [path] + [None] * 8 + [f"{type(err).__name__}: {err}"]
+
+    return [path, probe["date"], probe["sampling_rate"], probe["n_channels"],
+            probe["n_samples"], probe["duration"], probe["mea_name"],
+            probe["mea_layout"], len(probe["streams"]), ""]
+
+
+def find_files(pattern: str) -> list[str]:
+    """
+    Lists the files to import.
+
+    :param pattern: a directory or a glob pattern.
+    :type pattern: str
+
+    :return: the sorted paths of the matching files.
+    :rtype: list[str]
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.h5")
+
+    return sorted(path for path in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(path))
+
+
+def batch_workers(n_files: int,
+                  n_workers: Optional[int] = None,
+                  mem_budget: Optional[int] = None
+                  ) -> int:
+    """
+    Computes the number of worker processes from the number of files, CPU
+    cores and the memory budget.
+
+    :param n_files: the number of files to import.
+    :type n_files: int
+
+    :param n_workers: the maximal number of workers, defaults to the number
+        of CPU cores.
+    :type n_workers: int
+
+    :param mem_budget: the number of bytes the workers may use together.
+    :type mem_budget: int
+
+    :return: the number of worker processes to use, at least one.
+    :rtype: int
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if mem_budget is not None:
+        n_workers = min(n_workers, mem_budget // WORKER_BYTES)
+
+    return max(1, min(n_workers, n_files))
+
+
+def import_one(path: str, raw: bool = False, precision=np.float64) -> list:
+    """
+    Imports a single file into the cache. Runs in a worker process, so
+    errors are reported in the summary instead of being raised.
+
+    :param path: the path to the file containing the data in McS h5 format.
+    :type path: str
+
+    :param raw: if True, the file is cached as int16 ADC counts.
+    :type raw: bool
+
+    :param precision: the floating point type to cache the file in otherwise.
+    :type precision: np.dtype
+
+    :return: a row of the summary table, see batch_import.
+    :rtype: list
+    """
+    tic = time.perf_counter()
+    try:
+        key = cache_key(path, IMPORTER_VERSION, cache_dtype(raw, precision))
+        cached = os.path.exists(cache_paths(key)[1])
+        rec, info = cached_mcs_256_import(path, None, raw, precision,
+                                          fill=True)
+    except Exception as err:
+        # any error, e.g. a MemoryError, only fails this file of the batch
+        return [path, None, None, None, None, False,
+                time.perf_counter() - tic, f"{type(err).__name__}: {err}",
+                ""]
+
+    if rec is None:
+        return [path, None, None, None, None, False,
+                time.perf_counter() - tic, info, ""]
+
+    return [path,
+            rec.recording_date,
+            rec.sampling_rate,
+            rec.electrode_names.shape[0],
+            rec.duration_mus / 1e6,
+            cached,
+            time.perf_counter() - tic,
+            "",
+            info]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import many MCS 256 MEA "
+                                     "files into the cache concurrently.")
+    parser.add_argument("pattern", help="directory or glob pattern")
+    parser.add_argument("-i", "--index", action="store_true",
+                        help="only probe the metadata, do not import")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of concurrent imports, default: cores")
+    parser.add_argument("-m", "--mem-budget", type=float, default=None,
+                        help="memory budget of all imports in GiB")
+    parser.add_argument("-r", "--raw", action="store_true",
+                        help="cache int16 ADC counts, for raw imports")
+    parser.add_argument("-p", "--precision", default="float64",
+                        choices=["float64", "float32"],
+                        help="floating point type to cache volts in")
+    parser.add_argument("-o", "--output", default=None,
+                        help="write the summary table to this CSV file")
+    args = parser.parse_args()
+
+    budget = (None if args.mem_budget is None
+              else int(args.mem_budget * 1024**3))
+    if args.index:
+        table = index_archive(args.pattern, args.workers)
+    else:
+        table = batch_import(args.pattern, args.workers, budget, args.raw,
+                             np.dtype(args.precision))
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
+    print(table.drop(columns="Info", errors="ignore").to_string())
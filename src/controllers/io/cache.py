@@ -0,0 +1,428 @@
+"""
+On-disk cache for imported recordings, to reopen files quickly.
+
+The reordered data matrix is stored in the type the recording keeps it in,
+i.e. as little-endian int16 ADC counts for raw recordings and as ADC
+corrected float64 or float32 values otherwise, in row-major order next to a
+JSON file holding the metadata. Thus the cache takes no more space than the
+source file for raw recordings and the counts are copied exactly. Both files
+are named by a key derived from the contents and modification time of the
+source file, the importer version and the stored data type. Reopening a
+cached file only reads the JSON file. The data matrix is memory-mapped, such
+that the selected electrodes and time window are read from the cache instead
+of the HDF5 file. The ADC step sizes and offsets are kept in the metadata,
+to scale the counts to volts.
+The data matrix is read from the HDF5 file in blocks, opening it only once,
+reporting the progress through a queue and checking for cancellation between
+blocks, see controllers/io/async_import.py.
+Filling the cache is opt-in, as it reads the whole file, while the first
+selection only needs a hyperslab of it. The cache holds at most
+cache_max_bytes, the least recently opened entries are evicted first.
+"""
+import datetime
+from functools import partial
+import hashlib
+import json
+from multiprocessing import Queue
+from multiprocessing.synchronize import Event
+import os
+from typing import Optional
+
+import h5py
+import numpy as np
+
+from constants import cache_dir, cache_max_bytes
+from controllers.io.import_mcs_256 import (CHANNEL_DATA, CHUNK_BYTES,
+                                           IMPORTER_VERSION,
+                                           load_electrode_order,
+                                           mcs_256_import,
+                                           stream_channel_data)
+from model.data import Recording
+
+# Number of bytes at the beginning and end of the source file to hash.
+HASH_BYTES = 1024**2
+
+
+class ImportCancelled(Exception):
+    """
+    Raised when an import is cancelled while the data is written to the cache.
+    """
+
+
+def cached_mcs_256_import(path: str,
+                          que: Queue,
+                          raw: bool = False,
+                          precision=np.float64,
+                          storage: str = "shm",
+                          cancel: Optional[Event] = None,
+                          fill: bool = False
+                          ) -> tuple[Recording, str]:
+    """
+    Imports a multi channel systems 256 MEA file via the cache. On a cache hit
+    only the metadata is read from the cache and the returned recording reads
+    the selected electrodes and time window from the cache when the selection
+    is applied. On a miss, only the metadata is imported and the selection is
+    read from the file, unless fill is set, in which case the data is first
+    streamed into the cache once.
+
+    :param path: the path to the file containing the data in McS h5 format.
+    :type path: str
+
+    :param que: A queue to report the progress of writing the cache to as
+        ("progress", bytes done, bytes total) tuples, or None.
+    :type que: Queue
+
+    :param raw: if True, the selection is stored as int16 ADC counts, see
+        model/data.py::Recording.
+    :type raw: bool
+
+    :param precision: floating point type of the data and all derived
+        arrays, np.float64 or np.float32.
+    :type precision: np.dtype
+
+    :param storage: "shm" to keep the selection in shared memory or "disk" to
+        keep it in a memory-mapped file.
+    :type storage: str
+
+    :param cancel: if set while the cache is written, ImportCancelled is
+        raised and the partially written entry is removed.
+    :type cancel: Event
+
+    :param fill: if True, the whole file is written to the cache on a miss,
+        e.g. by the batch import, to reopen it instantly later on.
+    :type fill: bool
+
+    :return: the recording with the metadata only and the info string or
+        None and an error message
+    :rtype: tuple[Recording, str]
+    """
+    key = cache_key(path, IMPORTER_VERSION, cache_dtype(raw, precision))
+    cached = load_cached(key, raw, precision, storage)
+    if cached is not None:
+        return cached
+
+    rec, info = mcs_256_import(path, que, lazy=True, raw=raw,
+                               precision=precision, storage=storage)
+    if rec is None or not fill:
+        return rec, info
+
+    store_cached(key, path, rec, info, que, cancel)
+    evict_cached(keep=key)
+
+    return load_cached(key, raw, precision, storage)
+
+
+def cache_dtype(raw: bool, precision=np.float64) -> str:
+    """
+    Returns the data type a recording is cached in.
+
+    :param raw: if True, the recording stores int16 ADC counts.
+    :type raw: bool
+
+    :param precision: the floating point type of the recording otherwise.
+    :type precision: np.dtype
+
+    :return: the little-endian data type string, e.g. '<i2'.
+    :rtype: str
+    """
+    if raw:
+        return '<i2'
+
+    return np.dtype(precision).newbyteorder('<').str
+
+
+def cache_key(path: str, version: int, dtype: str) -> str:
+    """
+    Computes the cache key of a file. It is a hash of the file size, the
+    modification time, the first and the last HASH_BYTES of the file, the
+    version of the importer and the data type of the cached matrix.
+
+    :param path: the path to the file to compute the key for.
+    :type path: str
+
+    :param version: the version of the importer.
+    :type version: int
+
+    :param dtype: the data type of the cached matrix, see cache_dtype.
+    :type dtype: str
+
+    :return: the cache key as hex string.
+    :rtype: str
+    """
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}:{version}:{dtype}"
+                  .encode())
+
+    with open(path, "rb") as src:
+        digest.update(src.read(HASH_BYTES))
+        if stat.st_size > 2 * HASH_BYTES:
+            src.seek(-HASH_BYTES, os.SEEK_END)
+            digest.update(src.read(HASH_BYTES))
+
+    return digest.hexdigest()
+
+
+def cache_paths(key: str) -> tuple[str, str]:
+    """
+    Returns the paths of the data and the metadata file of a cache entry.
+
+    :param key: the cache key.
+    :type key: str
+
+    :return: the path of the data file and the path of the metadata file.
+    :rtype: tuple[str, str]
+    """
+    base = os.path.join(cache_dir, key)
+
+    return base + ".bin", base + ".json"
+
+
+def store_cached(key: str,
+                 path: str,
+                 rec: Recording,
+                 info: str,
+                 que: Optional[Queue] = None,
+                 cancel: Optional[Event] = None):
+    """
+    Streams the whole data matrix of a file into the cache and writes the
+    metadata of the recording next to it. The data is stored in the type of
+    the recording, see cache_dtype. The files are written to temporary
+    files first, such that a partially written cache entry is never used.
+    The HDF5 file is opened once and read in blocks of about CHUNK_BYTES.
+
+    :param key: the cache key.
+    :type key: str
+
+    :param path: the path to the file containing the data in McS h5 format.
+    :type path: str
+
+    :param rec: the recording imported from the file, with the ADC offsets
+        and step sizes of its rows, whether it is raw and its precision.
+    :type rec: Recording
+
+    :param info: the info string of the import.
+    :type info: str
+
+    :param que: queue to report ("progress", bytes done, bytes total) to after
+        every block, or None.
+    :type que: Queue
+
+    :param cancel: checked before every block, if it is set the temporary
+        files are removed and ImportCancelled is raised.
+    :type cancel: Event
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, meta_path = cache_paths(key)
+    n_rows = rec.electrode_names.shape[0]
+    n_samples = rec.stop_idx + 1
+    shape = (n_rows, n_samples)
+
+    dtype = cache_dtype(rec.raw, rec.precision)
+    data = np.memmap(data_path + ".tmp", dtype=dtype, mode="w+",
+                     shape=shape)
+    order = load_electrode_order()
+    row_bytes = n_rows * data.dtype.itemsize
+    block_len = max(1, CHUNK_BYTES // row_bytes)
+    with h5py.File(path, "r") as h5_file:
+        channel_data = h5_file[CHANNEL_DATA]
+        for start in range(0, n_samples, block_len):
+            if cancel is not None and cancel.is_set():
+                del data
+                os.remove(data_path + ".tmp")
+                raise ImportCancelled(f"Import of {rec.fname} cancelled")
+
+            stop = min(start + block_len, n_samples)
+            stream_channel_data(channel_data, data[:, start:stop], order,
+                                rec.offsets, rec.scales, start=start,
+                                chunk_len=block_len)
+            if que is not None:
+                que.put(("progress", stop * row_bytes,
+                         n_samples * row_bytes))
+    data.flush()
+    del data
+
+    meta = {"fname": rec.fname,
+            "date": rec.recording_date.isoformat(),
+            "n_electrodes": rec.n_mea_electrodes,
+            "sampling_rate": rec.sampling_rate,
+            "shape": shape,
+            "dtype": dtype,
+            "names": rec.electrode_names.tolist(),
+            "ground_els": rec.ground_els.tolist(),
+            "ground_el_names": rec.ground_el_names.tolist(),
+            "scales": rec.scales.tolist(),
+            "offsets": rec.offsets.tolist(),
+            "info": info}
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as meta_file:
+        json.dump(meta, meta_file)
+
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def load_cached(key: str,
+                raw: bool = False,
+                precision=np.float64,
+                storage: str = "shm"
+                ) -> tuple[Recording, str] | None:
+    """
+    Loads the metadata of a cache entry and creates a recording that reads
+    its data from the cache.
+
+    :param key: the cache key.
+    :type key: str
+
+    :param raw: if True, the selection is stored as int16 ADC counts.
+    :type raw: bool
+
+    :param precision: floating point type of the data and derived arrays.
+    :type precision: np.dtype
+
+    :param storage: "shm" for shared memory or "disk" for a memory-mapped file.
+    :type storage: str
+
+    :return: the recording and the info string or None if there is no entry
+    :rtype: tuple[Recording, str] | None
+    """
+    data_path, meta_path = cache_paths(key)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path, "r", encoding="utf-8") as meta_file:
+        meta = json.load(meta_file)
+    # marks the entry as recently used, see evict_cached
+    os.utime(meta_path)
+
+    # entries written before the ADC parameters were stored are re-imported
+    if "scales" not in meta:
+        return None
+
+    shape = tuple(meta["shape"])
+    scales = np.array(meta["scales"])
+    offsets = np.array(meta["offsets"])
+    rec = Recording(meta["fname"],
+                    datetime.datetime.fromisoformat(meta["date"]),
+                    meta["n_electrodes"],
+                    meta["sampling_rate"],
+                    None,
+                    0,
+                    shape[1] - 1,
+                    np.array(meta["names"]),
+                    np.array(meta["ground_els"]),
+                    np.array(meta["ground_el_names"]),
+                    loader=partial(cache_read_window, data_path, shape,
+                                   meta["dtype"], scales, offsets),
+                    n_samples=shape[1],
+                    scales=scales,
+                    offsets=offsets,
+                    raw=raw,
+                    precision=precision,
+                    storage=storage)
+
+    return rec, meta["info"]
+
+
+def evict_cached(max_bytes: int = cache_max_bytes,
+                 keep: Optional[str] = None) -> None:
+    """
+    Removes the least recently opened cache entries until the cache holds at
+    most max_bytes. An entry is used whenever it is stored or loaded, which
+    updates the modification time of its metadata file.
+
+    :param max_bytes: the number of bytes the cache may hold.
+    :type max_bytes: int
+
+    :param keep: the key of an entry that is never removed, e.g. the one
+        just stored.
+    :type keep: str
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        key, ext = os.path.splitext(name)
+        if ext != ".json" or key == keep:
+            continue
+        try:
+            paths = cache_paths(key)
+            used = os.stat(paths[1]).st_mtime
+            n_bytes = sum(os.stat(path).st_size for path in paths)
+        except FileNotFoundError:
+            # incomplete or removed concurrently, e.g. by a batch worker
+            continue
+        entries.append((used, n_bytes, paths))
+
+    total = sum(n_bytes for _, n_bytes, _ in entries)
+    if keep is not None:
+        total += sum(os.stat(path).st_size for path in cache_paths(keep)
+                     if os.path.exists(path))
+    for _, n_bytes, paths in sorted(entries):
+        if total <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= n_bytes
+
+
+def cache_read_window(data_path: str,
+                      shape: tuple[int, int],
+                      dtype: str,
+                      scales: np.ndarray,
+                      offsets: np.ndarray,
+                      out: np.ndarray,
+                      rows: list[int] | np.ndarray,
+                      start: int,
+                      stop: int):
+    """
+    Reads the given rows and time window from a cached data matrix.
+    ADC counts are copied if out is of integer type and scaled to volts
+    otherwise. Volts can not be read into an integer array.
+
+    :param data_path: the path of the cached data matrix.
+    :type data_path: str
+
+    :param shape: the shape of the cached data matrix.
+    :type shape: tuple[int, int]
+
+    :param dtype: the data type of the cached data matrix.
+    :type dtype: str
+
+    :param scales: the ADC step size per row.
+    :type scales: np.ndarray
+
+    :param offsets: the ADC offset per row.
+    :type offsets: np.ndarray
+
+    :param out: array of shape (len(rows), stop - start) to write into.
+    :type out: np.ndarray
+
+    :param rows: the rows to read.
+    :type rows: list[int] | np.ndarray
+
+    :param start: the first sample to read.
+    :type start: int
+
+    :param stop: the sample after the last one to read.
+    :type stop: int
+    """
+    data = np.memmap(data_path, dtype=dtype, mode="r", shape=shape)
+    window = np.take(data[:, start:stop], rows, axis=0)
+    counts = np.issubdtype(data.dtype, np.integer)
+    if np.issubdtype(out.dtype, np.integer):
+        if not counts:
+            raise ValueError("The cache holds volts, ADC counts can not be "
+                             "read from it.")
+        out[:] = window
+        return
+
+    if counts:
+        rows = np.asarray(rows)
+        window = np.subtract(window, offsets[rows].reshape(-1, 1),
+                             dtype=out.dtype)
+        window *= scales[rows].reshape(-1, 1).astype(out.dtype)
+    out[:] = window
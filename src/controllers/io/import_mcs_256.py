@@ -6,55 +6,101 @@ Importer for multi channel systems 256MEAs chip, assuming all data is in a
 single analog stream in the same recording.
 """
 import datetime
+from functools import partial
 from multiprocessing import Queue
+from typing import Optional, TYPE_CHECKING
 
-import McsPy.McsData as Mcs256
+import h5py
 import numpy as np
 from tabulate import tabulate
 
-from model.data import Recording
+from model.data import Recording, allocate_array
 
+if TYPE_CHECKING:
+    import McsPy.McsData as Mcs256
 
-def mcs_256_import(path: str, que: Queue) -> None:
+
+# Version of the import, i.e. of the correction and ordering of the data.
+# Increase it whenever the imported data changes to invalidate the caches,
+# see controllers/io/cache.py.
+IMPORTER_VERSION = 1
+
+# Groups of a recording in the HDF5 file that contain streams.
+STREAM_GROUPS = ["AnalogStream", "FrameStream", "EventStream",
+                 "SegmentStream", "TimeStampStream"]
+
+# The analog stream holding the samples of all electrodes.
+CHANNEL_DATA = "Data/Recording_0/AnalogStream/Stream_0/ChannelData"
+
+# Upper bound for the size of the blocks that are read from the HDF5 file at
+# once during import. Keeps the peak memory at about one output buffer.
+CHUNK_BYTES = 64 * 1024**2
+
+
+def mcs_256_import(path: str,
+                   que: Optional[Queue],
+                   chunk_len: Optional[int] = None,
+                   lazy: bool = False,
+                   raw: bool = False,
+                   precision=np.float64,
+                   storage: str = "shm"
+                   ) -> None:
     """
     Import data recorded with a MultiChannel Systems MEA into A Data object, \
             see model/Data.py.
+    The analog stream is streamed from the file in time chunks directly into
+    the shared memory of the Recording, correcting the ADC values and
+    reordering the rows while copying.
+    In lazy mode only the metadata is read. The selected electrodes and time
+    window are read later on by mcs_256_read_window, see
+    controllers/select.py::apply_selection.
 
         :param path: the path to the file containing the data in McS h5 format.
-        :param que: A python Queue, to return the loaded data asynchronously.
+        :param que: A queue to report the progress of reading the data to as
+                ("progress", bytes done, bytes total) tuples, or None.
+        :param chunk_len: number of samples per channel to read at once. If
+                None it is derived from the chunking of the HDF5 data set and
+                CHUNK_BYTES.
+        :param lazy: if True, only read the metadata and defer reading the
+                data until the selection is applied.
+        :param raw: if True, keep the int16 ADC counts and the per channel
+                ADC step sizes and offsets instead of float64 volts, i.e. use
+                a quarter of the memory.
+        :param precision: floating point type of the data and all derived
+                arrays, np.float64 or np.float32.
+        :param storage: "shm" to keep the data in shared memory or "disk" to
+                keep it in a memory-mapped file, for files larger than RAM.
 
         :return a Data object containing the data in-memory and metadata or \
                 None and an error message
     """
+    # McsPy takes a second to import, see lazy_import.py
+    import McsPy.McsData as Mcs256
+
     fname = path.split('/')[-1].split('.')[0]
 
     Mcs256.VERBOSE = False
+    data = None
     try:
         file_contents = Mcs256.RawData(path)
         date = file_contents.date
         stream = file_contents.recordings[0].analog_streams[0]
         sampling_rate = stream.channel_infos[2].sampling_frequency.magnitude
-        data = np.array(stream.channel_data, dtype=np.double)
-
-        channel_row_map = {}
 
-        for i in [c.channel_id for c in stream.channel_infos.values()]:
-            channel_row_map[i] = stream.channel_infos[i].row_index
-
-        # correct signal values, see MCS implementation:
-        # https://mcspydatatools.readthedocs.io/en/latest/api.html#Mcs256.AnalogStream.get_channel_in_range
-        for i in [c.channel_id for c in stream.channel_infos.values()]:
-            adc_step = stream.channel_infos[i].adc_step.magnitude
-            ad_zero = stream.channel_infos[i].get_field('ADZero')
-            data[channel_row_map[i]] = ((data[channel_row_map[i]] - ad_zero)
-                                        * adc_step)
-
-        with (open("assets/mcs_256mea_mapping.txt", "r", encoding="utf-8")
-                as ids_file):
-            order = np.array([int(v) for v in ids_file.read().split(",")
-                              if v.strip() != ''])
-
-        data = data[order]
+        order = load_electrode_order()
+        n_samples = stream.channel_data.shape[1]
+        ad_zeros, adc_steps = adc_correction(stream)
+        ad_zeros = ad_zeros[order]
+        adc_steps = adc_steps[order]
+
+        if lazy:
+            data = None
+        else:
+            data = allocate_array((order.shape[0], n_samples),
+                                  np.int16 if raw else precision, storage)
+            stream_channel_data(stream.channel_data, data.read(), order,
+                                ad_zeros, adc_steps, chunk_len=chunk_len,
+                                que=que)
 
         n_mea_electrodes = 256
         side_len = int(np.sqrt(n_mea_electrodes))
@@ -70,21 +116,274 @@ def mcs_256_import(path: str, que: Queue) -> None:
 
         info = mcs_info(path, file_contents)
         rec = Recording(fname, date, n_mea_electrodes, sampling_rate, data, 0,
-                        data.shape[1] - 1, names, ground_els, ground_el_names)
+                        n_samples - 1, names, ground_els, ground_el_names,
+                        loader=partial(mcs_256_read_window, path, ad_zeros,
+                                       adc_steps),
+                        n_samples=n_samples, scales=adc_steps,
+                        offsets=ad_zeros, raw=raw, precision=precision,
+                        storage=storage)
         del file_contents
 
-    except IOError as err:
+    except (IOError, ValueError) as err:
+        # the partially filled buffer is not owned by any recording yet
+        if data is not None:
+            data.free()
         info = "Failed to import specified file! Please specify a valid" \
                 + " multi channel systems H5 formatted file.\n" \
                 + "Error: " + str(err)
         rec = None
 
-    # que.put((data, info))
     return rec, info
 
 
+def mcs_256_read_window(path: str,
+                        ad_zeros: np.ndarray,
+                        adc_steps: np.ndarray,
+                        out: np.ndarray,
+                        rows: list[int] | np.ndarray,
+                        start: int,
+                        stop: int
+                        ) -> None:
+    """
+    Reads only the given electrodes and time window from the file, i.e. the
+    corresponding hyperslab of the analog stream, with ADC correction.
+    The file is opened with h5py directly, as parsing it with McsPy takes
+    much longer than reading a small window, e.g. for a preview. The ADC
+    correction was read from the channel infos during the import already.
+
+        :param path: the path to the file containing the data in McS h5 format.
+        :param ad_zeros: ADC offsets, aligned to the rows of the data matrix.
+        :param adc_steps: ADC step sizes, aligned to the rows of the data
+                matrix.
+        :param out: array of shape (len(rows), stop - start) to write into.
+                If it is of integer type, the ADC counts are written.
+        :param rows: the electrodes to read, as rows of the data matrix, i.e.
+                excluding the ground electrodes.
+        :param start: index of the first sample to read.
+        :param stop: index after the last sample to read.
+    """
+    rows = np.asarray(rows)
+    with h5py.File(path, "r") as h5_file:
+        stream_channel_data(h5_file[CHANNEL_DATA], out,
+                            load_electrode_order()[rows], ad_zeros[rows],
+                            adc_steps[rows], start=start)
+
+
+def load_electrode_order() -> np.ndarray:
+    """
+    Reads the mapping from the rows of the analog stream to the row-major
+    layout of the electrodes on the MEA.
+
+        :return the row of the analog stream for every electrode, excluding
+                the ground electrodes.
+    """
+    with (open("assets/mcs_256mea_mapping.txt", "r", encoding="utf-8")
+            as ids_file):
+        order = np.array([int(v) for v in ids_file.read().split(",")
+                          if v.strip() != ''])
+
+    return order
+
+
+def adc_correction(stream: "Mcs256.AnalogStream"
+                   ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Collects the ADC offsets and step sizes of all channels in the stream.
+    The signal values are corrected by (value - ad_zero) * adc_step, see the
+    MCS implementation:
+    https://mcspydatatools.readthedocs.io/en/latest/api.html#Mcs256.AnalogStream.get_channel_in_range
+
+        :param stream: the analog stream to read the channel infos from.
+
+        :return the ADC offsets and step sizes, indexed by the rows of the
+                stream.
+    """
+    n_rows = stream.channel_data.shape[0]
+    ad_zeros = np.zeros(n_rows)
+    adc_steps = np.ones(n_rows)
+
+    for info in stream.channel_infos.values():
+        ad_zeros[info.row_index] = info.get_field('ADZero')
+        adc_steps[info.row_index] = info.adc_step.magnitude
+
+    return ad_zeros, adc_steps
+
+
+def stream_channel_data(channel_data,
+                        out: np.ndarray,
+                        rows: np.ndarray,
+                        ad_zeros: np.ndarray,
+                        adc_steps: np.ndarray,
+                        start: int = 0,
+                        chunk_len: Optional[int] = None,
+                        que: Optional[Queue] = None
+                        ) -> None:
+    """
+    Copies the HDF5 channel data in time chunks into the output array,
+    selecting and reordering the rows and applying the ADC correction on the
+    way. Only one chunk of raw values is held in memory at a time. If not all
+    rows are requested, only the requested ones are read from the file.
+    If out is of integer type, the ADC counts are copied without correction.
+
+        :param channel_data: h5py data set of shape (n_channels, n_samples).
+        :param out: array of shape (len(rows), n_samples) to write into.
+        :param rows: the rows of channel_data to copy, in the order in which
+                they are written to out.
+        :param ad_zeros: ADC offsets, aligned to the rows of out.
+        :param adc_steps: ADC step sizes, aligned to the rows of out.
+        :param start: the sample of channel_data that is written to the first
+                column of out.
+        :param chunk_len: number of samples per channel to read at once.
+        :param que: queue to report ("progress", bytes done, bytes total) to
+                after every chunk, or None.
+    """
+    n_samples = out.shape[1]
+    row_bytes = out.shape[0] * out.dtype.itemsize
+    if chunk_len is None:
+        chunk_len = import_chunk_len(channel_data)
+
+    # h5py only supports reading rows in increasing order, so read the
+    # requested rows sorted and reorder them in memory.
+    rows = np.asarray(rows)
+    if np.unique(rows).shape[0] == channel_data.shape[0]:
+        read_rows = slice(None)
+    else:
+        read_rows, rows = np.unique(rows, return_inverse=True)
+
+    counts = np.issubdtype(out.dtype, np.integer)
+    ad_zeros = ad_zeros.reshape(-1, 1)
+    adc_steps = adc_steps.reshape(-1, 1)
+    for offset in range(0, n_samples, chunk_len):
+        stop = min(offset + chunk_len, n_samples)
+        raw = channel_data[read_rows, start + offset:start + stop]
+        block = out[:, offset:stop]
+
+        if counts:
+            limits = np.iinfo(out.dtype)
+            if raw.min() < limits.min or raw.max() > limits.max:
+                raise ValueError(f"ADC counts do not fit into {out.dtype}")
+            block[:] = raw[rows]
+        else:
+            np.subtract(raw[rows], ad_zeros, out=block, casting='unsafe')
+            np.multiply(block, adc_steps, out=block, casting='unsafe')
+
+        if que is not None:
+            que.put(("progress", stop * row_bytes, n_samples * row_bytes))
+
+
+def import_chunk_len(channel_data) -> int:
+    """
+    Chooses the number of samples per channel to read at once, such that a
+    chunk holds at most CHUNK_BYTES and is aligned to the chunks of the HDF5
+    data set, if it is chunked.
+
+        :param channel_data: h5py data set of shape (n_channels, n_samples).
+
+        :return the number of samples per channel to read at once.
+    """
+    n_rows = channel_data.shape[0]
+    chunk_len = max(1, CHUNK_BYTES // (n_rows * channel_data.dtype.itemsize))
+
+    if channel_data.chunks is not None:
+        h5_len = channel_data.chunks[1]
+        chunk_len = max(h5_len, chunk_len // h5_len * h5_len)
+
+    return chunk_len
+
+
+def mcs_256_probe(path: str) -> dict:
+    """
+    Reads the metadata of a multi channel systems file without loading any
+    samples, i.e. only HDF5 attributes, dataset shapes and the first row of
+    the channel info table. Unlike McsPy.McsData.RawData, it does not parse
+    all channel and stream infos, so it takes about a millisecond per file.
+
+        :param path: the path to the file containing the data in McS h5 format.
+
+        :return a dict with the path, date, sampling rate [Hz], number of
+                channels and samples, duration [s], program, version,
+                comment, MEA name and layout and the streams as list of
+                [type, label, # ch] rows.
+    """
+    with h5py.File(path, "r") as h5_file:
+        session = h5_file["Data"].attrs
+        recording = h5_file["Data/Recording_0"]
+
+        streams = []
+        for group in STREAM_GROUPS:
+            if group not in recording:
+                continue
+            for stream in recording[group].values():
+                infos = [key for key in stream if key.startswith("Info")]
+                n_channels = stream[infos[0]].shape[0] if infos else ""
+                streams.append([attr_str(stream.attrs.get("StreamType", "")),
+                                attr_str(stream.attrs.get("Label", "")),
+                                n_channels])
+
+        channel_data = recording["AnalogStream/Stream_0/ChannelData"]
+        # the tick is the sampling period in microseconds
+        tick = recording["AnalogStream/Stream_0/InfoChannel"][0]["Tick"]
+        sampling_rate = 1e6 / tick
+        n_channels, n_samples = channel_data.shape
+
+        delta = datetime.timedelta(
+                microseconds=int(session["DateInTicks"]) / 10)
+
+        return {"path": path,
+                "date": datetime.datetime(1, 1, 1) + delta,
+                "sampling_rate": sampling_rate,
+                "n_channels": n_channels,
+                "n_samples": n_samples,
+                "duration": n_samples / sampling_rate,
+                "program": attr_str(session.get("ProgramName", "")),
+                "version": attr_str(session.get("ProgramVersion", "")),
+                "comment": attr_str(session.get("Comment", "")),
+                "mea_name": attr_str(session.get("MeaName", "")),
+                "mea_layout": attr_str(session.get("MeaLayout", "")),
+                "streams": streams}
+
+
+def attr_str(value) -> str:
+    """
+    Converts a string attribute of a McS h5 file, stored as bytes, to str.
+
+        :param value: the attribute value.
+
+        :return the value as str without trailing whitespace.
+    """
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+
+    return str(value).rstrip()
+
+
+def probe_info(probe: dict) -> str:
+    """
+    Formats the result of mcs_256_probe like mcs_info.
+
+        :param probe: the dict returned by mcs_256_probe
+
+        :return the information formatted as tables
+    """
+    header_info = "\nFile path:" + probe["path"] + "\n\n"
+    t_row = [probe["date"].strftime("%Y-%m-%d %H:%M:%S"), probe["program"],
+             probe["version"], probe["comment"], probe["mea_name"],
+             probe["mea_layout"]]
+    table_header = ["Date", "Program", "Version", "Comment", "MEA System Name",
+                    "MEA Layout"]
+    header_info += tabulate([t_row], headers=table_header) + "\n\n"
+
+    size_row = [probe["sampling_rate"], probe["n_channels"],
+                probe["n_samples"], f"{probe['duration']:.1f}"]
+    size_header = ["Sampling rate [Hz]", "# ch", "# samples", "Duration [s]"]
+    header_info += tabulate([size_row], headers=size_header) + "\n\n"
+
+    return header_info + tabulate(probe["streams"],
+                                  headers=["Type", "Stream", "# ch"])
+
+
 def mcs_header_info(h5filename: str,
-                    data: Mcs256.RawData
+                    data: "Mcs256.RawData"
                     ) -> str:
     """
     Prints infos that are contained in the header of the McS h5 file, like \
@@ -112,7 +411,7 @@ def mcs_header_info(h5filename: str,
     return header_info + tabulate(real_row, headers=table_header)
 
 
-def mcs_info(h5filename: str, data: Mcs256.RawData) -> str:
+def mcs_info(h5filename: str, data: "Mcs256.RawData") -> str:
     """
     Prints infos about the McS h5 file and the available stream(s)
 
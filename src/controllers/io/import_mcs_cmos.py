@@ -2,174 +2,312 @@
 :author: Fabian Klopfer <fabian.klofper@ieee.org>
 :date:   21.04.2023
 
-Importer for multi channel systems 256MEAs chip, assuming all data is in a single \
-        analog stream in the same recording.
+Importer for multi channel systems CMOS-MEAs, assuming all data is in the
+first sensor stream of the acquisition, stored as a cube of
+(frames, sensor rows, sensor columns) ADC values.
+
+CMOS chips have thousands of sensors, so the cube is never loaded at once.
+It is streamed in blocks of frames, only reading the bounding box of the
+requested sensors, and converted to volts, or kept as int16 ADC values, while
+copying into the buffer of the Recording.
 """
 import datetime
+from functools import partial
 from multiprocessing import Queue
 import os.path
+from typing import Optional
 
-import McsPy
-import McsPy.McsCMOSMEA as McsCMOS
+import h5py
 import numpy as np
 from tabulate import tabulate
 
-from model.Data import Data
+from controllers.io.import_mcs_256 import CHUNK_BYTES, attr_str
+from model.data import Recording, allocate_array
 
 
-def mcs_cmos_import(path: str, que: Queue) -> None:
+def mcs_cmos_import(path: str,
+                    que: Optional[Queue],
+                    roi: Optional[tuple[int, int, int, int]] = None,
+                    lazy: bool = False,
+                    raw: bool = False,
+                    precision=np.float64,
+                    storage: str = "shm"
+                    ) -> tuple[Optional[Recording], str]:
     """
-    Import data recorded with a MultiChannel Systems MEA into A Data object, \
-            see model/Data.py.
-
-        @param path: the path to the file containing the data in McS h5 format.
-        @param que: A python Queue, to return the loaded data asynchronously.
-
-        @return a Data object containing the data in-memory and metadata or \
-                None and an error message
+    Import data recorded with a MultiChannel Systems CMOS-MEA into a Recording
+            object, see model/data.py.
+    The sensor cube is streamed from the file in blocks of frames directly
+    into the buffer of the Recording. In lazy mode only the metadata is read
+    and the selected sensors and time window are read later on by
+    mcs_cmos_read_window, see controllers/select.py::apply_selection.
+
+        :param path: the path to the file containing the data in McS h5 format.
+        :param que: A queue to report the progress of reading the data to as
+                ("progress", bytes done, bytes total) tuples, or None.
+        :param roi: region of interest as (first row, row after the last,
+                first column, column after the last) of the sensors, 0-based.
+                If None, all sensors are imported. The electrode grid of the
+                select screen requires a square region.
+        :param lazy: if True, only read the metadata and defer reading the
+                data until the selection is applied.
+        :param raw: if True, keep the int16 ADC values and the per sensor
+                conversion factors and offsets instead of volts.
+        :param precision: floating point type of the data and all derived
+                arrays, np.float64 or np.float32.
+        :param storage: "shm" to keep the data in shared memory or "disk" to
+                keep it in a memory-mapped file.
+
+        :return a Recording containing the metadata and, if not lazy, the
+                data or None and an error message
     """
     if path is None or not os.path.exists(path):
         return None, "File does not exist or invalid path!"
 
-    McsCMOS.VERBOSE = False
+    fname = os.path.basename(path).split('.')[0]
+
+    data = None
     try:
-        file_contents = McsCMOS.McsData(path)
-        date = file_contents.attributes['DateTime']
-        stream = file_contents.Acquisition.Sensor_Data
-        num_channels = stream.SensorData_1_1.shape[-1] ** 2
-        sampling_rate = int(np.round(stream.SensorMeta.Tick * 1e-6))
-        print(stream.SensorMeta.Tick) # 50
-        print(stream.SensorMeta.Label) # ROI
-        print(stream.SensorMeta.RawDataType) # short
-        print(stream.SensorMeta.Unit) # V
-        print(stream.SensorMeta.Exponent) # -9
-        print(stream.SensorMeta.ADCBits) # 16
-        print(stream.SensorMeta['Conversion Factors']) # all arround 45000
-
-        data = np.array(np.moveaxis(stream.SensorData_1_1, 0, -1), dtype=np.float64)
-        data = data.reshape(num_channels, -1)
-        print(data.shape)
-        exit(0)
-
-        channel_row_map = {}
-        row_order = None
-
-        for i in [c.channel_id for c in stream.channel_infos.values()]:
-            row = stream.channel_infos[i].row_index
-            channel_row_map[i] = row
-
-        # correct signal values, see MCS implementation:
-        # https://mcspydatatools.readthedocs.io/en/latest/api.html#McsCMOS.AnalogStream.get_channel_in_range
-        for i in [c.channel_id for c in stream.channel_infos.values()]:
-            adc_step = stream.channel_infos[i].adc_step.magnitude
-            ad_zero = stream.channel_infos[i].get_field('ADZero')
-            data[channel_row_map[i]] = ((data[channel_row_map[i]] - ad_zero)
-                                        * adc_step)
-
-        # TODO handle CMOS case and potentially others
-        with open("assets/mcs_256mea_mapping.txt", "r") as ids_file:
-            order = np.array([int(v) for v in ids_file.read().split(",") \
-                    if v.strip() != ''])
-
-        data = data[order]
-
-        # TODO handle CMOS case and potentially others
-        temp_data = np.concatenate((np.nan * np.ones((1, data.shape[1])), # 0
-                                    data[0:14],                        # 1:14
-                                    np.nan * np.ones((1, data.shape[1])), # 15
-                                    data[14:238],                      # 14+2:238+1
-                                    np.nan * np.ones((1, data.shape[1])), # 240
-                                    data[238:],                        # 238+3:251+3
-                                    np.nan * np.ones((1, data.shape[1])) # 255
-                                    ), axis=0)
-        grounds = [0, 15, 240, 255]
-        data = temp_data
-  #      info = mcs_info(path, file_contents)
-        data = Data(date, sampling_rate, data, grounds)
-        del file_contents
-
-    except IOError as err:
+        with h5py.File(path, "r") as h5_file:
+            sensor_data, meta = sensor_stream(h5_file)
+            n_frames, height, width = sensor_data.shape
+            if roi is None:
+                roi = (0, height, 0, width)
+            if not (0 <= roi[0] < roi[1] <= height
+                    and 0 <= roi[2] < roi[3] <= width):
+                raise ValueError(f"ROI {roi} exceeds the sensor grid "
+                                 f"{height}x{width}")
+
+            # the tick is the sampling period in microseconds
+            sampling_rate = 1e6 / meta["Tick"]
+            offsets, scales = cmos_conversion(meta, roi, height, width)
+            roi_h, roi_w = roi[1] - roi[0], roi[3] - roi[2]
+            rows = np.arange(roi_h * roi_w)
+
+            if lazy:
+                data = None
+            else:
+                data = allocate_array((rows.shape[0], n_frames),
+                                      np.int16 if raw else precision, storage)
+                stream_sensor_data(sensor_data, data.read(), roi, rows,
+                                   offsets, scales, que=que)
+
+            date = cmos_date(h5_file, path)
+            info = mcs_cmos_info(path, h5_file, sensor_data, meta, roi)
+
+        names = np.array([f"R {i} C {j}"
+                          for i in range(roi[0] + 1, roi[1] + 1)
+                          for j in range(roi[2] + 1, roi[3] + 1)])
+        rec = Recording(fname, date, rows.shape[0], sampling_rate, data, 0,
+                        n_frames - 1, names, np.array([], dtype=int),
+                        np.array([], dtype=str),
+                        loader=partial(mcs_cmos_read_window, path, roi),
+                        n_samples=n_frames, scales=scales, offsets=offsets,
+                        raw=raw, precision=precision, storage=storage)
+
+    except (IOError, KeyError, ValueError) as err:
+        # the partially filled buffer is not owned by any recording yet
+        if data is not None:
+            data.free()
         info = "Failed to import specified file! Please specify a valid" \
-                + " multi channel systems H5 formatted file.\n" \
+                + " multi channel systems CMOS-MEA H5 formatted file.\n" \
                 + "Error: " + str(err)
-        data = None
+        rec = None
 
-    que.put((data, info))
+    return rec, info
 
 
-def mcs_header_info(h5filename: str,
-                    data: McsCMOS.RawData
-                    ) -> str:
+def mcs_cmos_read_window(path: str,
+                         roi: tuple[int, int, int, int],
+                         out: np.ndarray,
+                         rows: list[int] | np.ndarray,
+                         start: int,
+                         stop: int
+                         ) -> None:
     """
-    Prints infos that are contained in the header of the McS h5 file, like \
-            the MEA name, the version, ...
+    Reads only the given sensors and time window from the file, i.e. the
+    bounding box of the sensors in the frames of the time window, with
+    conversion to volts.
+
+        :param path: the path to the file containing the data in McS h5 format.
+        :param roi: the region of interest the recording was imported with.
+        :param out: array of shape (len(rows), stop - start) to write into.
+                If it is of integer type, the ADC values are written.
+        :param rows: the sensors to read, as rows of the data matrix, i.e.
+                row-major indices into the region of interest.
+        :param start: index of the first frame to read.
+        :param stop: index after the last frame to read.
+    """
+    with h5py.File(path, "r") as h5_file:
+        sensor_data, meta = sensor_stream(h5_file)
+        _, height, width = sensor_data.shape
+        offsets, scales = cmos_conversion(meta, roi, height, width)
+        rows = np.asarray(rows)
+        stream_sensor_data(sensor_data, out, roi, rows, offsets[rows],
+                           scales[rows], start=start)
 
-        @param h5filename: Name of the file containing the data.
-        @param data: McsPy.McData.RawData object
 
-        @return the information formatted as a table
+def sensor_stream(h5_file: h5py.File) -> tuple[h5py.Dataset, np.void]:
     """
-    header_info = "\nFile path:" + h5filename + "\n\n"
-    t_row = []
-    delta = datetime.timedelta(microseconds=int(data.date_in_clr_ticks) / 10)
-    date = datetime.datetime(1, 1, 1) + delta
-    t_row.append(str(date.strftime("%Y-%m-%d %H:%M:%S")))
-    t_row.append(data.program_name)
-    t_row.append(data.program_version)
-    t_row.append(data.comment)
-    t_row.append(data.mea_name)
-    t_row.append(data.mea_layout)
-    real_row = [t_row]
-    table_header = ["Date", "Program", "Version", "Comment", "MEA System Name",
-                    "MEA Layout"]
-
-    return header_info + tabulate(real_row, headers=table_header)
-
-
-def mcs_info(h5filename: str, data: McsCMOS.RawData) -> str:
+    Finds the sensor data cube and its meta data in a CMOS-MEA file.
+
+        :param h5_file: the opened file.
+
+        :return the data set of shape (frames, sensor rows, sensor columns)
+                and the row of the sensor meta data table belonging to it.
     """
-    Prints infos about the McS h5 file and the available stream(s)
+    streams = h5_file["Acquisition"]
+    stream = next(streams[key] for key in streams
+                  if key.startswith("Sensor")
+                  and isinstance(streams[key], h5py.Group))
+    data_key = sorted(key for key in stream if key.startswith("SensorData"))[0]
+    meta = stream["SensorMeta"][0]
+
+    return stream[data_key], meta
 
-        @param h5filename: Name of the file containing the data.
-        @param data: : the object returned by calling McsPy.McData.RawData
 
-        @return the information formatted as a table
+def cmos_conversion(meta: np.void,
+                    roi: tuple[int, int, int, int],
+                    height: int,
+                    width: int
+                    ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the ADC offset and step size of each sensor in the region of
+    interest, such that volts = (value - offset) * step.
+    The step size is the conversion factor of the sensor times
+    10 ** exponent. Files without ADZero field have an offset of 0.
+
+        :param meta: the row of the sensor meta data table.
+        :param roi: the region of interest.
+        :param height: the number of sensor rows of the data cube.
+        :param width: the number of sensor columns of the data cube.
+
+        :return the offsets and step sizes, one per sensor of the region of
+                interest in row-major order.
+    """
+    names = meta.dtype.names
+    factors = np.broadcast_to(np.asarray(meta["Conversion Factors"],
+                                         dtype=np.float64).reshape(-1),
+                              height * width).reshape(height, width)
+    scales = factors[roi[0]:roi[1], roi[2]:roi[3]].reshape(-1) \
+        * 10.0 ** int(meta["Exponent"])
+
+    ad_zero = float(meta["ADZero"]) if "ADZero" in names else 0.0
+    offsets = np.full(scales.shape[0], ad_zero)
+
+    return offsets, scales
+
+
+def stream_sensor_data(sensor_data: h5py.Dataset,
+                       out: np.ndarray,
+                       roi: tuple[int, int, int, int],
+                       rows: np.ndarray,
+                       offsets: np.ndarray,
+                       scales: np.ndarray,
+                       start: int = 0,
+                       que: Optional[Queue] = None
+                       ) -> None:
+    """
+    Copies the sensor cube in blocks of frames into the output array,
+    selecting the requested sensors and applying the conversion on the way.
+    Only the bounding box of the requested sensors is read from the file.
+    If out is of integer type, the ADC values are copied without conversion.
+
+        :param sensor_data: h5py data set of shape (frames, rows, columns).
+        :param out: array of shape (len(rows), n_frames) to write into.
+        :param roi: the region of interest the rows refer to.
+        :param rows: the row-major indices of the sensors in the region of
+                interest, in the order in which they are written to out.
+        :param offsets: ADC offsets, aligned to the rows of out.
+        :param scales: ADC step sizes, aligned to the rows of out.
+        :param start: the frame that is written to the first column of out.
+        :param que: queue to report ("progress", bytes done, bytes total) to
+                after every block, or None.
     """
-    print(file_contents)
-    print(stream)
-     # print(stream.Acquisition_Info)
-     # print(stream.Acquisition_Info.ChannelData_1)
-     # print(stream.Acquisition_Info.ChannelMeta)
-     # What is channel data?!
-    print(stream.Sensor_Data)
-    print(stream.Sensor_Data.SensorData_1_1)
-    print(stream.Sensor_Data.SensorMeta)
-    info_string = mcs_header_info(h5filename, data) + "\n\n"
-    recording = data.recordings[0]
-
-    if recording is None:
-        return ""
-
-    all_rows = []
-    table_header = ["Type", "Stream", "# ch"]
-
-    streams = vars(recording).items()
-    for key, value in streams:
-        if value is None or key not in ["_Recording__analog_streams",
-                                        "_Recording__frame_streams",
-                                        "_Recording__event_streams",
-                                        "_Recording__segment_streams",
-                                        "_Recording__timestamp_streams"]:
-            continue
-
-        for _, stream in value.items():
-            row = [stream.stream_type, stream.label]
-
-            try:
-                row.append(len(stream.channel_infos))
-            except AttributeError:
-                row.append("")
-
-            all_rows.append(row)
-
-    return info_string + tabulate(all_rows, headers=table_header)
+    n_frames = out.shape[1]
+    row_bytes = out.shape[0] * out.dtype.itemsize
+    roi_w = roi[3] - roi[2]
+
+    # bounding box of the requested sensors on the chip
+    sensor_rows = roi[0] + rows // roi_w
+    sensor_cols = roi[2] + rows % roi_w
+    top, bottom = sensor_rows.min(), sensor_rows.max() + 1
+    left, right = sensor_cols.min(), sensor_cols.max() + 1
+    box_idx = (sensor_rows - top) * (right - left) + (sensor_cols - left)
+
+    box_bytes = (bottom - top) * (right - left) * sensor_data.dtype.itemsize
+    block_len = max(1, CHUNK_BYTES // box_bytes)
+    if sensor_data.chunks is not None:
+        h5_len = sensor_data.chunks[0]
+        block_len = max(h5_len, block_len // h5_len * h5_len)
+
+    counts = np.issubdtype(out.dtype, np.integer)
+    offsets = offsets.reshape(-1, 1)
+    scales = scales.reshape(-1, 1)
+    for offset in range(0, n_frames, block_len):
+        stop = min(offset + block_len, n_frames)
+        frames = sensor_data[start + offset:start + stop, top:bottom,
+                             left:right]
+        # (frames, sensors) -> (sensors, frames)
+        raw = frames.reshape(stop - offset, -1)[:, box_idx].T
+        block = out[:, offset:stop]
+
+        if counts:
+            block[:] = raw
+        else:
+            np.subtract(raw, offsets, out=block, casting='unsafe')
+            np.multiply(block, scales, out=block, casting='unsafe')
+
+        if que is not None:
+            que.put(("progress", stop * row_bytes, n_frames * row_bytes))
+
+
+def cmos_date(h5_file: h5py.File, path: str) -> datetime.datetime:
+    """
+    Reads the date of the recording from the root attributes of the file,
+    falling back to the modification time of the file.
+
+        :param h5_file: the opened file.
+        :param path: the path of the file.
+
+        :return the date of the recording.
+    """
+    try:
+        return datetime.datetime.fromisoformat(
+                attr_str(h5_file.attrs["DateTime"]))
+    except (KeyError, ValueError):
+        return datetime.datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def mcs_cmos_info(h5filename: str,
+                  h5_file: h5py.File,
+                  sensor_data: h5py.Dataset,
+                  meta: np.void,
+                  roi: tuple[int, int, int, int]
+                  ) -> str:
+    """
+    Formats infos that are contained in the header of the McS CMOS-MEA file
+    and about the sensor stream.
+
+        :param h5filename: Name of the file containing the data.
+        :param h5_file: the opened file.
+        :param sensor_data: the data set of the sensor cube.
+        :param meta: the row of the sensor meta data table.
+        :param roi: the imported region of interest.
+
+        :return the information formatted as tables
+    """
+    header_info = "\nFile path:" + h5filename + "\n\n"
+    t_row = [attr_str(h5_file.attrs.get(key, ""))
+             for key in ["DateTime", "ProgramName", "ProgramVersion"]]
+    header_info += tabulate([t_row], headers=["Date", "Program", "Version"])
+
+    n_frames, height, width = sensor_data.shape
+    s_row = [attr_str(meta["Label"]) if "Label" in meta.dtype.names else "",
+             f"{height}x{width}",
+             f"{roi[0] + 1}-{roi[1]}, {roi[2] + 1}-{roi[3]}",
+             1e6 / meta["Tick"],
+             n_frames]
+    s_header = ["Stream", "Sensors", "Imported rows, cols",
+                "Sampling rate [Hz]", "# frames"]
+
+    return header_info + "\n\n" + tabulate([s_row], headers=s_header)
@@ -2,30 +2,126 @@
 TODO
 """
 import math
+from multiprocessing import Queue
+from multiprocessing.synchronize import Event
 from typing import Optional
 
 import numpy as np
 import pandas as pd
-from wand.image import Image
 
 from constants import img_size
-from model.data import Recording, SharedArray
+from controllers.io.cache import ImportCancelled
+from model.data import BLOCK_BYTES, MemmapArray, Recording, SharedArray
 from views.grid_plot_utils import el_idx_plot_to_data
 
 
-def apply_selection(rec: Recording):
+def apply_selection(rec: Recording,
+                    que: Optional[Queue] = None,
+                    cancel: Optional[Event] = None):
     """
-    Creates a new NumPy array with the rows and their elements corresponding
-        to the selected electrodes and the selected time window only.
+    Restricts the data matrix to the rows corresponding to the selected
+        electrodes and to the selected time window.
+    If the full data matrix is in memory, the selection is a view on it,
+    which is copied only once the data is modified, e.g. by a filter, see
+    model/data.py::Recording.select. Thus selecting again is instant.
+    Otherwise, e.g. if only the metadata of the recording was imported or a
+    previous selection was copied, just the selected rows and time window
+    are read from the file or cache, see read_selection. The web app does
+    that in a background process, see controllers/io/async_import.py.
 
     :param rec: the recording object
     :type rec: Recording
+
+    :param que: queue to report ("progress", bytes done, bytes total) to
+        while reading, or None.
+    :type que: Queue
+
+    :param cancel: checked before every block that is read, if it is set
+        ImportCancelled is raised.
+    :type cancel: Event
+    """
+    if rec.select(rec.selected_electrodes, rec.start_idx, rec.stop_idx):
+        rec.channels_df = pd.DataFrame(rec.get_sel_names(),
+                                       columns=['Channel'], dtype="string")
+        return
+
+    adopt_selection(rec, read_selection(rec, que, cancel))
+
+
+def read_selection(rec: Recording,
+                   que: Optional[Queue] = None,
+                   cancel: Optional[Event] = None
+                   ) -> SharedArray | MemmapArray:
+    """
+    Reads the selected rows and time window from the file or cache into a
+    new data matrix, in blocks of at most BLOCK_BYTES. Rows longer than that
+    are read in several time windows, such that the progress is reported and
+    the cancellation is checked regularly.
+
+    :param rec: the recording object, or a handle of it, see
+        model/data.py::Recording.handle.
+    :type rec: Recording
+
+    :param que: queue to report ("progress", bytes done, bytes total) to
+        after every block, or None.
+    :type que: Queue
+
+    :param cancel: checked before every block, if it is set the new data
+        matrix is freed and ImportCancelled is raised.
+    :type cancel: Event
+
+    :return: the selected data, ADC counts if the recording is raw.
+    :rtype: SharedArray | MemmapArray
+    """
+    rows = np.asarray(rec.selected_electrodes, dtype=np.intp)
+    n_rows, n_samples = rows.shape[0], rec.stop_idx - rec.start_idx
+    data = rec.allocate((n_rows, n_samples),
+                        np.int16 if rec.raw else rec.precision)
+    out = data.read()
+    itemsize = data.dtype.itemsize
+    block_rows = max(1, BLOCK_BYTES // max(1, n_samples * itemsize))
+    block_len = max(1, n_samples if block_rows > 1
+                    else BLOCK_BYTES // itemsize)
+
+    try:
+        done = 0
+        for row in range(0, n_rows, block_rows):
+            row_stop = min(row + block_rows, n_rows)
+            for start in range(0, n_samples, block_len):
+                if cancel is not None and cancel.is_set():
+                    raise ImportCancelled(f"Selection of {rec.fname} "
+                                          "cancelled")
+
+                stop = min(start + block_len, n_samples)
+                rec.read_window(rows[row:row_stop], rec.start_idx + start,
+                                rec.start_idx + stop,
+                                out=out[row:row_stop, start:stop])
+                done += (row_stop - row) * (stop - start) * itemsize
+                if que is not None:
+                    que.put(("progress", done, out.nbytes))
+    except Exception:
+        data.free()
+        raise
+
+    return data
+
+
+def adopt_selection(rec: Recording, data: SharedArray | MemmapArray):
+    """
+    Replaces the data matrix by the selection read by read_selection.
+
+    :param rec: the recording object
+    :type rec: Recording
+
+    :param data: the selected rows and time window of the file.
+    :type data: SharedArray | MemmapArray
     """
-    prev_data = rec.data
-    data = rec.get_data()
-    rec.data = SharedArray(data[rec.selected_electrodes,
-                                rec.start_idx:rec.stop_idx])
-    prev_data.free()
+    # frees the previous data matrix, see model/data.py::SegmentRegistry.
+    # The scales stay aligned to the rows of the file.
+    rec.data = data
+    rec.data_rows = np.array(rec.selected_electrodes, dtype=np.intp)
+    rec.data_changed()
+
     rec.channels_df = pd.DataFrame(rec.get_sel_names(), columns=['Channel'],
                                    dtype="string")
 
@@ -165,6 +261,9 @@ def convert_to_jpeg(image_path: str) -> str:
     :return jpeg image URL
     :type return: str
     """
+    # loads ImageMagick, so it is imported on first use
+    from wand.image import Image
+
     # FIXME Add RuntimeError if image_path is not a valid path
     img = Image(filename=image_path)
     img.format = 'jpeg'
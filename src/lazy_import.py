@@ -0,0 +1,146 @@
+"""
+Deferred imports of heavy dependencies and the startup time budget.
+
+Importing the scientific libraries used by the analyses (scipy.signal,
+elephant, fooof, antropy, McsPy, ...) takes seconds each, while a session
+usually uses only a few of them. Thus functions that are the only user of a
+library import it themselves, and modules that use a library throughout bind
+it with lazy_import, which defers executing the module until an attribute of
+it is accessed the first time.
+
+Running this file starts a fresh interpreter, imports the webapp and exits
+with 1 if that failed, took longer than STARTUP_BUDGET_S or loaded any of
+HEAVY_MODULES. tests/test_startup.py runs the same check:
+
+    python lazy_import.py [budget in seconds]
+"""
+from contextlib import contextmanager
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+# Seconds that importing the webapp may take, i.e. dash, pandas, numpy and
+# h5py, with some headroom for slower machines.
+STARTUP_BUDGET_S = 4.0
+
+# Modules that must not be loaded before they are used.
+HEAVY_MODULES = ["antropy", "elephant", "fooof", "matplotlib", "McsPy",
+                 "mutual_info", "neo", "numba", "PyIF", "pyqtgraph",
+                 "quantities", "scipy.signal", "wand"]
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Imports a module on first use, see importlib.util.LazyLoader. Parent
+    packages are imported right away, so name should be a top-level module
+    or a submodule of a cheap package, like scipy.signal.
+
+        :param name: the full name of the module.
+
+        :return the module, which is executed when an attribute is accessed
+                the first time.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
+
+
+def is_loaded(name: str) -> bool:
+    """
+    :return True if the module was imported and, if it was imported lazily,
+            executed.
+    """
+    module = sys.modules.get(name)
+
+    # lazy modules change their class to ModuleType once executed
+    return module is not None and type(module) is types.ModuleType
+
+
+class ImportTimer:
+    """
+    Measures how long the groups of imports of a module take.
+    """
+
+    def __init__(self) -> None:
+        self.times: dict[str, float] = {}
+
+    @contextmanager
+    def group(self, name: str):
+        """
+        Times the imports in the with block under the given name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) \
+                    + time.perf_counter() - start
+
+    def report(self) -> str:
+        """
+        :return one line per group with its import time and the total.
+        """
+        width = max(map(len, self.times), default=0)
+        lines = [f"  {name:<{width}} {secs:6.2f} s"
+                 for name, secs in self.times.items()]
+        lines.append(f"  {'total':<{width}} {sum(self.times.values()):6.2f} s")
+
+        return "Startup imports:\n" + "\n".join(lines)
+
+
+def check_startup(budget: float = STARTUP_BUDGET_S,
+                  module: str = "webapp"
+                  ) -> list[str]:
+    """
+    Imports the module in a new interpreter.
+
+        :param budget: the seconds the import may take.
+        :param module: the module to import.
+
+        :return the violations of the budget, empty if there are none.
+    """
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "secs = time.perf_counter() - start\n"
+            "from lazy_import import HEAVY_MODULES, is_loaded\n"
+            "print(json.dumps([secs, [name for name in HEAVY_MODULES\n"
+            "                         if is_loaded(name)]]))\n")
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, "-c", code], cwd=src_dir,
+                         capture_output=True, text=True, check=False)
+    if out.returncode != 0:
+        error = (out.stderr.strip().splitlines() or ["no output"])[-1]
+        return [f"importing {module} failed: {error}"]
+    secs, loaded = json.loads(out.stdout.strip().splitlines()[-1])
+
+    errors = [f"{name} is imported at startup" for name in loaded]
+    if secs > budget:
+        errors.append(f"importing {module} took {secs:.2f} s, "
+                      f"the budget is {budget:.2f} s")
+
+    return errors
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else STARTUP_BUDGET_S
+    violations = check_startup(budget)
+    for violation in violations:
+        print(violation)
+    if violations:
+        sys.exit(1)
+    print("Startup is within the budget.")
@@ -1,28 +1,998 @@
+import atexit
+from collections import OrderedDict
+from multiprocessing.process import BaseProcess
+import os
+from typing import Callable, Optional
+import uuid
+import weakref
+
 import numpy as np
+import pandas as pd
 from multiprocessing.shared_memory import SharedMemory
 
+from constants import spill_dir
+
+# Upper bound for the size of the blocks in which the data matrix is scaled,
+# if it is stored as raw ADC counts.
+BLOCK_BYTES = 64 * 1024**2
+
+# Upper bound for the size of the unused shared memory segments that are kept
+# for reuse, see SharedBufferPool.
+POOL_BYTES = 1024**3
+# Smallest size class of the pool, smaller arrays are rounded up to it.
+POOL_MIN_BYTES = 64 * 1024
+# Upper bound for the size of the derived arrays that are cached per
+# recording, see SegmentRegistry.cache.
+DERIVED_BYTES = 2 * 1024**3
+# Number of preprocessing steps that can be undone, see Recording.snapshot.
+MAX_SNAPSHOTS = 8
+# Metadata of a recording that is passed to plot and worker processes, see
+# Recording.handle.
+HANDLE_ATTRS = ("fname", "recording_date", "n_mea_electrodes", "duration_mus",
+                "n_samples", "start_idx", "stop_idx", "electrode_names",
+                "ground_els", "ground_el_names", "selected_electrodes",
+                "sampling_rate", "scales", "offsets", "data_rows", "raw",
+                "precision", "storage", "data_version")
+
+
+class SharedArray:
+    '''
+    Wraps a numpy array so that it can be shared quickly among processes,
+    avoiding unnecessary copying and (de)serializing.
+    '''
+
+    def __init__(self, array: np.ndarray, dtype=None):
+        '''
+        Creates the shared memory and copies the array therein
+
+        :param array: the array to be shared
+        :type array: np.ndarray
+        '''
+        self._allocate(array.shape, array.dtype if dtype is None else dtype)
+
+        # create a new numpy array that uses the shared memory we created.
+        # at first, it is filled with zeros
+        res = self.read()
+        # copy data from the array to the shared memory. numpy will
+        # take care of copying everything in the correct format
+        res[:] = array[:]
+
+    @classmethod
+    def empty(cls, shape: tuple[int, ...], dtype=np.float64):
+        '''
+        Creates the shared memory for an array of the given shape and type
+        without copying anything into it. Used to fill the buffer
+        incrementally, e.g. while streaming a file from disk.
+
+        :param shape: shape of the array to be shared
+        :type shape: tuple[int, ...]
+
+        :param dtype: data type of the array to be shared
+        :type dtype: np.dtype
+
+        :return: the shared array, filled with zeros
+        :rtype: SharedArray
+        '''
+        shared = cls.__new__(cls)
+        shared._allocate(shape, dtype)
+
+        return shared
+
+    def _allocate(self, shape: tuple[int, ...], dtype):
+        '''
+        Creates the shared memory location large enough to hold an array of
+        the given shape and type.
+        '''
+        # save data type and shape, necessary to read the data correctly
+        self._dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+
+        nbytes = int(np.prod(self._shape)) * self._dtype.itemsize
+        self._attach(SharedMemory(create=True, size=nbytes), shape, dtype)
+
+    def _attach(self, shared: SharedMemory, shape: tuple[int, ...], dtype,
+                pool=None):
+        '''
+        Uses an existing shared memory segment, which may be larger than the
+        array, to hold an array of the given shape and type.
+        '''
+        self._dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+        self._shared = shared
+        self._name = shared.name
+        self._pool = pool
+
+    def __getstate__(self):
+        # other processes attach to the segment by name, but must never
+        # return it to the pool of this process
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        '''
+        Shape of the shared array.
+        '''
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        '''
+        Data type of the shared array.
+        '''
+        return self._dtype
+
+    def read(self):
+        '''
+        Reads the array from the shared memory without unnecessary copying.
+        '''
+        # open the shared memory region and simply create an array of the
+        # correct shape and type. Pooled segments may be larger than needed.
+        return np.ndarray(self._shape, self._dtype, buffer=self._shared.buf)
+
+    def close(self):
+        '''
+        Closes the shared memory region.
+        '''
+        self._shared.close()
+
+    def free(self):
+        '''
+        Closes and unlinks the shared memory region or hands it back to the
+        pool it was taken from.
+        '''
+        if getattr(self, "_pool", None) is not None:
+            self._pool.recycle(self._shared)
+            self._pool = None
+            return
+
+        self._shared.close()
+        self._shared.unlink()
+
+
+class SharedBufferPool:
+    '''
+    Recycles shared memory segments instead of unlinking them, such that
+    repeated analyses, e.g. while tuning thresholds, do not create and zero a
+    new segment of the size of the data every time.
+    Segments are grouped into size classes of a quarter octave, i.e. an array
+    uses at most 19 % less than the segment it gets. At most max_bytes of
+    unused segments are kept, the least recently returned ones are unlinked
+    first.
+    '''
+
+    def __init__(self, max_bytes: int = POOL_BYTES):
+        self.max_bytes = max_bytes
+        self._free: list[SharedMemory] = []
+        self._free_bytes = 0
+
+    @staticmethod
+    def size_class(nbytes: int) -> int:
+        '''
+        Rounds the number of bytes up to the next size class.
+        '''
+        if nbytes <= POOL_MIN_BYTES:
+            return POOL_MIN_BYTES
+
+        base = 1 << (nbytes.bit_length() - 1)
+        step = base // 4
+
+        return base + -(-(nbytes - base) // step) * step
+
+    def acquire(self, shape: tuple[int, ...], dtype=np.float64) -> SharedArray:
+        '''
+        Returns a shared array of the given shape and type, backed by a
+        recycled segment of the matching size class if there is one. Unlike
+        SharedArray.empty, the contents are undefined.
+
+        :param shape: shape of the array
+        :type shape: tuple[int, ...]
+
+        :param dtype: data type of the array
+        :type dtype: np.dtype
+
+        :return: the shared array, freeing it returns it to the pool
+        :rtype: SharedArray
+        '''
+        size = self.size_class(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        shared = None
+        for idx, candidate in enumerate(self._free):
+            if candidate.size == size:
+                shared = self._free.pop(idx)
+                self._free_bytes -= size
+                break
+        if shared is None:
+            shared = SharedMemory(create=True, size=size)
+
+        array = SharedArray.__new__(SharedArray)
+        array._attach(shared, shape, dtype, pool=self)
+
+        return array
+
+    def recycle(self, shared: SharedMemory) -> None:
+        '''
+        Keeps an unused segment for reuse, unlinking the least recently
+        returned segments if more than max_bytes would be kept.
+        '''
+        self._free.append(shared)
+        self._free_bytes += shared.size
+        while self._free_bytes > self.max_bytes:
+            oldest = self._free.pop(0)
+            self._free_bytes -= oldest.size
+            oldest.close()
+            oldest.unlink()
+
+    def names(self) -> set[str]:
+        '''
+        Returns the names of the unused segments kept.
+        '''
+        return {shared.name for shared in self._free}
+
+    def clear(self) -> None:
+        '''
+        Unlinks all unused segments.
+        '''
+        while self._free:
+            shared = self._free.pop()
+            shared.close()
+            shared.unlink()
+        self._free_bytes = 0
+
+
+# Pool of the shared memory segments of this process, see allocate_array.
+POOL = SharedBufferPool()
+atexit.register(POOL.clear)
+
+
+class MemmapArray:
+    '''
+    Same interface as SharedArray, but the array lives in a memory-mapped
+    file on local disk instead of shared memory. Hence it is not limited by
+    the size of the RAM and can still be opened quickly by other processes.
+    Pickling only transfers the path of the file.
+    '''
+
+    def __init__(self, array: np.ndarray, dtype=None):
+        '''
+        Creates the file and copies the array therein
+
+        :param array: the array to be stored
+        :type array: np.ndarray
+        '''
+        self._allocate(array.shape, array.dtype if dtype is None else dtype)
+        res = self.read()
+        res[:] = array[:]
+
+    @classmethod
+    def empty(cls, shape: tuple[int, ...], dtype=np.float64):
+        '''
+        Creates the file for an array of the given shape and type without
+        copying anything into it.
+
+        :param shape: shape of the array to be stored
+        :type shape: tuple[int, ...]
+
+        :param dtype: data type of the array to be stored
+        :type dtype: np.dtype
+
+        :return: the memory-mapped array, filled with zeros
+        :rtype: MemmapArray
+        '''
+        mapped = cls.__new__(cls)
+        mapped._allocate(shape, dtype)
+
+        return mapped
+
+    def _allocate(self, shape: tuple[int, ...], dtype):
+        '''
+        Creates a sparse file large enough to hold an array of the given
+        shape and type.
+        '''
+        self._dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+
+        os.makedirs(spill_dir, exist_ok=True)
+        self._path = os.path.join(spill_dir, f"{uuid.uuid4().hex}.bin")
+        nbytes = int(np.prod(self._shape)) * self._dtype.itemsize
+        with open(self._path, "wb") as spill_file:
+            spill_file.truncate(nbytes)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        '''
+        Shape of the memory-mapped array.
+        '''
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        '''
+        Data type of the memory-mapped array.
+        '''
+        return self._dtype
+
+    def read(self):
+        '''
+        Maps the file into memory. Pages are only read from disk when they are
+        accessed and modifications are written back to the file.
+        '''
+        return np.memmap(self._path, dtype=self._dtype, mode="r+",
+                         shape=self._shape)
+
+    def close(self):
+        '''
+        Nothing to close, the mapping is released with the last reference to
+        the array returned by read.
+        '''
+
+    def free(self):
+        '''
+        Deletes the file.
+        '''
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class SelectionView:
+    '''
+    Selection of rows and of a contiguous time window of a shared or
+    memory-mapped array, without copying anything. The parent array stays
+    owned by the registry of the recording as long as a view refers to it.
+    Pickling transfers the parent by name and the row indices.
+    '''
+
+    def __init__(self,
+                 parent: SharedArray | MemmapArray,
+                 rows: list[int] | np.ndarray,
+                 start: int,
+                 stop: int):
+        '''
+        :param parent: the array to select from
+        :type parent: SharedArray | MemmapArray
+
+        :param rows: indices of the selected rows of the parent
+        :type rows: list[int] | np.ndarray
+
+        :param start: first selected column of the parent
+        :type start: int
+
+        :param stop: column after the last selected one
+        :type stop: int
+        '''
+        self.parent = parent
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.start = int(start)
+        self.stop = int(stop)
+
+        # consecutive rows, e.g. a box selected in the electrode grid, can
+        # be sliced instead of indexed, which returns a view
+        self._row_slice = None
+        if self.rows.shape[0] > 0 and np.all(np.diff(self.rows) == 1):
+            self._row_slice = slice(int(self.rows[0]), int(self.rows[-1]) + 1)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        '''
+        Shape of the selection.
+        '''
+        return self.rows.shape[0], self.stop - self.start
+
+    @property
+    def dtype(self) -> np.dtype:
+        '''
+        Data type of the parent array.
+        '''
+        return self.parent.dtype
+
+    def read(self) -> np.ndarray:
+        '''
+        Returns the selection as numpy array. This is a view on the parent if
+        the selected rows are consecutive and a copy otherwise, prefer block
+        or indexing single rows for large selections then.
+        '''
+        if self._row_slice is not None:
+            return self.parent.read()[self._row_slice, self.start:self.stop]
+
+        return self.block()
+
+    def block(self,
+              rows: slice | list[int] | np.ndarray = slice(None),
+              start: int = 0,
+              stop: Optional[int] = None
+              ) -> np.ndarray:
+        '''
+        Returns the given rows and time window of the selection, copying
+        only these.
+
+        :param rows: rows of the selection
+        :type rows: slice | list[int] | np.ndarray
+
+        :param start: first sample relative to the start of the selection
+        :type start: int
+
+        :param stop: sample after the last one relative to the start of the
+            selection, defaults to the end of the selection
+        :type stop: int
+        '''
+        stop = self.stop if stop is None else self.start + stop
+        window = self.parent.read()[:, self.start + start:stop]
+        if (isinstance(rows, slice) and rows.step in (None, 1)
+                and self._row_slice is not None):
+            # a view, as the slice of consecutive rows is consecutive too
+            first, last, _ = rows.indices(self.rows.shape[0])
+            offset = self._row_slice.start
+            return window[offset + first:offset + last]
+
+        return np.take(window, self.rows[rows], axis=0)
+
+    def __getitem__(self, row: int) -> np.ndarray:
+        '''
+        Returns a single row of the selection as a view on the parent.
+        '''
+        return self.parent.read()[self.rows[row], self.start:self.stop]
+
+    def __len__(self) -> int:
+        return self.rows.shape[0]
+
+    def close(self):
+        '''
+        Closes the parent array in this process.
+        '''
+        self.parent.close()
+
+
+class RaggedArray:
+    '''
+    One array of varying length per row, e.g. the indices of the peaks of
+    each channel, stored in compressed sparse row layout: the values of all
+    rows in one flat shared array and the offset of each row therein in a
+    second one. Hence it is pickled by name like a SharedArray and a row is
+    a slice of the values without copying.
+    '''
+
+    def __init__(self, rows: list[np.ndarray], dtype=np.int64):
+        '''
+        Copies the rows into shared memory.
+
+        :param rows: the arrays, one per row
+        :type rows: list[np.ndarray]
+
+        :param dtype: data type of the values
+        :type dtype: np.dtype
+        '''
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        self.offsets = allocate_array(offsets.shape, np.int64, "shm")
+        self.offsets.read()[:] = offsets
+        self.values = allocate_array((int(offsets[-1]),), dtype, "shm")
+        values = self.values.read()
+        for row, (start, stop) in zip(rows, zip(offsets[:-1], offsets[1:])):
+            values[start:stop] = row
+
+    @classmethod
+    def wrap(cls,
+             values: SharedArray | MemmapArray,
+             offsets: SharedArray | MemmapArray):
+        '''
+        Uses existing arrays as values and offsets without copying, e.g. a
+        column of a ResultTable that is sorted by channel.
+
+        :param values: the flat values of all rows
+        :type values: SharedArray | MemmapArray
+
+        :param offsets: the offsets of the rows in values, one more than the
+            number of rows
+        :type offsets: SharedArray | MemmapArray
+
+        :return: the ragged array
+        :rtype: RaggedArray
+        '''
+        ragged = cls.__new__(cls)
+        ragged.values = values
+        ragged.offsets = offsets
+
+        return ragged
+
+    def __getitem__(self, row: int) -> np.ndarray:
+        '''
+        Returns the values of a row as a view on the shared memory.
+        '''
+        offsets = self.offsets.read()
+        return self.values.read()[offsets[row]:offsets[row + 1]]
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def lengths(self) -> np.ndarray:
+        '''
+        Returns the number of values per row.
+        '''
+        return np.diff(self.offsets.read())
+
+    def close(self):
+        '''
+        Closes the shared memory regions.
+        '''
+        self.values.close()
+        self.offsets.close()
+
+
+class ResultTable:
+    '''
+    Table of detection results, e.g. one row per peak, stored column-wise in
+    shared memory. The channel of a row is an integer index into the
+    selected channel names instead of a string, and the rows are sorted by
+    channel, such that the rows of a channel are a slice. It is converted to
+    a DataFrame only for display and export, see to_frame.
+    '''
+
+    def __init__(self,
+                 columns: dict[str, np.ndarray],
+                 channels: np.ndarray,
+                 channel_names: np.ndarray,
+                 sort_by: Optional[str] = None):
+        '''
+        Copies the columns into shared memory, sorted by channel.
+
+        :param columns: the columns by name, all of the same length
+        :type columns: dict[str, np.ndarray]
+
+        :param channels: the index of the channel of each row
+        :type channels: np.ndarray
+
+        :param channel_names: the names of the channels, indexed by channels
+        :type channel_names: np.ndarray
+
+        :param sort_by: column to sort the rows of each channel by, or None
+            if they are sorted already
+        :type sort_by: str
+        '''
+        channels = np.asarray(channels, dtype=np.int32)
+        if sort_by is None:
+            order = np.argsort(channels, kind="stable")
+        else:
+            order = np.lexsort((columns[sort_by], channels))
+
+        self.channel_names = np.asarray(channel_names)
+        self.channels = allocate_array(channels.shape, np.int32, "shm")
+        self.channels.read()[:] = channels[order]
+        self.columns = {}
+        for name, column in columns.items():
+            column = np.asarray(column)
+            self.columns[name] = allocate_array(column.shape, column.dtype,
+                                                "shm")
+            self.columns[name].read()[:] = column[order]
+
+        offsets = np.searchsorted(self.channels.read(),
+                                  np.arange(self.channel_names.shape[0] + 1))
+        self.offsets = allocate_array(offsets.shape, np.int64, "shm")
+        self.offsets.read()[:] = offsets
+
+    def __len__(self) -> int:
+        return self.channels.shape[0]
+
+    def column(self, name: str, channel: Optional[int] = None) -> np.ndarray:
+        '''
+        Returns a column, or its rows of a single channel, as a view on the
+        shared memory.
+        '''
+        column = self.columns[name].read()
+        if channel is None:
+            return column
+
+        offsets = self.offsets.read()
+        return column[offsets[channel]:offsets[channel + 1]]
+
+    def ragged(self, name: str) -> RaggedArray:
+        '''
+        Returns a column as ragged array with one row per channel, sharing
+        the memory of the table.
+        '''
+        return RaggedArray.wrap(self.columns[name], self.offsets)
+
+    def to_frame(self, start: int = 0, stop: Optional[int] = None):
+        '''
+        Converts the rows from start to stop to a DataFrame, with the channel
+        names as categorical column.
+        '''
+        codes = self.channels.read()[start:stop]
+        frame = {"Channel": pd.Categorical.from_codes(
+                    codes, categories=pd.Index(self.channel_names))}
+        for name in self.columns:
+            frame[name] = self.columns[name].read()[start:stop]
+
+        return pd.DataFrame(frame, index=np.arange(start, start + len(codes)))
+
+    def arrays(self) -> list[SharedArray | MemmapArray]:
+        '''
+        Returns all shared arrays of the table.
+        '''
+        return [self.channels, self.offsets] + list(self.columns.values())
+
+    def close(self):
+        '''
+        Closes the shared memory regions.
+        '''
+        for array in self.arrays():
+            array.close()
+
+
+def allocate_array(shape: tuple[int, ...],
+                   dtype=np.float64,
+                   storage: str = "shm"
+                   ) -> SharedArray | MemmapArray:
+    '''
+    Creates an empty array either in shared memory or in a file on disk.
+    Shared memory is taken from the pool, so the contents are undefined.
+
+    :param shape: shape of the array
+    :type shape: tuple[int, ...]
+
+    :param dtype: data type of the array
+    :type dtype: np.dtype
+
+    :param storage: "shm" for shared memory, "disk" for a memory-mapped file
+    :type storage: str
+
+    :return: the empty array
+    :rtype: SharedArray | MemmapArray
+    '''
+    if storage == "disk":
+        return MemmapArray.empty(shape, dtype)
+    if storage == "shm":
+        return POOL.acquire(shape, dtype)
+
+    raise ValueError(f"Unknown storage {storage}, use 'shm' or 'disk'")
+
+
+# Arrays that were released while a process might still open them. They are
+# freed as soon as all of these processes terminated, see SegmentRegistry.
+_PENDING: list[tuple[SharedArray | MemmapArray, list[BaseProcess]]] = []
+# All live registries, to find segments in /dev/shm that none of them owns.
+_REGISTRIES = weakref.WeakSet()
+
+
+class SegmentRegistry:
+    '''
+    Owns the shared memory segments and memory-mapped files of a Recording,
+    keyed by the attribute they are stored in, e.g. data, mv_mads or psds.
+    Storing a new value under a key releases the arrays it supersedes.
+
+    Processes that receive the Recording, e.g. the plot processes, open the
+    segments by name after they started. Hence they are attached to all
+    arrays stored at that time and released arrays are only freed once all
+    attached processes terminated.
+
+    Additionally, derived values like moving MADs or envelopes are cached by
+    stage, parameters and data version, see Recording.derived. Arrays are
+    only released once they are neither stored nor cached. The least
+    recently used entries are evicted if the cache exceeds max_cached_bytes.
+    '''
+
+    def __init__(self, max_cached_bytes: int = DERIVED_BYTES):
+        self._values: dict[str, object] = {}
+        self._procs: dict[int, list[BaseProcess]] = {}
+        self._cached: OrderedDict[tuple, object] = OrderedDict()
+        self.max_cached_bytes = max_cached_bytes
+        _REGISTRIES.add(self)
+
+    def __getstate__(self):
+        # processes can not be pickled and are only tracked by the owner,
+        # the cache is only used by the owner, too
+        return {"_values": self._values, "_procs": {},
+                "_cached": OrderedDict(),
+                "max_cached_bytes": self.max_cached_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        _REGISTRIES.add(self)
+
+    def get(self, key: str):
+        '''
+        Returns the value stored under key or None.
+        '''
+        return self._values.get(key)
+
+    def put(self, key: str, value) -> None:
+        '''
+        Stores a value, i.e. an array, a tuple of arrays or None, under key
+        and releases all arrays of the previous value that are not part of
+        the new one.
+        '''
+        old = self._values.get(key)
+        self._values[key] = value
+        self._release_unused(arrays_of(old))
+
+    def cached(self, key: tuple):
+        '''
+        Returns the cached value for key, i.e. (stage, parameters, data
+        version), or None.
+        '''
+        if key not in self._cached:
+            return None
+        self._cached.move_to_end(key)
+
+        return self._cached[key]
+
+    def cache(self, key: tuple, value) -> None:
+        '''
+        Caches a derived value and evicts the least recently used values
+        while the cache holds more than max_cached_bytes.
+        '''
+        self._cached[key] = value
+        self._cached.move_to_end(key)
+        while (len(self._cached) > 1
+               and sum(nbytes_of(v) for v in self._cached.values())
+               > self.max_cached_bytes):
+            _, evicted = self._cached.popitem(last=False)
+            self._release_unused(arrays_of(evicted))
+
+    def clear_cache(self) -> None:
+        '''
+        Drops all cached values, e.g. after the data changed.
+        '''
+        evicted = [array for value in self._cached.values()
+                   for array in arrays_of(value)]
+        self._cached.clear()
+        self._release_unused(evicted)
+
+    def _release_unused(self, arrays: list) -> None:
+        '''
+        Releases the arrays that are neither stored nor cached.
+        '''
+        used = {id(array) for value in (list(self._values.values())
+                                        + list(self._cached.values()))
+                for array in arrays_of(value)}
+        for array in arrays:
+            if id(array) not in used:
+                used.add(id(array))
+                self.release(array)
+
+    def attach(self, proc: BaseProcess) -> None:
+        '''
+        Marks all currently stored arrays as used by the process, such that
+        they are not freed before the process terminated. Any object with an
+        is_alive method can be attached, e.g. a window of the plot server,
+        see views/plot_server.py.
+        '''
+        for value in self._values.values():
+            for array in arrays_of(value):
+                self._procs.setdefault(id(array), []).append(proc)
+
+    def release(self, array: SharedArray | MemmapArray) -> None:
+        '''
+        Frees the array, or defers freeing it until all processes attached to
+        it terminated.
+        '''
+        procs = self._procs.pop(id(array), [])
+        _PENDING.append((array, procs))
+        collect_segments()
+
+    def free(self) -> None:
+        '''
+        Releases all stored and cached arrays.
+        '''
+        self.clear_cache()
+        for key in list(self._values):
+            self.put(key, None)
+
+    def usage(self) -> dict[str, int]:
+        '''
+        Returns the number of bytes of shared memory used per key. Memory
+        mapped files are not counted, as they reside on disk.
+        '''
+        usage = {}
+        for key, value in self._values.items():
+            n_bytes = sum(int(np.prod(array.shape)) * array.dtype.itemsize
+                          for array in arrays_of(value)
+                          if isinstance(array, SharedArray))
+            if n_bytes > 0:
+                usage[key] = n_bytes
+
+        return usage
+
+    def names(self) -> set[str]:
+        '''
+        Returns the names of all shared memory segments stored.
+        '''
+        return {array._name for value in self._values.values()
+                for array in arrays_of(value)
+                if isinstance(array, SharedArray)}
+
+
+class Segment:
+    '''
+    Descriptor for attributes of a Recording that hold shared arrays. The
+    values are stored in the SegmentRegistry of the recording, such that
+    assigning a new value frees the superseded arrays.
+    '''
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, rec, owner=None):
+        if rec is None:
+            return self
+        return rec.segments.get(self.name)
+
+    def __set__(self, rec, value):
+        rec.segments.put(self.name, value)
+
+
+def arrays_of(value) -> list[SharedArray | MemmapArray]:
+    '''
+    Returns the shared arrays contained in a value stored in a registry,
+    i.e. in a single array, a selection view, a ragged array, a result table
+    or a tuple of these.
+    '''
+    if isinstance(value, (SharedArray, MemmapArray)):
+        return [value]
+    if isinstance(value, SelectionView):
+        return [value.parent]
+    if isinstance(value, RaggedArray):
+        return [value.values, value.offsets]
+    if isinstance(value, ResultTable):
+        return value.arrays()
+    if isinstance(value, (tuple, list)):
+        return [a for v in value for a in arrays_of(v)]
+
+    return []
+
+
+def nbytes_of(value) -> int:
+    '''
+    Returns the number of bytes of the arrays contained in a cached value,
+    i.e. arrays, shared arrays and arbitrarily nested tuples and lists
+    thereof.
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (SharedArray, MemmapArray)):
+        return int(np.prod(value.shape)) * value.dtype.itemsize
+    if isinstance(value, (RaggedArray, ResultTable)):
+        return sum(nbytes_of(array) for array in arrays_of(value))
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(v) for v in value)
+
+    return 0
+
+
+def collect_segments() -> None:
+    '''
+    Frees all released arrays whose attached processes terminated.
+    '''
+    for entry in list(_PENDING):
+        array, procs = entry
+        if any(proc.is_alive() for proc in procs):
+            continue
+        _PENDING.remove(entry)
+        array.free()
+
+
+def shm_usage() -> tuple[int, int]:
+    '''
+    Returns the number of bytes used and available in /dev/shm.
+    '''
+    stat = os.statvfs("/dev/shm")
+    total = stat.f_blocks * stat.f_frsize
+
+    return total - stat.f_bavail * stat.f_frsize, total
+
+
+def unowned_segments() -> list[str]:
+    '''
+    Lists the shared memory segments created by multiprocessing that are
+    neither owned by a live Recording nor pending to be freed, i.e. leaks.
+    Only includes the segments visible in /dev/shm, i.e. on Linux.
+    '''
+    if not os.path.isdir("/dev/shm"):
+        return []
+
+    owned = set()
+    for registry in list(_REGISTRIES):
+        owned |= registry.names()
+    owned |= {array._name for array, _ in _PENDING
+              if isinstance(array, SharedArray)}
+    owned |= POOL.names()
+
+    return sorted(name for name in os.listdir("/dev/shm")
+                  if name.startswith("psm_") and name not in owned)
+
+
+def copy_array(src: SharedArray | MemmapArray | SelectionView,
+               dst: SharedArray | MemmapArray) -> None:
+    '''
+    Copies an array of the same shape into another one in blocks of rows of
+    at most BLOCK_BYTES, such that no temporary copy of the whole array is
+    needed, e.g. when spilling shared memory to disk.
+    '''
+    n_rows, n_samples = src.shape
+    block_rows = max(1, BLOCK_BYTES // max(1, n_samples * src.dtype.itemsize))
+    out = dst.read()
+    for start in range(0, n_rows, block_rows):
+        rows = slice(start, min(start + block_rows, n_rows))
+        if isinstance(src, SelectionView):
+            out[rows] = src.block(rows)
+        else:
+            out[rows] = src.read()[rows]
+
+
+class Snapshot:
+    '''
+    Copy of the data matrix on disk together with the metadata that
+    preprocessing changes, taken before a preprocessing step.
+    '''
+
+    def __init__(self, label: str, rec: "Recording"):
+        '''
+        Spills the data matrix of the recording as it is stored, i.e. ADC
+        counts stay int16 and only the rows and samples of a selection view
+        are written.
+
+        :param label: description of the step about to be applied
+        :type label: str
+
+        :param rec: the recording to take the snapshot of
+        :type rec: Recording
+        '''
+        self.label = label
+        self.data = MemmapArray.empty(rec.data.shape, rec.data.dtype)
+        copy_array(rec.data, self.data)
+
+        self.sampling_rate = rec.sampling_rate
+        self.start_idx = rec.start_idx
+        self.stop_idx = rec.stop_idx
+        self.raw = rec.raw
+        # the rows of a view are written, so keep which rows of the file
+        # they are, the scales stay aligned to the rows of the file
+        self.data_rows = rec.file_rows()
+
 
 class Recording:
     recording_date: str
     n_mea_electrodes: int
     duration_mus: int
     sampling_rate: int
-    data: np.ndarray
     start_idx: int
     stop_idx: int
     electrode_names: list[str]
 
+    # shared arrays, owned by the SegmentRegistry of the recording
+    data = Segment()
+    derivatives = Segment()
+    mv_avgs = Segment()
+    mv_mads = Segment()
+    psds = Segment()
+    spectrograms = Segment()
+    # ragged arrays with one row per channel
+    envelopes = Segment()
+    mad_env = Segment()
+    peaks = Segment()
+    events = Segment()
+    # detection results, see ResultTable
+    peak_table = Segment()
+    event_table = Segment()
+
     def __init__(self,
                  fname: str,
                  date: str,
                  n_electrodes: int,
                  sampling_rate: int,
-                 data: np.ndarray,
+                 data: Optional[np.ndarray | SharedArray | MemmapArray],
                  start_idx: int,
                  stop_idx: int,
                  names: np.ndarray,
                  ground_els: np.ndarray,
-                 ground_el_names: np.ndarray
+                 ground_el_names: np.ndarray,
+                 loader: Optional[Callable] = None,
+                 n_samples: Optional[int] = None,
+                 scales: Optional[np.ndarray] = None,
+                 offsets: Optional[np.ndarray] = None,
+                 raw: bool = False,
+                 precision=np.float64,
+                 storage: str = "shm"
                  ) -> None:
         """
         Data object used to hold the data matrix and metadata.
@@ -30,12 +1000,34 @@ class Recording:
         @param date: the date when this recording was carried out.
         @param sampling rate: Sampling rate with which data was recorded.
         @param data: the matrix holding the actual data.
-            (num_channels, duration * sampling rate)
+            (num_channels, duration * sampling rate). If it already is a
+            SharedArray it is used as is instead of being copied. If None,
+            only the metadata is loaded and the data is read by the loader
+            once the selection is applied.
+        @param loader: callable(out, rows, start, stop) that reads the given
+            rows and time window from file into out. Required if data is None.
+        @param n_samples: number of samples per channel in the file. Required
+            if data is None.
+        @param scales: factor to convert ADC counts to volts, per row of the
+            file, i.e. of the full data matrix.
+        @param offsets: ADC offset, i.e. the count for 0 V, per row of the
+            file.
+        @param raw: if True the data matrix holds the int16 ADC counts, which
+            are scaled block-wise on access, see get_block.
+        @param precision: floating point type of the data and all arrays
+            derived from it, i.e. np.float64 or np.float32. See
+            controllers/analysis/precision.py for the accuracy of float32.
+        @param storage: where to keep the data matrix, "shm" for shared
+            memory or "disk" for a memory-mapped file, which allows for
+            recordings larger than the RAM.
         """
         self.fname = fname
         self.recording_date = date
         self.n_mea_electrodes = n_electrodes
-        self.duration_mus = data.shape[1] / sampling_rate * 1000000
+        if n_samples is None:
+            n_samples = data.shape[1]
+        self.n_samples = n_samples
+        self.duration_mus = n_samples / sampling_rate * 1000000
         self.start_idx = start_idx
         self.stop_idx = stop_idx
         self.electrode_names = names
@@ -44,12 +1036,36 @@ class Recording:
         self.selected_electrodes = []
         self.sampling_rate = sampling_rate
 
-        # create shared memory
-        self.data = SharedArray(data)
+        # create shared memory, unless the importer already streamed the
+        # data into it or only the metadata was loaded
+        self.loader = loader
+        self.scales = scales
+        self.offsets = offsets
+        # the rows of the file the rows of the data matrix hold, if it holds
+        # a selection that was copied, see file_rows
+        self.data_rows = None
+        self.raw = raw
+        self.precision = np.dtype(precision)
+        self.storage = storage
+        self.segments = SegmentRegistry()
+        # increased whenever the data matrix changes, to invalidate the
+        # cached derived values, see derived
+        self.data_version = 0
+        # the states before the last preprocessing steps, see snapshot
+        self.snapshots: list[Snapshot] = []
+        if data is None or isinstance(data, (SharedArray, MemmapArray)):
+            self.data = data
+        else:
+            self.data = self.allocate(data.shape, data.dtype)
+            self.data.read()[:] = data
 
         # Maybe used for burst detection and burst & peak characterization
         self.mv_mads = None  # ndarray (data.shape)
-        self.envelopes = None  # ndarray (data.shape)
+        # min and max envelope indices, tuple[RaggedArray, RaggedArray]
+        self.envelopes = None
+        self.mad_env = None  # RaggedArray, max envelope of the moving MADs
+        self.peaks = None  # RaggedArray, peak indices per channel
+        self.events = None  # start and stop indices, tuple of RaggedArrays
 
         # Spectral --- Store output of fooof wrt. psd. May use spectrogram as fooof group
         self.psds = None  # tuple[ndarray (1,#freqs), ndarray(data.shape[0], #freqs) ]
@@ -58,8 +1074,8 @@ class Recording:
         # self.fooof_group = None # FOOOFGroup object
 
         self.channels_df = None  # Cols: SNR, RMS, Apprx_Entropy, n_peaks, firing rate
-        self.peaks_df = None
-        self.events_df = None
+        self.peak_table = None
+        self.event_table = None
         self.network_df = None
 
         #  ####### Not sure how to put that into df
@@ -76,6 +1092,24 @@ class Recording:
         # phase synchrony
         # self.latencies c.f. intraop dataset repo
 
+    def allocate(self,
+                 shape: tuple[int, ...],
+                 dtype=None
+                 ) -> SharedArray | MemmapArray:
+        """
+        Creates an empty array for the data matrix in the storage of this
+        recording, i.e. shared memory or disk.
+
+        @param shape: shape of the array.
+        @param dtype: data type of the array, defaults to the precision.
+
+        @return the empty array.
+        """
+        if dtype is None:
+            dtype = self.precision
+
+        return allocate_array(shape, dtype, self.storage)
+
     def get_sel_names(self):
         return self.electrode_names[self.selected_electrodes]
 
@@ -86,57 +1120,385 @@ class Recording:
         return t_start, t_stop
 
     def get_data(self):
+        """
+        Returns the data matrix. If it is stored as ADC counts or it is a
+        selection of rows that are not consecutive, a copy is returned,
+        prefer get_block or iter_channel_blocks then.
+        """
+        if self.raw:
+            return self.get_block()
+
         return self.data.read()
 
-    def free(self):
-        self.data.free()
+    def get_block(self,
+                  rows: slice | list[int] | np.ndarray = slice(None),
+                  start: int = 0,
+                  stop: Optional[int] = None,
+                  dtype=None
+                  ) -> np.ndarray:
+        """
+        Returns the given rows and time window of the data matrix in volts.
+        If the data is stored as ADC counts, it is scaled to dtype, otherwise
+        a view on the data is returned whenever possible.
 
+        @param rows: the rows of the data matrix to return.
+        @param start: the first sample to return.
+        @param stop: the sample after the last one to return.
+        @param dtype: the data type to scale ADC counts to. Defaults to the
+            precision of the recording.
 
-class SharedArray:
-    '''
-    Wraps a numpy array so that it can be shared quickly among processes,
-    avoiding unnecessary copying and (de)serializing.
-    '''
+        @return the requested block of the data matrix.
+        """
+        if isinstance(self.data, SelectionView):
+            block = self.data.block(rows, start, stop)
+        else:
+            block = self.data.read()[rows, start:stop]
+        if not self.raw:
+            return block
 
-    def __init__(self, array: np.ndarray, dtype=None):
-        '''
-        Creates the shared memory and copies the array therein
+        # the scales are aligned to the rows of the file
+        file_rows = self.file_rows()
+        if file_rows is not None:
+            rows = file_rows[rows]
 
-        :param array: the array to be shared
-        :type array: np.ndarray
-        '''
-        # create the shared memory location of the same size of the array
-        self._shared = SharedMemory(create=True, size=array.nbytes)
-        self._name = self._shared.name
+        return self._scaled(block, rows, dtype)
 
-        # save data type and shape, necessary to read the data correctly
-        self._dtype = array.dtype if dtype is None else dtype
-        self._shape = array.shape
+    def _scaled(self, block: np.ndarray, rows, dtype=None) -> np.ndarray:
+        """
+        Converts a block of ADC counts of the given rows of the file to
+        volts.
+        """
+        if dtype is None:
+            dtype = self.precision
 
-        # create a new numpy array that uses the shared memory we created.
-        # at first, it is filled with zeros
-        res = np.ndarray(self._shape, self._dtype, buffer=self._shared.buf)
-        # copy data from the array to the shared memory. numpy will
-        # take care of copying everything in the correct format
-        res[:] = array[:]
+        scaled = np.subtract(block, self.offsets[rows].reshape(-1, 1),
+                             dtype=dtype)
+        scaled *= self.scales[rows].reshape(-1, 1).astype(dtype)
 
-    def read(self):
-        '''
-        Reads the array from the shared memory without unnecessary copying.
-        '''
-        # open the shared memory region and simply create an array of the
-        # correct shape and type
-        return np.ndarray(self._shape, self._dtype, buffer=self._shared.buf)
+        return scaled
 
-    def close(self):
-        '''
-        Closes the shared memory region.
-        '''
-        self._shared.close()
+    def iter_channel_blocks(self, dtype=None):
+        """
+        Iterates over the data matrix in blocks of rows of at most
+        BLOCK_BYTES each, scaling ADC counts block-wise if necessary.
+        Rows are never split, so a single row longer than BLOCK_BYTES is
+        returned whole. Use iter_blocks for computations that do not need
+        whole rows, e.g. sums.
+
+        @param dtype: the data type to scale ADC counts to. Defaults to the
+            precision of the recording.
+
+        @return generator of the row slice and the corresponding block.
+        """
+        if dtype is None:
+            dtype = self.precision
+
+        n_rows, n_samples = self.data.shape
+        itemsize = np.dtype(dtype).itemsize
+        block_rows = max(1, BLOCK_BYTES // (n_samples * itemsize))
+
+        for start in range(0, n_rows, block_rows):
+            rows = slice(start, min(start + block_rows, n_rows))
+            yield rows, self.get_block(rows, dtype=dtype)
+
+    def iter_blocks(self, dtype=None):
+        """
+        Iterates over the data matrix in blocks of at most BLOCK_BYTES each,
+        like iter_channel_blocks, but splits rows longer than BLOCK_BYTES
+        into time windows.
+
+        @param dtype: the data type to scale ADC counts to. Defaults to the
+            precision of the recording.
+
+        @return generator of the row slice, the first sample, the sample
+            after the last one and the corresponding block.
+        """
+        if dtype is None:
+            dtype = self.precision
+
+        n_rows, n_samples = self.data.shape
+        itemsize = np.dtype(dtype).itemsize
+        if n_samples * itemsize <= BLOCK_BYTES:
+            for rows, block in self.iter_channel_blocks(dtype):
+                yield rows, 0, n_samples, block
+            return
+
+        block_len = max(1, BLOCK_BYTES // itemsize)
+        for row in range(n_rows):
+            rows = slice(row, row + 1)
+            for start in range(0, n_samples, block_len):
+                stop = min(start + block_len, n_samples)
+                yield rows, start, stop, self.get_block(rows, start, stop,
+                                                        dtype)
+
+    def to_float(self, dtype=None):
+        """
+        Replaces the ADC counts by the scaled values and a selection view by
+        a copy of the selection, to be able to modify the data in-place, e.g.
+        by filters. Scales and copies block-wise to avoid temporary copies of
+        the whole data matrix.
+
+        @param dtype: the data type to scale ADC counts to. Defaults to the
+            precision of the recording.
+        """
+        if not self.raw and not isinstance(self.data, SelectionView):
+            return
+
+        if dtype is None:
+            dtype = self.precision
+
+        scaled = self.allocate(self.data.shape, dtype)
+        out = scaled.read()
+        for rows, block in self.iter_channel_blocks(dtype):
+            out[rows] = block
+
+        # frees the ADC counts or the full matrix the selection was taken
+        # from, unless it is still in use
+        self.data_rows = self.file_rows()
+        self.data = scaled
+        self.raw = False
+
+    def full_data(self) -> Optional[SharedArray | MemmapArray]:
+        """
+        Returns the data matrix with all electrodes and samples of the file,
+        if it is in memory, i.e. the matrix selections can be taken from
+        without reading the file again.
+        """
+        if isinstance(self.data, SelectionView):
+            return self.data.parent
+        if (self.data is not None and self.data_rows is None
+                and self.data.shape == (self.electrode_names.shape[0],
+                                        self.n_samples)):
+            return self.data
+
+        return None
+
+    def file_rows(self) -> Optional[np.ndarray]:
+        """
+        Returns the rows of the file, i.e. of the full data matrix, that the
+        rows of the data matrix hold, or None if it holds all rows in order.
+        The scales and offsets are indexed by these.
+        """
+        if isinstance(self.data, SelectionView):
+            return self.data.rows
+
+        return self.data_rows
+
+    def select(self,
+               rows: list[int] | np.ndarray,
+               start: int,
+               stop: int
+               ) -> bool:
+        """
+        Replaces the data matrix by a view of the given rows and time window
+        of the full data matrix, without copying. The view is copied only
+        once the data is modified in-place, see to_float.
+
+        @param rows: the rows of the full data matrix to select.
+        @param start: the first sample to select.
+        @param stop: the sample after the last one to select.
+
+        @return False if the full data matrix is not in memory, i.e. the
+            selection needs to be read from file.
+        """
+        full = self.full_data()
+        if full is None:
+            return False
+
+        # keeps the full matrix alive, see SegmentRegistry.put
+        self.data = SelectionView(full, rows, start, stop)
+        self.data_rows = None
+        self.data_changed()
+
+        return True
+
+    def preview(self,
+                rows: list[int] | np.ndarray,
+                start: int,
+                stop: int
+                ) -> np.ndarray | SelectionView:
+        """
+        Returns the given rows and time window of the full data matrix for
+        plotting. Indexing a single row of the result is a view, unless the
+        data is stored as ADC counts or the full data matrix is not in
+        memory, in which case the window is scaled or read from the file or
+        cache into a new array.
+
+        @param rows: the rows of the full data matrix.
+        @param start: the first sample.
+        @param stop: the sample after the last one.
+
+        @return an array or view of shape (len(rows), stop - start).
+        """
+        full = self.full_data()
+        if full is None:
+            return self.read_window(rows, start, stop)
+
+        view = SelectionView(full, rows, start, stop)
+        if self.raw:
+            return self._scaled(view.read(), view.rows)
+
+        return view
+
+    def data_changed(self) -> None:
+        """
+        Marks the data matrix as changed, e.g. by a filter or a new
+        selection, such that derived values are recomputed.
+        """
+        self.data_version += 1
+        self.segments.clear_cache()
+
+    def derived(self, stage: str, params: tuple, compute: Callable):
+        """
+        Returns a value derived from the data matrix, e.g. the moving MADs,
+        computing it only if it is not cached for these parameters and the
+        current data version yet.
+
+        @param stage: name of the derived quantity, e.g. "mv_mads".
+        @param params: hashable parameters the value depends on.
+        @param compute: callable without arguments computing the value.
+
+        @return the cached or computed value.
+        """
+        key = (stage, params, self.data_version)
+        value = self.segments.cached(key)
+        if value is None:
+            value = compute()
+            self.segments.cache(key, value)
+
+        return value
+
+    def is_loaded(self) -> bool:
+        """
+        Checks if the data matrix is in memory or if only the metadata was
+        loaded so far.
+        """
+        return self.data is not None
+
+    def read_window(self,
+                    rows: list[int] | np.ndarray,
+                    start: int,
+                    stop: int,
+                    out: Optional[np.ndarray] = None
+                    ) -> np.ndarray:
+        """
+        Reads the given rows and time window of the file, either from the
+        full data matrix if it is in memory, or from the file or cache
+        through the loader otherwise. A selection that was applied already
+        is never read from, as its rows and samples differ from the file.
+
+        @param rows: the rows of the file, i.e. of the full data matrix, to
+            read.
+        @param start: the first sample to read.
+        @param stop: the sample after the last one to read.
+        @param out: array of shape (len(rows), stop - start) to read into.
+            If None a new array is allocated. If it is of integer type, ADC
+            counts are read instead of volts.
+
+        @return the requested window of the file.
+        """
+        if out is None:
+            out = np.empty((len(rows), stop - start), dtype=self.precision)
+
+        full = self.full_data()
+        if full is None:
+            if self.loader is None:
+                raise RuntimeError("The selected data can not be read, as "
+                                   "the full recording is neither in memory "
+                                   "nor can be read from file.")
+            self.loader(out, rows, start, stop)
+            return out
+
+        window = full.read()[:, start:stop]
+        if self.raw and not np.issubdtype(out.dtype, np.integer):
+            out[:] = self._scaled(np.take(window, rows, axis=0), rows,
+                                  out.dtype)
+        else:
+            np.take(window, rows, axis=0, out=out)
+
+        return out
+
+    def handle(self, *segments: str, **attrs) -> "Recording":
+        """
+        Returns a slim copy of the recording to pass to another process,
+        e.g. a plot window. It holds only the metadata, the given shared
+        arrays and attributes, but no DataFrames, snapshots or cached values.
+        The shared arrays are pickled by the names of their segments, so the
+        process attaches to them without copying.
+        The handle does not own the arrays, never free it.
+
+        @param segments: names of the segment attributes to include, e.g.
+            "data" or "mv_mads".
+        @param attrs: further attributes to set on the handle, e.g. the
+            detection thresholds.
+
+        @return the handle, a Recording with only these attributes.
+        """
+        slim = Recording.__new__(Recording)
+        for attr in HANDLE_ATTRS:
+            setattr(slim, attr, getattr(self, attr))
+        # the importers' loaders are partials of module-level functions,
+        # which pickle by reference, so previews of lazy recordings work
+        slim.loader = self.loader
+        slim.snapshots = []
+        slim.segments = SegmentRegistry(max_cached_bytes=0)
+        for name in segments:
+            setattr(slim, name, getattr(self, name))
+        for attr, value in attrs.items():
+            setattr(slim, attr, value)
+
+        return slim
+
+    def snapshot(self, label: str) -> None:
+        """
+        Saves the data matrix to disk before a preprocessing step modifies
+        or replaces it, such that the step can be undone without importing
+        the file again. Shared memory is not used for this, and at most
+        MAX_SNAPSHOTS are kept, dropping the oldest first.
+
+        @param label: description of the step about to be applied, e.g.
+            "bandpass 1-300 Hz".
+        """
+        if not self.is_loaded():
+            return
+
+        self.snapshots.append(Snapshot(label, self))
+        del self.snapshots[:-MAX_SNAPSHOTS]
+        # the registry deletes the files of dropped snapshots
+        self.segments.put("snapshots", [snap.data for snap in self.snapshots])
+
+    def undo(self) -> Optional[str]:
+        """
+        Restores the data matrix and metadata from the latest snapshot, i.e.
+        reverts the last preprocessing step.
+
+        @return the label of the reverted step or None if there is none.
+        """
+        if len(self.snapshots) == 0:
+            return None
+
+        snap = self.snapshots.pop()
+        if self.storage == "disk":
+            # the snapshot already is a memory-mapped file
+            data = snap.data
+        else:
+            data = self.allocate(snap.data.shape, snap.data.dtype)
+            copy_array(snap.data, data)
+
+        self.data = data
+        self.segments.put("snapshots", [snap.data for snap in self.snapshots])
+        self.sampling_rate = snap.sampling_rate
+        self.start_idx = snap.start_idx
+        self.stop_idx = snap.stop_idx
+        self.raw = snap.raw
+        self.data_rows = snap.data_rows
+        self.data_changed()
+
+        return snap.label
 
     def free(self):
-        '''
-        Closes and unlinks the shared memory region.
-        '''
-        self._shared.close()
-        self._shared.unlink()
+        """
+        Frees the data matrix, all derived shared arrays and the snapshots.
+        """
+        self.snapshots = []
+        self.segments.free()
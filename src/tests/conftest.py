@@ -0,0 +1,8 @@
+"""
+The modules import each other relative to src, like when running the webapp
+from there, so src is put on the path for the tests.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+"""
+Batch import, see controllers/io/batch.py.
+"""
+import controllers.io.batch as batch
+
+
+def test_import_one_reports_any_error(tmp_path, monkeypatch):
+    path = tmp_path / "recording.h5"
+    path.write_bytes(b"not an HDF5 file")
+
+    def fail(*args, **kwargs):
+        raise MemoryError("out of memory")
+
+    monkeypatch.setattr(batch, "cached_mcs_256_import", fail)
+    row = batch.import_one(str(path))
+
+    assert row[0] == str(path)
+    assert row[7] == "MemoryError: out of memory"
+
+
+def test_probe_one_reports_any_error(tmp_path):
+    path = tmp_path / "recording.h5"
+    path.write_bytes(b"not an HDF5 file")
+
+    row = batch.probe_one(str(path))
+
+    assert row[0] == str(path) and row[-1] != ""
@@ -0,0 +1,37 @@
+"""
+Reading windows of cached recordings, see controllers/io/cache.py.
+"""
+import numpy as np
+import pytest
+
+from controllers.io.cache import cache_dtype, cache_read_window
+
+
+def test_counts_are_cached_exactly(tmp_path):
+    rng = np.random.default_rng(0)
+    counts = rng.integers(-32768, 32767, (4, 50)).astype(np.int16)
+    scales = rng.uniform(1e-7, 2e-7, 4)
+    offsets = rng.integers(-10, 10, 4).astype(np.float64)
+    path = str(tmp_path / "entry.bin")
+    counts.astype(cache_dtype(raw=True)).tofile(path)
+
+    out = np.empty((2, 20), dtype=np.int16)
+    cache_read_window(path, counts.shape, '<i2', scales, offsets, out,
+                      [3, 1], 5, 25)
+    np.testing.assert_array_equal(out, counts[[3, 1], 5:25])
+
+    volts = np.empty((2, 20), dtype=np.float32)
+    cache_read_window(path, counts.shape, '<i2', scales, offsets, volts,
+                      [3, 1], 5, 25)
+    np.testing.assert_allclose(
+        volts, (counts[[3, 1], 5:25] - offsets[[3, 1], None])
+        * scales[[3, 1], None], rtol=1e-6)
+
+
+def test_counts_are_not_recovered_from_volts(tmp_path):
+    path = str(tmp_path / "entry.bin")
+    np.zeros((2, 10), dtype=cache_dtype(False, np.float32)).tofile(path)
+
+    with pytest.raises(ValueError):
+        cache_read_window(path, (2, 10), '<f4', np.ones(2), np.zeros(2),
+                          np.empty((1, 10), dtype=np.int16), [0], 0, 10)
@@ -0,0 +1,63 @@
+"""
+Block-wise network analyses, see controllers/analysis/network.py.
+"""
+import datetime
+
+import numpy as np
+import pytest
+import scipy.signal as sg
+
+# imported lazily by network.py, which requires them to be installed
+for module in ("elephant", "neo", "quantities"):
+    pytest.importorskip(module)
+
+from controllers.analysis.network import (channel_stats, compute_xcorrs,
+                                          iter_channel_pairs)
+from model.data import Recording
+
+
+@pytest.fixture
+def rec(monkeypatch):
+    # blocks of two rows, rows of 300 samples are split for iter_blocks
+    monkeypatch.setattr("model.data.BLOCK_BYTES", 2 * 300 * 8)
+    rng = np.random.default_rng(0)
+    counts = rng.integers(-2000, 2000, (5, 300)).astype(np.int16)
+    names = np.array([f"R 1 C {i + 1}" for i in range(5)])
+    rec = Recording("test", datetime.datetime(2023, 1, 1), 5, 1000, counts,
+                    0, 299, names, np.array([], dtype=int),
+                    np.array([], dtype=str),
+                    scales=rng.uniform(1e-7, 2e-7, 5),
+                    offsets=rng.integers(-10, 10, 5).astype(np.float64),
+                    raw=True)
+    yield rec
+    rec.free()
+
+
+def test_channel_stats_of_split_rows(rec, monkeypatch):
+    sig = rec.get_data()
+    np.testing.assert_allclose(channel_stats(rec),
+                               (np.mean(sig, axis=-1), np.std(sig, axis=-1)))
+
+    monkeypatch.setattr("model.data.BLOCK_BYTES", 70 * 8)
+    assert len(list(rec.iter_blocks())) == 5 * 5
+    np.testing.assert_allclose(channel_stats(rec),
+                               (np.mean(sig, axis=-1), np.std(sig, axis=-1)))
+
+
+def test_pairs_and_xcorrs_match_whole_matrix(rec):
+    pairs = [(i, j) for i, j, _, _ in iter_channel_pairs(rec)]
+    # in blocks of rows, but j is ascending for every i
+    for i in range(5):
+        assert [b for a, b in pairs if a == i] == list(range(i + 1))
+    assert sorted(pairs) == [(i, j) for i in range(5) for j in range(i + 1)]
+
+    sig = rec.get_data()
+    sig = ((sig.T - np.mean(sig, axis=-1)) / np.std(sig, axis=-1)).T
+    lags = sg.correlation_lags(300, 300, "same")
+    compute_xcorrs(rec)
+    for i in range(5):
+        for j in range(5):
+            expected = (sg.correlate(sig[max(i, j)], sig[min(i, j)], 'same')
+                        / (300 - np.abs(lags)))
+            np.testing.assert_allclose(rec.xcorrs[1][i, j], expected,
+                                       atol=1e-12)
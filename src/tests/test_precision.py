@@ -0,0 +1,14 @@
+"""
+Checks that the float32 processing mode stays within the documented
+tolerances of the float64 path, see controllers/analysis/precision.py.
+"""
+from controllers.analysis.precision import (check_precisions,
+                                            synthetic_recording)
+
+
+def test_float32_within_tolerance():
+    rec = synthetic_recording(n_channels=4, duration=10)
+    try:
+        check_precisions(rec)
+    finally:
+        rec.free()
@@ -0,0 +1,56 @@
+"""
+Preprocessing chains, see controllers/analysis/preprocess.py.
+"""
+import datetime
+
+import numpy as np
+
+import controllers.analysis.preprocess as preprocess
+from controllers.analysis.filter import (concurrent_workers, downsample,
+                                         frequency_filter)
+from controllers.analysis.preprocess import (Downsample, FrequencyFilter,
+                                             Preprocessing)
+from model.data import Recording
+
+
+def recording(seed: int = 0) -> Recording:
+    rng = np.random.default_rng(seed)
+    data = rng.standard_normal((6, 20000)) * 1e-5
+    names = np.array([f"R 1 C {i + 1}" for i in range(6)])
+    return Recording("test", datetime.datetime(2023, 1, 1), 6, 10000, data,
+                     0, 19999, names, np.array([], dtype=int),
+                     np.array([], dtype=str))
+
+
+def test_concurrent_workers():
+    assert concurrent_workers(100, 8, 1000) == 8
+    assert concurrent_workers(300, 8, 1000) == 3
+    # a row larger than the budget is still processed
+    assert concurrent_workers(5000, 8, 1000) == 1
+
+
+def test_chain_caps_workers_by_row_size(monkeypatch):
+    # two rows of float64 fit into the budget
+    monkeypatch.setattr(preprocess, "BLOCK_BYTES", 2 * 20000 * 8)
+    used = []
+
+    def map_blocks(func, blocks, workers):
+        used.append(workers)
+        for rows in blocks:
+            func(rows)
+
+    monkeypatch.setattr(preprocess, "map_channel_blocks", map_blocks)
+
+    chained, stepwise = recording(), recording()
+    try:
+        Preprocessing([FrequencyFilter(False, 1, 300),
+                       Downsample(1000)]).apply(chained, workers=16)
+        assert used == [2]
+
+        frequency_filter(stepwise, False, 1, 300)
+        downsample(stepwise, 1000)
+        np.testing.assert_allclose(chained.get_data(), stepwise.get_data(),
+                                   atol=1e-12)
+    finally:
+        chained.free()
+        stepwise.free()
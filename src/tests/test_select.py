@@ -0,0 +1,197 @@
+"""
+Selecting electrodes and time windows repeatedly, see
+controllers/select.py::apply_selection and model/data.py::Recording.select.
+"""
+import datetime
+from functools import partial
+import pickle
+import queue
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from controllers.io.async_import import SelectJob
+from controllers.io.cache import ImportCancelled
+from controllers.select import adopt_selection, apply_selection, read_selection
+from model.data import Recording, SelectionView
+
+N_ROWS, N_SAMPLES = 60, 200
+
+
+def file_contents():
+    """
+    Returns the ADC counts of a small file, their offsets and step sizes per
+    row and the corresponding volts.
+    """
+    rng = np.random.default_rng(0)
+    counts = rng.integers(-2000, 2000, (N_ROWS, N_SAMPLES)).astype(np.int16)
+    scales = rng.uniform(1e-7, 2e-7, N_ROWS)
+    offsets = rng.integers(-10, 10, N_ROWS).astype(np.float64)
+    volts = (counts - offsets.reshape(-1, 1)) * scales.reshape(-1, 1)
+
+    return counts, scales, offsets, volts
+
+
+def read_contents(out, rows, start, stop):
+    """
+    Loader of file_contents, a module-level function like the importers'
+    loaders, so that it can be pickled.
+    """
+    counts, _, _, volts = file_contents()
+    src = counts if np.issubdtype(out.dtype, np.integer) else volts
+    out[:] = src[rows, start:stop]
+
+
+def recording(raw: bool, lazy: bool) -> tuple[Recording, np.ndarray]:
+    """
+    Creates a recording of file_contents, either with the full data matrix
+    in memory or with only the metadata, reading the data through a loader
+    like the importers and the cache do.
+    """
+    counts, scales, offsets, volts = file_contents()
+    if lazy:
+        data = None
+    else:
+        data = counts if raw else volts
+    names = np.array([f"R {i // 16 + 1} C {i % 16 + 1}"
+                      for i in range(N_ROWS)])
+    rec = Recording("test", datetime.datetime(2023, 1, 1), N_ROWS, 1000,
+                    data, 0, N_SAMPLES - 1, names, np.array([], dtype=int),
+                    np.array([], dtype=str), loader=partial(read_contents),
+                    n_samples=N_SAMPLES, scales=scales, offsets=offsets,
+                    raw=raw)
+
+    return rec, volts
+
+
+def select(rec: Recording, rows: list[int], start: int, stop: int):
+    rec.selected_electrodes = list(rows)
+    rec.start_idx, rec.stop_idx = start, stop
+    apply_selection(rec)
+
+
+@pytest.mark.parametrize("raw", [False, True])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_reselect_and_preview(raw, lazy):
+    rec, volts = recording(raw, lazy)
+    try:
+        select(rec, [3, 7, 20], 10, 50)
+        np.testing.assert_allclose(rec.get_data(), volts[[3, 7, 20], 10:50])
+
+        # a wider window and rows outside of the previous selection
+        select(rec, [0, 1, 50], 5, 150)
+        np.testing.assert_allclose(rec.get_data(), volts[[0, 1, 50], 5:150])
+        assert rec.channels_df["Channel"].tolist() \
+            == rec.electrode_names[[0, 1, 50]].tolist()
+
+        preview = rec.preview([2, 59], 0, 100)
+        np.testing.assert_allclose(np.asarray(preview[1]), volts[59, :100])
+    finally:
+        rec.free()
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_reselect_after_copying_selection(raw):
+    rec, volts = recording(raw, lazy=False)
+    try:
+        select(rec, [3, 7, 20], 10, 50)
+        assert isinstance(rec.data, SelectionView)
+        # e.g. before filtering in-place, the full data matrix is released
+        rec.to_float()
+        assert rec.full_data() is None
+
+        select(rec, [0, 1, 50], 5, 150)
+        np.testing.assert_allclose(rec.get_data(), volts[[0, 1, 50], 5:150])
+        np.testing.assert_allclose(rec.preview([4, 5], 0, 30),
+                                   volts[[4, 5], :30])
+    finally:
+        rec.free()
+
+
+def test_undo_selection_copy_keeps_scales():
+    rec, volts = recording(raw=True, lazy=True)
+    try:
+        select(rec, [1, 40], 0, 100)
+        rec.snapshot("noop")
+        rec.to_float()
+        rec.get_data()[:] = 0
+        rec.undo()
+        np.testing.assert_allclose(rec.get_data(), volts[[1, 40], :100])
+    finally:
+        rec.free()
+
+
+def test_read_window_rejects_rows_outside_the_file():
+    rec, _ = recording(raw=False, lazy=False)
+    try:
+        with pytest.raises(IndexError):
+            rec.read_window([0, N_ROWS], 0, 10)
+    finally:
+        rec.free()
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_preview_through_handle_of_lazy_recording(raw):
+    # e.g. "Show signals" on the select screen before applying a selection
+    rec, volts = recording(raw, lazy=True)
+    try:
+        handle = pickle.loads(pickle.dumps(rec.handle("data")))
+        np.testing.assert_allclose(handle.preview([2, 59], 10, 60),
+                                   volts[[2, 59], 10:60])
+    finally:
+        rec.free()
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_select_job_reads_in_background(raw):
+    rec, volts = recording(raw, lazy=True)
+    try:
+        rec.selected_electrodes = [0, 5, 33]
+        rec.start_idx, rec.stop_idx = 20, 180
+        job = SelectJob(rec)
+        deadline = time.monotonic() + 60
+        while not job.poll() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert job.result is not None, job.info
+        assert job.total_bytes == job.result.read().nbytes
+
+        adopt_selection(rec, job.result)
+        np.testing.assert_allclose(rec.get_data(), volts[[0, 5, 33], 20:180])
+    finally:
+        rec.free()
+
+
+def test_read_selection_reports_progress_and_cancels(monkeypatch):
+    # blocks of two rows
+    monkeypatch.setattr("controllers.select.BLOCK_BYTES", 2 * 100 * 8)
+    rec, _ = recording(raw=False, lazy=True)
+    rec.selected_electrodes = list(range(10))
+    rec.start_idx, rec.stop_idx = 0, 100
+
+    que = queue.Queue()
+    read_selection(rec, que).free()
+    progress = [que.get_nowait()[1] for _ in range(que.qsize())]
+    assert progress == [1600, 3200, 4800, 6400, 8000]
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(ImportCancelled):
+        read_selection(rec, cancel=cancel)
+
+
+def test_read_selection_splits_long_rows(monkeypatch):
+    # rows of 100 samples are read in windows of 40
+    monkeypatch.setattr("controllers.select.BLOCK_BYTES", 40 * 8)
+    rec, volts = recording(raw=False, lazy=True)
+    rec.selected_electrodes = [2, 3]
+    rec.start_idx, rec.stop_idx = 50, 150
+
+    que = queue.Queue()
+    data = read_selection(rec, que)
+    try:
+        assert que.qsize() == 6
+        np.testing.assert_allclose(data.read(), volts[[2, 3], 50:150])
+    finally:
+        data.free()
@@ -0,0 +1,22 @@
+"""
+Fails if the cold start of the webapp regresses, see lazy_import.py.
+"""
+import importlib.util
+
+import pytest
+
+from lazy_import import HEAVY_MODULES, check_startup
+
+# Libraries the webapp imports at startup, besides numpy and pandas.
+STARTUP_MODULES = ["dash", "dash_bootstrap_components", "h5py", "plotly",
+                   "tabulate"]
+
+
+def test_startup_within_budget():
+    # lazily imported modules have to be installed, too
+    missing = [name for name in STARTUP_MODULES + HEAVY_MODULES
+               if importlib.util.find_spec(name.split(".")[0]) is None]
+    if missing:
+        pytest.skip(f"requirements not installed: {', '.join(missing)}")
+
+    assert check_startup() == []
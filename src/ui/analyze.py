@@ -8,6 +8,8 @@ from dash import html
 import dash_bootstrap_components as dbc
 import numpy as np
 
+from model.data import ResultTable
+
 # , style={"padding": "50px"}
 # width="auto"
 # , align="center", justify="center"
@@ -89,8 +91,9 @@ def generate_table(dataframe, from_row=0, max_rows=100):
     """
     Generate a HTML table from a pandas dataframe.
 
-    :param dataframe: The dataframe to generate the table from.
-    :type dataframe: pandas.DataFrame
+    :param dataframe: The dataframe to generate the table from. Result
+        tables are converted only for the displayed rows.
+    :type dataframe: pandas.DataFrame | ResultTable
 
     :param from_row: The row to start from.
     :type from_row: int
@@ -103,6 +106,10 @@ def generate_table(dataframe, from_row=0, max_rows=100):
     :return: The HTML table.
     :rtype: dash_html_components.Table
     """
+    if isinstance(dataframe, ResultTable):
+        dataframe = dataframe.to_frame(from_row, from_row + max_rows)
+        from_row = 0
+
     rows = []
     for i in range(from_row, min(len(dataframe), from_row + max_rows)):
         cols = []
@@ -127,7 +134,17 @@ filters = dbc.AccordionItem([
     # Rereference (to remove noise across all channels)
     # Line Noise
     dbc.Row([
-        dbc.Row([dbc.Button("Remove Line Noise (EU)",
+        dbc.Row([
+            dbc.Col([dbc.RadioItems(id="analyze-linenoise-freq",
+                                    options=[{"label": "50 Hz (EU)",
+                                              "value": 50},
+                                             {"label": "60 Hz (US)",
+                                              "value": 60}],
+                                    value=50, inline=True)]),
+            dbc.Col([dbc.Input(placeholder="Harmonics (default 9)",
+                               id="analyze-linenoise-harmonics")])
+            ]),
+        dbc.Row([dbc.Button("Remove Line Noise",
                             id="analyze-linenoise-apply")]),
         dbc.Row([], id="analyze-linenoise-result"),
     ], style={"padding": "25px"}, class_name="border rounded-3"),
@@ -158,6 +175,25 @@ filters = dbc.AccordionItem([
         dbc.Col([dbc.Button("Downsample", id="analyze-dwnsmpl-apply")]),
         dbc.Row([], id="analyze-dwnsmpl-result"),
     ], style={"padding": "25px"}, class_name="border rounded-3"),
+    # All of the above in a single pass over the data
+    dbc.Row([
+        dbc.Row([html.H6("Preprocessing Chain")]),
+        dbc.Row([html.Hr(className="my-2")]),
+        dbc.Checklist(id="analyze-chain-stages",
+                      options=[{"label": "Frequency Filter",
+                                "value": "filter"},
+                               {"label": "Line Noise", "value": "linenoise"},
+                               {"label": "Downsample", "value": "downsample"}],
+                      value=[], inline=True),
+        dbc.Row([dbc.Button("Apply Selected Steps in One Pass",
+                            id="analyze-chain-apply")]),
+        dbc.Row([], id="analyze-chain-result"),
+    ], style={"padding": "25px"}, class_name="border rounded-3"),
+    # Undo
+    dbc.Row([
+        dbc.Row([dbc.Button("Undo Last Step", id="analyze-undo-apply")]),
+        dbc.Row([], id="analyze-undo-result"),
+    ], style={"padding": "25px"}, class_name="border rounded-3"),
 
 ], title="Filter")
 
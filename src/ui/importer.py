@@ -1,7 +1,7 @@
 """
 Dash-based HTML code for the home/import ui to be displayed in the browser via the Dash server.
 """
-from dash import html
+from dash import dcc, html
 import dash_bootstrap_components as dbc
 
 importer_input = dbc.Container(
@@ -34,7 +34,58 @@ importer_input = dbc.Container(
                                             options=[{"label": "MCS 256",
                                                       "value": 0},
                                                      {"label": "MCS CMOS",
-                                                      "value": 1, "disabled": True},
+                                                      "value": 1},
+                                                     ],
+                                            ), width="auto")],
+                    align="center",
+                    justify="center",
+                    style={"padding": "5px"}
+                    ),
+            dbc.Row([dbc.Col(html.H6("Storage:"), width="auto"),
+                     dbc.Col(dbc.Checklist(id="import-raw", value=[],
+                                           inline=True,
+                                           options=[{"label": "Raw int16 ADC "
+                                                     "counts (1/4 memory)",
+                                                     "value": 1}],
+                                           ), width="auto")],
+                    align="center",
+                    justify="center",
+                    style={"padding": "5px"}
+                    ),
+            dbc.Row([dbc.Col(html.H6("Cache:"), width="auto"),
+                     dbc.Col(dbc.Checklist(id="import-cache", value=[],
+                                           inline=True,
+                                           options=[{"label": "Copy the whole "
+                                                     "file to the cache to "
+                                                     "reopen it faster",
+                                                     "value": 1}],
+                                           ), width="auto")],
+                    align="center",
+                    justify="center",
+                    style={"padding": "5px"}
+                    ),
+            dbc.Row([dbc.Col(html.H6("Precision:"), width="auto"),
+                     dbc.Col(dbc.RadioItems(id="import-precision",
+                                            value="float64", inline=True,
+                                            options=[{"label": "float64",
+                                                      "value": "float64"},
+                                                     {"label": "float32 "
+                                                      "(1/2 memory)",
+                                                      "value": "float32"},
+                                                     ],
+                                            ), width="auto")],
+                    align="center",
+                    justify="center",
+                    style={"padding": "5px"}
+                    ),
+            dbc.Row([dbc.Col(html.H6("Location:"), width="auto"),
+                     dbc.Col(dbc.RadioItems(id="import-storage",
+                                            value="shm", inline=True,
+                                            options=[{"label": "Shared memory",
+                                                      "value": "shm"},
+                                                     {"label": "Disk (larger "
+                                                      "than RAM)",
+                                                      "value": "disk"},
                                                      ],
                                             ), width="auto")],
                     align="center",
@@ -44,12 +95,26 @@ importer_input = dbc.Container(
             dbc.Row([dbc.Col(dbc.Button("Submit",
                                         id="import-submit-input-file-path",
                                         n_clicks=0),
+                             width="auto"),
+                     dbc.Col(dbc.Button("Cancel", id="import-cancel",
+                                        color="secondary", n_clicks=0),
                              width="auto")],
                     align="center",
                     justify="center",
                     style={"padding": "5px"}
                     ),
-            dbc.Container(id="import-feedback")
+            dbc.Row([dbc.Col(dbc.Progress(id="import-progress", value=0,
+                                          striped=True, animated=True),
+                             width=6)],
+                    id="import-progress-row",
+                    align="center",
+                    justify="center",
+                    style={"padding": "5px", "display": "none"}
+                    ),
+            dcc.Interval(id="import-interval", interval=500),
+            dbc.Container(id="import-probe"),
+            dbc.Container(id="import-feedback"),
+            dbc.Container(id="import-result")
             ],
         style={"padding": "50px"}
         )
@@ -77,6 +142,21 @@ importer = html.Div(
         )
 
 
+def build_probe_infos(infos):
+    """
+    Displays the metadata of a file before it is imported.
+
+        @param infos: preformatted string containing the metadata, see \
+                controllers/io/import_mcs_256.py::probe_info
+
+        @return: HTML to display the preformatted string.
+    """
+    return dbc.Row([dbc.Col([html.Pre(infos)], width="auto")],
+                   align="center",
+                   justify="center",
+                   style={"padding": "20px"})
+
+
 def build_import_infos(infos, success):
     """
     Creates a next button on success and displays the preformatted string info \
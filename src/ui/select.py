@@ -14,6 +14,10 @@ no_data = dbc.Col([dbc.Alert("Please select at least one electrode!",
                              color="danger")], width="auto")
 
 
+def selection_failed(info: str):
+    return dbc.Col([dbc.Alert(info, color="danger")], width="auto")
+
+
 def select(grid):
     return dbc.Container(
         [
@@ -69,12 +73,25 @@ def select(grid):
                 dbc.Col(
                     dbc.Button("Apply electrode and time window selection",
                                id="select-apply", n_clicks=0),
+                    width="auto"),
+                dbc.Col(
+                    dbc.Button("Cancel", id="select-cancel",
+                               color="secondary", n_clicks=0),
                     width="auto")
                 ],
                 id="select-next",
                 align="center",
                 justify="center",
                 style={"padding": "25px"}),
+            dbc.Row([dbc.Col(dbc.Progress(id="select-progress", value=0,
+                                          striped=True, animated=True),
+                             width=6)],
+                    id="select-progress-row",
+                    align="center",
+                    justify="center",
+                    style={"padding": "5px", "display": "none"}
+                    ),
+            dcc.Interval(id="select-interval", interval=500),
             dbc.Row([], id="select-output-dummy"),
         ],
         style={"padding": "50px"}, fluid=True
@@ -7,8 +7,6 @@ import os
 
 from plotly import graph_objects as go
 import numpy as np
-from matplotlib import use, animation
-import matplotlib.pyplot as plt
 
 from constants import grid_size
 from model.data import Recording
@@ -131,6 +129,9 @@ def create_video(rec: Recording, bins: np.ndarray, fps: float) -> None:
         :param bins: binned data
         :param fps: the frame rate
     """
+    from matplotlib import use, animation
+    import matplotlib.pyplot as plt
+
     use('AGG')
     base_path = os.path.join(os.getcwd(), "plots")
     video_name = os.path.join(base_path, "amplitude-animation.mp4")
@@ -172,6 +173,8 @@ def plot_value_grid(rec: Recording, values: np.ndarray) -> None:
         :param values: a 1D array with exactly 252 values aligned to the data \
                 rows
     """
+    import matplotlib.pyplot as plt
+
     xx, yy, xx_un, yy_un, names_sel, _ = get_marked_coords(rec)
     lims = [np.amin(values), np.amax(values)]
 
@@ -29,12 +29,17 @@ class MEAGridPlotIterator:
         self.grid_sz = int(np.sqrt(rec.n_mea_electrodes))
         self.sel_e = el_idx_data_to_plot(rec)
         self.crnrs = rec.ground_els
-        adj_els = [[self.crnrs[0] + 1, self.crnrs[0] + self.grid_sz],
-                   [self.crnrs[1] - 1, self.crnrs[1] + self.grid_sz],
-                   [self.crnrs[2] + 1, self.crnrs[2] - self.grid_sz],
-                   [self.crnrs[3] - 1, self.crnrs[3] - self.grid_sz]]
-        cnt_crnrs = [all([el in self.sel_e for el in adj_el])
-                     for adj_el in adj_els]
+        # CMOS-MEAs have no ground electrodes in the corners
+        if len(self.crnrs) == 4:
+            adj_els = [[self.crnrs[0] + 1, self.crnrs[0] + self.grid_sz],
+                       [self.crnrs[1] - 1, self.crnrs[1] + self.grid_sz],
+                       [self.crnrs[2] + 1, self.crnrs[2] - self.grid_sz],
+                       [self.crnrs[3] - 1, self.crnrs[3] - self.grid_sz]]
+            cnt_crnrs = [all([el in self.sel_e for el in adj_el])
+                         for adj_el in adj_els]
+        else:
+            self.crnrs = [-1] * 4
+            cnt_crnrs = [False] * 4
 
         plotted = np.zeros((self.grid_sz, self.grid_sz))
         for i in range(self.grid_sz):
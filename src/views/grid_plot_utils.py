@@ -6,33 +6,23 @@ from model.data import Recording
 # Convert the selected electrode indexes from conforming to the data matrix
 # to a row-major enumeration __including__ the ground electrodes for plotting
 def el_idx_data_to_plot(rec: Recording) -> np.ndarray:
-    sel = rec.selected_electrodes.copy()
-    for i, idx in enumerate(sel):
-        if idx >= rec.ground_els[2] - 2:
-            sel[i] += 3
-        elif idx >= rec.ground_els[1] - 1:
-            sel[i] += 2
-        elif idx >= rec.ground_els[0]:
-            sel[i] += 1
-
-    return sel
+    return non_ground_els(rec)[rec.selected_electrodes].tolist()
 
 
 def el_idx_plot_to_data(rec: Recording, idx: int) -> int:
     if idx in rec.ground_els:
-        idx = -1
-    else:
-        # The grid also shows the ground electrodes.
-        # the indexes must be subtracted accordingly to
-        # be fitting to the data matrix
-        if idx >= rec.ground_els[2]:
-            idx -= 3
-        elif idx >= rec.ground_els[1]:
-            idx -= 2
-        elif idx >= rec.ground_els[0]:
-            idx -= 1
-
-    return idx
+        return -1
+
+    # The grid also shows the ground electrodes.
+    # the indexes must be subtracted accordingly to
+    # be fitting to the data matrix
+    return int(np.searchsorted(non_ground_els(rec), idx))
+
+
+# Row-major indexes of the grid positions that are rows of the data matrix,
+# i.e. all but the ground electrodes. CMOS-MEAs have no ground electrodes.
+def non_ground_els(rec: Recording) -> np.ndarray:
+    return np.setdiff1d(np.arange(rec.n_mea_electrodes), rec.ground_els)
 
 
 def el_names_insert_grounds(rec: Recording) -> np.ndarray:
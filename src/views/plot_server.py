@@ -0,0 +1,180 @@
+"""
+Long-lived process that shows all pyqtgraph plot windows.
+
+Starting a new interpreter per plot means importing Qt, pyqtgraph and numpy
+and creating a QApplication on every click, which takes seconds. The plot
+server is started once and receives commands through a pipe, which its Qt
+event loop polls with a timer. Recordings are passed as slim handles, whose
+shared arrays the server attaches to by name, see
+model/data.py::Recording.handle.
+
+The arrays shown in a window must neither be freed nor recycled while the
+window is open. Thus every window is represented in the Dash process by a
+PlotWindow, which counts as alive until the server reports that it was
+closed, see model/data.py::SegmentRegistry.attach.
+"""
+import atexit
+import itertools
+import multiprocessing as mp
+import traceback
+
+from model.data import Recording
+
+# Interval in milliseconds in which the server checks for new commands and
+# closed windows.
+POLL_MS = 50
+
+
+class PlotWindow:
+    """
+    Handle of a window shown by the plot server.
+    """
+
+    def __init__(self, server: "PlotServer", window_id: int) -> None:
+        self.server = server
+        self.window_id = window_id
+        self.closed = False
+
+    def is_alive(self) -> bool:
+        """
+        :return True until the window was closed or the server terminated.
+        """
+        self.server.poll()
+
+        return not self.closed and self.server.is_alive()
+
+
+class PlotServer:
+    """
+    Starts the plot process on demand and sends it the windows to show.
+    """
+
+    def __init__(self) -> None:
+        self.proc = None
+        self.conn = None
+        self.windows: dict[int, PlotWindow] = {}
+        self._ids = itertools.count()
+
+    def is_alive(self) -> bool:
+        """
+        :return True if the server process is running.
+        """
+        return self.proc is not None and self.proc.is_alive()
+
+    def start(self) -> None:
+        """
+        Starts the server process, unless it is running already. Called once
+        at startup, such that the first plot does not wait for Qt either.
+        """
+        if self.is_alive():
+            return
+
+        ctx = mp.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=serve, args=(child_conn,), daemon=True)
+        self.proc.start()
+
+    def plot(self, kind: str, rec: Recording, handle: Recording, *args
+             ) -> PlotWindow:
+        """
+        Shows a new window.
+
+            :param kind: the kind of plot, "time_series", "psds" or
+                    "spectrograms", see serve.
+            :param rec: the recording owning the plotted arrays.
+            :param handle: the slim handle of the recording to plot.
+            :param args: further arguments of the plot function.
+
+            :return the handle of the window.
+        """
+        self.start()
+        window = PlotWindow(self, next(self._ids))
+        self.windows[window.window_id] = window
+        self.conn.send((window.window_id, kind, (handle,) + args))
+        # keep the segments until the window is closed
+        rec.segments.attach(window)
+
+        return window
+
+    def poll(self) -> None:
+        """
+        Reads the messages about closed windows sent by the server so far.
+        """
+        while self.is_alive():
+            try:
+                if not self.conn.poll():
+                    break
+                _, window_id = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            self.windows.pop(window_id).closed = True
+
+    def stop(self) -> None:
+        """
+        Closes all windows and terminates the server process.
+        """
+        if not self.is_alive():
+            return
+
+        self.conn.send(None)
+        self.proc.join(timeout=1)
+        if self.proc.is_alive():
+            self.proc.terminate()
+
+
+def serve(conn) -> None:
+    """
+    Entry point of the plot process. Runs the Qt event loop and builds a
+    window for every command ((window id, kind, arguments)) received, until
+    None is received. Sends ("closed", window id) when a window was closed.
+
+        :param conn: the end of the pipe to the Dash process.
+    """
+    import pyqtgraph as pg
+    from pyqtgraph.Qt import QtCore
+
+    from views.spectral_plots import psds_window, spectrograms_window
+    from views.time_series_plots import time_series_window
+
+    builders = {"time_series": time_series_window,
+                "psds": psds_window,
+                "spectrograms": spectrograms_window}
+
+    app = pg.mkQApp("MEA Analysis")
+    app.setQuitOnLastWindowClosed(False)
+    windows = {}
+
+    def poll():
+        try:
+            while conn.poll():
+                command = conn.recv()
+                if command is None:
+                    app.quit()
+                    return
+
+                window_id, kind, args = command
+                try:
+                    windows[window_id] = builders[kind](*args)
+                except Exception:
+                    traceback.print_exc()
+                    conn.send(("closed", window_id))
+        except (EOFError, OSError):
+            # the Dash process terminated
+            app.quit()
+            return
+
+        for window_id, win in list(windows.items()):
+            if not win.isVisible():
+                # drops the last reference to the window and its arrays
+                del windows[window_id]
+                conn.send(("closed", window_id))
+
+    timer = QtCore.QTimer()
+    timer.timeout.connect(poll)
+    timer.start(POLL_MS)
+
+    pg.exec()
+
+
+SERVER = PlotServer()
+atexit.register(SERVER.stop)
@@ -2,26 +2,29 @@
 """
 This module contains the function to plot the time series data in a grid.
 """
-from multiprocessing import Process
 import numpy as np
-import pyqtgraph as pg
 
 import sys
 import pdb
 
 from model.data import Recording
 from views.grid_plot_iterator import MEAGridPlotIterator
+from views.plot_server import SERVER
+from lazy_import import lazy_import
+
+# only the plot server builds windows, see views/plot_server.py
+pg = lazy_import("pyqtgraph")
 
 
 def plot_psds_grid(rec: Recording):
     """
 
     """
-    proc = Process(target=do_plot_psds, args=(rec,))
-    proc.start()
+    # the arrays are attached by name, see views/plot_server.py
+    SERVER.plot("psds", rec, rec.handle("psds"))
 
 
-def do_plot_psds(rec: Recording):
+def psds_window(rec: Recording) -> "pg.GraphicsLayoutWidget":
     """
 
     """
@@ -51,18 +54,18 @@ def do_plot_psds(rec: Recording):
 
         prev_p = p
 
-    pg.exec()
+    return win
 
 
 def plot_spectrograms_grid(rec: Recording):
     """
 
     """
-    proc = Process(target=do_plot_spectrograms, args=(rec,))
-    proc.start()
+    # the arrays are attached by name, see views/plot_server.py
+    SERVER.plot("spectrograms", rec, rec.handle("spectrograms"))
 
 
-def do_plot_spectrograms(rec: Recording):
+def spectrograms_window(rec: Recording) -> "pg.GraphicsLayoutWidget":
     """
 
     """
@@ -113,4 +116,4 @@ def do_plot_spectrograms(rec: Recording):
                     np.percentile(plot_pows, 99)))
     win.addItem(cbar)
 
-    pg.exec()
+    return win
@@ -3,12 +3,15 @@ This module contains the function to plot the time series data in a grid.
 """
 import sys
 import pdb
-from multiprocessing import Process
 import numpy as np
-import pyqtgraph as pg
 
 from model.data import Recording
 from views.grid_plot_iterator import MEAGridPlotIterator
+from views.plot_server import SERVER
+from lazy_import import lazy_import
+
+# only the plot server builds windows, see views/plot_server.py
+pg = lazy_import("pyqtgraph")
 
 
 def plot_time_series_grid(rec: Recording,
@@ -19,20 +22,35 @@ def plot_time_series_grid(rec: Recording,
                           thresh: bool = False):
     """
     Wrapper function to plot the time series data in a grid.
-    Neccessary to run the plotting in a separate process before the callback
-    exits.
+    The window is shown by the plot server process, such that the callback
+    exits immediately, see views/plot_server.py. The server gets a slim
+    handle of the recording, see model/data.py::Recording.handle.
     """
-    proc = Process(target=do_plot, args=(rec, selected, signals,
-                   peaks, events, thresh))
-    proc.start()
-
-
-def do_plot(rec: Recording,
-            selected: bool,
-            signals: bool,
-            peaks: bool,
-            events: bool,
-            thresh: bool):
+    # only pass what is plotted, the arrays are attached by name
+    segments = ["data"]
+    if thresh:
+        segments += ["mv_mads", "envelopes"]
+    if peaks:
+        segments.append("peaks")
+    if peaks and thresh:
+        segments.append("mad_env")
+    if events:
+        segments.append("events")
+    thresholds = {attr: getattr(rec, attr, None)
+                  for attr in ["lower", "upper", "mad_thresh",
+                               "event_mad_thresh"]}
+    handle = rec.handle(*segments, **thresholds)
+
+    SERVER.plot("time_series", rec, handle, selected, signals, peaks,
+                events, thresh)
+
+
+def time_series_window(rec: Recording,
+                       selected: bool,
+                       signals: bool,
+                       peaks: bool,
+                       events: bool,
+                       thresh: bool) -> "pg.GraphicsLayoutWidget":
     """
     Plot the time series data in a grid. The grid is created using the
     MEAGridPlotIterator class. The plots are created using the pyqtgraph
@@ -76,10 +94,11 @@ def do_plot(rec: Recording,
         sel_names = rec.electrode_names
 
     t_start, t_stop = rec.get_time_s()
-    data = rec.get_data()
-    ts = np.linspace(t_start, t_stop, num=data.shape[1])
-    sigs = (data[rec.selected_electrodes, rec.start_idx:rec.stop_idx]
-            if not selected else data)
+    # the preview plots rows of the full data matrix without copying them
+    sigs = (rec.preview(rec.selected_electrodes, rec.start_idx,
+                        rec.stop_idx)
+            if not selected else rec.get_data())
+    ts = np.linspace(t_start, t_stop, num=sigs.shape[1])
     mv_mads = rec.mv_mads.read() if thresh else None
 
     win = pg.GraphicsLayoutWidget(show=True, title="Raw signals")
@@ -107,8 +126,7 @@ def do_plot(rec: Recording,
                    label="Moving MAD")
 
         if peaks:
-            pdf = rec.peaks_df[rec.peaks_df['Channel'] == sel_names[i]]
-            peak_idxs = pdf['PeakIndex'].values.astype(int)
+            peak_idxs = rec.peaks[i]
 
             p.plot(x=ts[peak_idxs], y=sigs[i][peak_idxs], pen=None,
                    symbolBrush=(255, 0, 0, 255), symbolPen='w', label="Peaks")
@@ -133,9 +151,8 @@ def do_plot(rec: Recording,
                 p.addItem(inf3)
 
         if events:
-            edf = rec.events_df[rec.events_df['Channel'] == sel_names[i]]
-            start_idxs = edf['StartIndex'].values.astype(int)
-            stop_idxs = edf['StopIndex'].values.astype(int)
+            start_idxs = rec.events[0][i]
+            stop_idxs = rec.events[1][i]
 
             for start, stop in zip(start_idxs, stop_idxs):
                 p.plot(x=ts[start:stop], y=sigs[i][start:stop],
@@ -155,4 +172,4 @@ def do_plot(rec: Recording,
 
         prev_p = p
 
-    pg.exec()
+    return win
@@ -6,55 +6,74 @@ the Dash-based html code from views/ui, and the controllers implemented in
 controllers/.
 """
 import os
-from multiprocessing import Queue
 import multiprocessing as mp
 import pdb
 
+# Heavy scientific libraries are imported on first use, see lazy_import.py.
+# The remaining imports are timed per group and reported at startup.
+from lazy_import import ImportTimer
+
+IMPORT_TIMER = ImportTimer()
+
+with IMPORT_TIMER.group("numpy, pandas"):
+    import numpy as np
+    import pandas as pd
+
 # Dash server, html and core components as well as bootstrap components and
 # callback parameters
-from dash import dcc, html, Dash
-from dash.dependencies import Input, Output, State
-import dash_bootstrap_components as dbc
-import numpy as np
-import pandas as pd
-from plotly import graph_objects as go
-
-# Code used to import data into a Data object, see model/Data.py
-from controllers.io.import_mcs_256 import mcs_256_import
-# controllers to select, preprocess and analyze data.
-from controllers.select import (apply_selection,
-                                convert_to_jpeg,
-                                update_electrode_selection,
-                                max_duration,
-                                update_time_window)
-
-from controllers.analysis.filter import (frequency_filter,
-                                         downsample,
-                                         filter_line_noise)
-
-from controllers.analysis.analyze import (compute_snrs,
-                                          compute_rms,
-                                          compute_entropies)
-
-from controllers.analysis.activity import detect_peaks, detect_events
-
-from controllers.analysis.spectral import (compute_psds,
-                                           compute_spectrograms)
-from controllers.analysis.network import compute_xcorrs
-
-
-# Dash-wrapped html code for the UI
-from ui.nav import navbar, nav_items
-from ui.importer import importer, build_import_infos
-from ui.select import select, no_data, next_button
-from ui.analyze import analyze, generate_table, TimeSeriesPlottable
-
-# Plots using Plotly for selection and pyqtgraph everything else
-from views.electrode_grid import draw_electrode_grid
-from views.time_series_plots import plot_time_series_grid
-
-from views.spectral_plots import (plot_psds_grid,
-                                  plot_spectrograms_grid)
+with IMPORT_TIMER.group("dash"):
+    from dash import callback_context, dcc, html, Dash
+    from dash.dependencies import Input, Output, State
+    from dash.exceptions import PreventUpdate
+    import dash_bootstrap_components as dbc
+    from plotly import graph_objects as go
+
+with IMPORT_TIMER.group("controllers"):
+    # Code used to import data into a Data object, see model/Data.py
+    from controllers.io.async_import import ImportJob, SelectJob
+    from controllers.io.import_mcs_256 import mcs_256_probe, probe_info
+    # controllers to select, preprocess and analyze data.
+    from controllers.select import (adopt_selection,
+                                    apply_selection,
+                                    convert_to_jpeg,
+                                    update_electrode_selection,
+                                    max_duration,
+                                    update_time_window)
+
+    from controllers.analysis.filter import (frequency_filter,
+                                             downsample,
+                                             filter_line_noise)
+    from controllers.analysis.preprocess import (Downsample,
+                                                 FrequencyFilter,
+                                                 LineNoiseFilter,
+                                                 Preprocessing)
+
+    from controllers.analysis.analyze import (compute_snrs,
+                                              compute_rms,
+                                              compute_entropies)
+
+    from controllers.analysis.activity import detect_peaks, detect_events
+
+    from controllers.analysis.spectral import (compute_psds,
+                                               compute_spectrograms)
+    from controllers.analysis.network import compute_xcorrs
+
+with IMPORT_TIMER.group("ui"):
+    # Dash-wrapped html code for the UI
+    from ui.nav import navbar, nav_items
+    from ui.importer import importer, build_import_infos, build_probe_infos
+    from ui.select import (select, no_data, next_button,
+                           selection_failed)
+    from ui.analyze import analyze, generate_table, TimeSeriesPlottable
+
+with IMPORT_TIMER.group("views"):
+    # Plots using Plotly for selection and pyqtgraph everything else
+    from views.electrode_grid import draw_electrode_grid
+    from views.plot_server import SERVER as PLOT_SERVER
+    from views.time_series_plots import plot_time_series_grid
+
+    from views.spectral_plots import (plot_psds_grid,
+                                      plot_spectrograms_grid)
 
 # setup for the server and initialization of the data global
 app = Dash(__name__,
@@ -66,6 +85,10 @@ content = html.Div(id="page-content")
 app.layout = html.Div([dcc.Location(id="url"), navbar, content])
 # REC shared memory
 REC = None
+# import running in the background, see controllers/io/async_import.py
+IMPORT_JOB = None
+# selection read in the background, see controllers/select.py
+SELECT_JOB = None
 CHANNELS_TABLE_START = 0
 PEAKS_TABLE_START = 0
 EVENTS_TABLE_START = 0
@@ -107,55 +130,151 @@ def render_page_content(pathname: str) -> html.Div:
 
 
 # ============= Import
+@app.callback(Output("import-probe", "children"),
+              Input("import-input-file-path", "value"),
+              State("import-radios", "value"),
+              prevent_initial_call=True)
+def probe_file(input_file_path: str, file_type: int) -> html.Div:
+    """
+    Used on home/import screen.
+
+    Shows the metadata of the file as soon as a valid path is entered, without
+            loading any data, see controllers/io/import_mcs_256.py::
+            mcs_256_probe.
+
+        @param input_file_path: path to the file containing data
+        @param file_type: the type of the input file, only MCS 256 can be
+                probed so far.
+
+        @return the metadata of the file or nothing if the path is not a
+                valid file.
+    """
+    if (input_file_path is None or file_type != 0
+            or not os.path.isfile(input_file_path)):
+        return None
+
+    try:
+        return build_probe_infos(probe_info(mcs_256_probe(input_file_path)))
+    except (OSError, KeyError, IndexError):
+        return build_probe_infos("Not a valid multi channel systems H5 file.")
+
+
 @app.callback(Output("import-feedback", "children"),
               Input("import-submit-input-file-path", "n_clicks"),
+              Input("import-cancel", "n_clicks"),
               State("import-input-file-path", "value"),
               State("import-radios", "value"),
+              State("import-raw", "value"),
+              State("import-precision", "value"),
+              State("import-storage", "value"),
+              State("import-cache", "value"),
               prevent_initial_call=True)
 def import_file(_: int,
+                __: int,
                 input_file_path: str,
-                file_type: int
+                file_type: int,
+                raw: list[int],
+                precision: str,
+                storage: str,
+                fill_cache: list[int]
                 ) -> list[html.Div]:
     """
     Used on home/import screen.
 
-    Loads data from file into a Data object, stored in the REC global
-            variable, see model/Data.py using the importers provided in
-            model/io.
-    So far only the 252 channel MEA by MultiChannel Systems is supported.
+    Starts loading data from file into a Data object in a background process,
+            see controllers/io/async_import.py. The recording is stored in the
+            REC global variable by import_progress once it is done.
+            The cancel button stops a running import.
+    The 252 channel MEA and the CMOS-MEAs by MultiChannel Systems are
+    supported.
 
         @param input_file_path: path to the file containing data
         @param file_type: the type of the input file, used to choose the
                 apropriate importer e.g. MCS 256.
-
-        @return feedback if the import was successful. If so metadata shall be
-                displayed, if not an error message is shown.
+        @param raw: if checked, the data is kept as int16 ADC counts.
+        @param precision: float64 or float32, the floating point type of the
+                data and all derived arrays.
+        @param storage: shm or disk, where the data matrix is kept.
+        @param fill_cache: if checked, an MCS 256 file that is not cached yet
+                is copied to the cache before the selection, to reopen it
+                faster next time.
+
+        @return an error message if the import could not be started.
     """
+    global REC, IMPORT_JOB, SELECT_JOB
+
+    if callback_context.triggered[0]["prop_id"].startswith("import-cancel"):
+        if IMPORT_JOB is not None:
+            IMPORT_JOB.cancel()
+        return None
+
     if (input_file_path is None or file_type is None
             or os.path.exists(input_file_path) is False):
         return build_import_infos("Please enter a valid file path!\n"
                                   f"{input_file_path}", success=False)
 
-    global REC
-    import_que = Queue()
+    if IMPORT_JOB is not None and not IMPORT_JOB.finished:
+        return build_import_infos("Another import is still running, please "
+                                  "wait or cancel it.", success=False)
 
-    if file_type == 0:
+    if SELECT_JOB is not None:
+        if not SELECT_JOB.poll():
+            return build_import_infos("A selection is still being read, "
+                                      "please wait or cancel it.",
+                                      success=False)
+        # read for the recording that is replaced now
+        if SELECT_JOB.result is not None:
+            SELECT_JOB.result.free()
+        SELECT_JOB = None
 
-        if REC:
-            REC.free()
+    if REC:
+        REC.free()
+        REC = None
 
-        REC, info = mcs_256_import(input_file_path, import_que)
+    # Only read the metadata here, the selected electrodes and time
+    # window are read from the cache or the file when the selection is
+    # applied.
+    IMPORT_JOB = ImportJob(input_file_path, file_type, raw=bool(raw),
+                           precision=np.dtype(precision), storage=storage,
+                           fill_cache=bool(fill_cache))
 
-#    elif file_type == 1:
-#        proc_import = mcs_cmos_import(input_file_path, import_que)
-    else:
-        raise IOError("Only Multi Channel System H5 file format is supported"
-                      "so far.")
+    return None
 
-    success = REC is not None
-    feedback = build_import_infos(info, success=success)
 
-    return feedback
+@app.callback(Output("import-progress", "value"),
+              Output("import-progress", "label"),
+              Output("import-progress-row", "style"),
+              Output("import-result", "children"),
+              Input("import-interval", "n_intervals"),
+              prevent_initial_call=True)
+def import_progress(_: int) -> tuple:
+    """
+    Used on home/import screen.
+
+    Polls the running import, shows its progress and stores the recording in
+            the REC global variable once it is done.
+
+        @return the progress in percent, its label, the style of the progress
+                bar and the feedback of the import once it finished.
+    """
+    global REC, IMPORT_JOB
+
+    if IMPORT_JOB is None:
+        raise PreventUpdate
+
+    finished = IMPORT_JOB.poll()
+    percent = 100 * IMPORT_JOB.progress()
+    label = (f"{IMPORT_JOB.done_bytes / 1024**2:.0f} / "
+             f"{IMPORT_JOB.total_bytes / 1024**2:.0f} MiB")
+    style = {"padding": "5px"}
+    if not finished:
+        return percent, label, style, None
+
+    REC, info = IMPORT_JOB.rec, IMPORT_JOB.info
+    IMPORT_JOB = None
+
+    return percent, "", {"display": "none"}, build_import_infos(
+            info, success=REC is not None)
 
 
 # ================== Select
@@ -267,15 +386,20 @@ def select_plot_raw(_: int, t_start: str, t_end: str) -> list:
 
 @app.callback(Output("select-output-dummy", "children", allow_duplicate=True),
               Input("select-apply", "n_clicks"),
+              Input("select-cancel", "n_clicks"),
               State("select-start", "value"),
               State("select-stop", "value"),
               prevent_initial_call=True)
-def select_apply(_: int, t_start: str, t_stop: str) -> None:
+def select_apply(_: int, __: int, t_start: str, t_stop: str) -> None:
     """
     Used by select screen.
 
     Discards all but the selected rows, and all columns that are outside of
             the selected time window.
+    If the full data matrix is not in memory, the selection is read from the
+            file or cache in a background process, see
+            controllers/io/async_import.py::SelectJob, and adopted by
+            select_progress once it is done. The cancel button stops it.
 
         @param t_start: start of the time window in s:ms:mus
         @param t_stop: end of the time window in s:ms:mus
@@ -284,12 +408,66 @@ def select_apply(_: int, t_start: str, t_stop: str) -> None:
 
         @retrun a next button to get to the preprocessing page.
     """
+    global SELECT_JOB
+
+    if callback_context.triggered[0]["prop_id"].startswith("select-cancel"):
+        if SELECT_JOB is not None:
+            SELECT_JOB.cancel()
+        return []
+
     if len(REC.selected_electrodes) == 0:
         return no_data
+    if SELECT_JOB is not None and not SELECT_JOB.finished:
+        return selection_failed("The previous selection is still being "
+                                "read, please wait or cancel it.")
     update_time_window(REC, t_start, t_stop)
-    apply_selection(REC)
+    if REC.full_data() is not None:
+        # a view on the data in memory, which is instant
+        apply_selection(REC)
+        return next_button
+
+    SELECT_JOB = SelectJob(REC)
+
+    return []
+
+
+@app.callback(Output("select-progress", "value"),
+              Output("select-progress", "label"),
+              Output("select-progress-row", "style"),
+              Output("select-output-dummy", "children", allow_duplicate=True),
+              Input("select-interval", "n_intervals"),
+              prevent_initial_call=True)
+def select_progress(_: int) -> tuple:
+    """
+    Used on select screen.
+
+    Polls the selection read in the background, shows its progress and
+            replaces the data matrix of REC by it once it is done.
+
+        @return the progress in percent, its label, the style of the progress
+                bar and a next button or an error message once it finished.
+    """
+    global SELECT_JOB
 
-    return next_button
+    if SELECT_JOB is None:
+        raise PreventUpdate
+
+    finished = SELECT_JOB.poll()
+    percent = 100 * SELECT_JOB.progress()
+    label = (f"{SELECT_JOB.done_bytes / 1024**2:.0f} / "
+             f"{SELECT_JOB.total_bytes / 1024**2:.0f} MiB")
+    style = {"padding": "5px"}
+    if not finished:
+        return percent, label, style, []
+
+    data, info = SELECT_JOB.result, SELECT_JOB.info
+    SELECT_JOB = None
+    if data is None:
+        return percent, "", {"display": "none"}, selection_failed(info)
+
+    adopt_selection(REC, data)
+
+    return percent, "", {"display": "none"}, next_button
 
 
 # ====================== ANALYZE
@@ -331,7 +509,8 @@ def analyze_downsample(_, sampling_rate: str) -> html.Div:
 
     Decimates the signal to contain as many data points as the signal would
             have if it was sampled at rate fs.
-    Uses scipy.signal.decimate, which avoids aliasing.
+    Uses a polyphase anti-aliasing filter, see
+            controllers/analysis/filter.py::downsample.
 
         @param clicked: button to cause the application of the downsampling.
         @param fs: new sampling rate.
@@ -345,24 +524,106 @@ def analyze_downsample(_, sampling_rate: str) -> html.Div:
 
 @app.callback(Output("analyze-linenoise-result", "children"),
               Input("analyze-linenoise-apply", "n_clicks"),
+              State("analyze-linenoise-freq", "value"),
+              State("analyze-linenoise-harmonics", "value"),
               prevent_initial_call=True)
-def analyze_humming(_) -> html.Div:
+def analyze_humming(_, base_freq: int, harmonics: str) -> html.Div:
     """
     Used by preprocessing screen.
 
     Removes noise caused by the electrical system's frequency which is 50 Hz
-            in Europe. I.e. removes the 50 Hz component from the signal
+            in Europe and 60 Hz in North America. I.e. removes that
+            component and its harmonics from the signal
 
         @param clicked: button that causes the fitering to be applied.
+        @param base_freq: the frequency of the power line.
+        @param harmonics: the number of harmonics to remove, 9 if empty.
 
         @return a banner indicating if the filter was applied
     """
-    filter_line_noise(REC)
+    filter_line_noise(REC, base_freq=int(base_freq),
+                      n_harmonics=int(harmonics) if harmonics else 9)
 
     return dbc.Alert("Successfully removed electrical humming",
                      color="success")
 
 
+@app.callback(Output("analyze-chain-result", "children"),
+              Input("analyze-chain-apply", "n_clicks"),
+              State("analyze-chain-stages", "value"),
+              State("analyze-fltr-lower", "value"),
+              State("analyze-fltr-upper", "value"),
+              State("analyze-fltr-type", "value"),
+              State("analyze-linenoise-freq", "value"),
+              State("analyze-linenoise-harmonics", "value"),
+              State("analyze-dwnsmpl-rate", "value"),
+              prevent_initial_call=True)
+def analyze_chain(_,
+                  steps: list[str],
+                  lower: str,
+                  upper: str,
+                  ftype: int,
+                  base_freq: int,
+                  harmonics: str,
+                  sampling_rate: str) -> html.Div:
+    """
+    Used by preprocessing screen.
+
+    Applies the selected steps with the settings of the frequency filter,
+            line noise and downsampling sections in a single pass over the
+            data, see controllers/analysis/preprocess.py
+
+        @param clicked: button that causes the steps to be applied.
+        @param steps: the selected steps, "filter", "linenoise" and
+                "downsample".
+        @param lower: lower pass or stop frequency limit
+        @param upper: higher pass or stop frequency limit.
+        @param ftype:  wether to use a bandpass or a band stop filter.
+        @param base_freq: the frequency of the power line.
+        @param harmonics: the number of harmonics to remove, 9 if empty.
+        @param sampling_rate: the new sampling rate.
+
+        @return a banner indicating if the steps were applied
+    """
+    stages = []
+    if "filter" in steps:
+        stages.append(FrequencyFilter(bool(ftype), float(lower),
+                                      float(upper)))
+    if "linenoise" in steps:
+        stages.append(LineNoiseFilter(int(base_freq),
+                                      int(harmonics) if harmonics else 9))
+    if "downsample" in steps:
+        stages.append(Downsample(int(sampling_rate)))
+    if not stages:
+        return dbc.Alert("No step selected", color="warning")
+
+    Preprocessing(stages).apply(REC)
+
+    return dbc.Alert("Successfully applied the preprocessing chain",
+                     color="success")
+
+
+@app.callback(Output("analyze-undo-result", "children"),
+              Input("analyze-undo-apply", "n_clicks"),
+              prevent_initial_call=True)
+def analyze_undo(_) -> html.Div:
+    """
+    Used by preprocessing screen.
+
+    Reverts the last filter or downsampling step, restoring the data from
+            the snapshot taken before it, see model/data.py::Recording.undo
+
+        @param clicked: button that causes the step to be undone.
+
+        @return a banner naming the reverted step
+    """
+    label = REC.undo()
+    if label is None:
+        return dbc.Alert("Nothing to undo", color="warning")
+
+    return dbc.Alert(f"Reverted the {label}", color="success")
+
+
 # ======== Basics
 @app.callback(Output("channels-table", "children", allow_duplicate=True),
               Input("channels-table-next", "n_clicks"),
@@ -408,7 +669,7 @@ def peaks_table_scroll(next_click, prev_click) -> html.Div:
     if next_click > 0:
         PEAKS_TABLE_START += 100
 
-        if PEAKS_TABLE_START > REC.peaks_df.shape[0]:
+        if PEAKS_TABLE_START > len(REC.peak_table):
             PEAKS_TABLE_START -= 100
 
         next_click = 0
@@ -420,7 +681,7 @@ def peaks_table_scroll(next_click, prev_click) -> html.Div:
 
         prev_click = 0
 
-    return generate_table(REC.peaks_df, PEAKS_TABLE_START)
+    return generate_table(REC.peak_table, PEAKS_TABLE_START)
 
 
 @app.callback(Output("events-table", "children", allow_duplicate=True),
@@ -437,7 +698,7 @@ def events_table_scroll(next_click, prev_click) -> html.Div:
     if next_click > 0:
         EVENTS_TABLE_START += 100
 
-        if EVENTS_TABLE_START > REC.events_df.shape[0]:
+        if EVENTS_TABLE_START > len(REC.event_table):
             EVENTS_TABLE_START -= 100
 
         next_click = 0
@@ -449,7 +710,7 @@ def events_table_scroll(next_click, prev_click) -> html.Div:
 
         prev_click = 0
 
-    return generate_table(REC.events_df, EVENTS_TABLE_START)
+    return generate_table(REC.event_table, EVENTS_TABLE_START)
 
 
 @app.callback(Output("channels-table", "children", allow_duplicate=True),
@@ -597,7 +858,7 @@ def analyze_peaks(_,
 
     detect_peaks(REC, mad_win, env_win, env_percentile, mad_thrsh, env_thrsh)
 
-    return generate_table(REC.channels_df), generate_table(REC.peaks_df)
+    return generate_table(REC.channels_df), generate_table(REC.peak_table)
 
 
 @app.callback(Output("channels-table", "children", allow_duplicate=True),
@@ -625,8 +886,8 @@ def analyze_events(_,
 
     detect_events(REC, mad_win, env_percentile, mad_thrsh)
 
-    return (generate_table(REC.channels_df), generate_table(REC.peaks_df),
-            generate_table(REC.events_df))
+    return (generate_table(REC.channels_df), generate_table(REC.peak_table),
+            generate_table(REC.event_table))
 
 
 # ======== Network
@@ -768,9 +1029,9 @@ def analyze_plot_time_series(_: int, to_plot: list[int]) -> None:
     thresh = TimeSeriesPlottable.THRESH.value in to_plot
     selected = True
 
-    if peaks and REC.peaks_df is None:
+    if peaks and REC.peaks is None:
         detect_peaks(REC)
-    if events and REC.events_df is None:
+    if events and REC.events is None:
         detect_events(REC)
 
     plot_time_series_grid(REC, selected, signals, peaks, events,
@@ -844,10 +1105,10 @@ def analyze_export(_: int, path: str) -> html.Div:
 
     if REC.channels_df is not None:
         REC.channels_df.to_csv(path + "_channels.csv")
-    if REC.peaks_df is not None:
-        REC.peaks_df.to_csv(path + "_peaks.csv")
-    if REC.events_df is not None:
-        REC.events_df.to_csv(path + "_events.csv")
+    if REC.peak_table is not None:
+        REC.peak_table.to_frame().to_csv(path + "_peaks.csv")
+    if REC.event_table is not None:
+        REC.event_table.to_frame().to_csv(path + "_events.csv")
 
     return dbc.Alert("Successfully exported results", color="success")
 
@@ -887,8 +1148,11 @@ def analyze_export(_: int, path: str) -> html.Div:
 
 if __name__ == "__main__":
     print("LFP Toolbox")
+    print(IMPORT_TIMER.report())
     mp.set_start_method('spawn')
     pd.set_eng_float_format(accuracy=1)
+    # warm up Qt, such that the first plot opens instantly
+    PLOT_SERVER.start()
 
     HOST = "localhost"
     PORT = 8080